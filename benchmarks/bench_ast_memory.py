@@ -0,0 +1,74 @@
+"""Retained-memory benchmark: parsed ASTs for a whole corpus held in memory.
+
+Usage:
+  PYTHONPATH=src python benchmarks/bench_ast_memory.py [--queries 10000]
+
+Parses a generated corpus of small, typical queries (source + timeSeries, then
+filter/eval/join/merge/switch/fork/group/sort/limit stages) and keeps every `Query`
+alive, as a linter or cache would. Reports the tracemalloc size retained by the ASTs
+(the DSL text itself is excluded) and the number of objects tracked by the GC.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from aggdsl import parse
+
+
+def make_query(i: int) -> str:
+    return f"""\
+FROM event([source=pageEvents,appId={i},blacklist="apply"])
+TIMESERIES period=dayRange first=now() count=-30
+| identified visitorId
+| filter pageId == "page{i}" && numEvents > {i % 7}
+| eval {{ day=startOfPeriod("dayRange", day), score=numEvents * {i % 5} }}
+| switch bucket from score {{ "1"=="low", "2"=="mid", "3"=="high" }}
+| merge fields [visitorId] mappings {{ accountId=metadata.auto.accountid }}
+  FROM event([source=visitors,appId={i}])
+  TIMESERIES period=dayRange first=now() count=-30
+  | select {{ visitorId=visitorId, lastVisit=metadata.auto.lastvisit }}
+endmerge
+| fork
+  | branch
+  || group by visitorId fields {{ events=sum(numEvents), minutes=sum(numMinutes) }}
+  | endbranch
+  | branch
+  || join fields [visitorId, accountId]
+  | endbranch
+| endfork
+| sort -events,visitorId
+| limit {100 + i % 50}
+"""
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--queries", type=int, default=10000)
+    args = p.parse_args(argv)
+
+    corpus = [make_query(i) for i in range(args.queries)]
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    asts = [parse(text) for text in corpus]
+    elapsed = time.perf_counter() - t0
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    objects = len(gc.get_objects()) - objects_before
+
+    print(
+        f"queries={len(asts)} parse={elapsed:6.2f}s retained={retained / 1e6:7.2f}MB "
+        f"({retained / len(asts):7.0f} B/query) peak={peak / 1e6:7.2f}MB "
+        f"gc_objects={objects} ({objects / len(asts):.1f}/query)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
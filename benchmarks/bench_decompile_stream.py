@@ -0,0 +1,89 @@
+"""Peak-memory and time benchmark: json.load + decompile vs the streaming decompiler.
+
+Usage:
+  PYTHONPATH=src python benchmarks/bench_decompile_stream.py [--rows 20000 200000]
+
+The input is an export with an inline `bulkExpand` of `--rows` rows and a fork whose
+branches carry the same data, written to a temporary file. Both paths write the same
+DSL to a discarding sink. Time is measured without tracing; peak memory is the
+tracemalloc high-water mark of a second, traced run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from aggdsl import decompile_json_stream, decompile_pendo_aggregation_to_dsl
+
+
+class _NullSink(io.TextIOBase):
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s) -> int:  # type: ignore[override]
+        return len(s)
+
+
+def make_export(rows: int) -> dict:
+    data = {"account": {"ids": [{"id": f"acct-{i}", "score": i * 0.5} for i in range(rows)]}}
+    pipeline = [
+        {"source": {"events": None}, "timeSeries": {"period": "dayRange", "first": "now()", "count": -30}},
+        {"bulkExpand": data},
+        {"fork": [[{"bulkExpand": data}, {"limit": 10}], [{"filter": "numEvents > 0"}]]},
+        {"group": {"group": ["accountId"], "fields": [{"n": {"count": None}}]}},
+    ]
+    return {"response": {"mimeType": "application/json"}, "request": {"name": "Export", "pipeline": pipeline}}
+
+
+def _load_path(path: str) -> None:
+    with open(path, encoding="utf-8") as f:
+        _NullSink().write(decompile_pendo_aggregation_to_dsl(json.load(f)))
+
+
+def _stream_path(path: str) -> None:
+    with open(path, encoding="utf-8") as f:
+        decompile_json_stream(f, _NullSink())
+
+
+def _measure(fn, path: str) -> tuple[float, float]:
+    # tracemalloc slows down allocation-heavy code unevenly, so time an untraced run.
+    t0 = time.perf_counter()
+    fn(path)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    fn(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", type=int, nargs="+", default=[20000, 200000])
+    args = p.parse_args(argv)
+
+    for n in args.rows:
+        fd, path = tempfile.mkstemp(suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(make_export(n), f, indent=2)
+            size = os.path.getsize(path) / 1e6
+            for label, fn in (("load", _load_path), ("stream", _stream_path)):
+                elapsed, peak = _measure(fn, path)
+                print(
+                    f"rows={n:7d} file={size:7.1f}MB {label:6s} "
+                    f"time={elapsed * 1000:9.2f}ms peak={peak:8.2f}MB"
+                )
+        finally:
+            os.unlink(path)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,83 @@
+"""Per-stage parse/compile/decompile cost by stage kind.
+
+Usage:
+  PYTHONPATH=src python benchmarks/bench_dispatch.py [--stages 5000] [--repeat 9]
+
+For each kind, `--stages` stages of that kind are parsed, compiled and decompiled one
+by one; the best-of-N time per stage is reported. With dispatch by
+kind the cost should not depend on where a kind used to sit in an if-chain: `group`,
+`sort` and `limit` should cost about the same as `filter`, apart from the work the
+stage itself does.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from aggdsl.compiler import _compile_stage
+from aggdsl.decompiler import _decompile_stage
+from aggdsl.lexer import Line
+from aggdsl.parser import _parse_stage
+
+# One cheap stage line per kind, in the order the old if-chains tested them.
+STAGES = {
+    "filter": "filter x",
+    "identified": "identified visitorId",
+    "eval": "eval { a=b }",
+    "select": "select { a=b }",
+    "join": "join fields [a]",
+    "switch": 'switch o from f { "1"=="a" }',
+    "unmarshal": "unmarshal { a=b }",
+    "unwind": "unwind { field=a }",
+    "segment": 'segment id="s"',
+    "bulkExpand": 'bulkExpand {"a":1}',
+    "sessionReplays": 'sessionReplays {"a":1}',
+    "pes": 'pes {"a":1}',
+    "raw": 'raw {"a":1}',
+    "limit": "limit 1",
+    "sort": "sort a",
+    "group": "group by a fields { n=count(null) }",
+}
+
+
+def _time(fn, items) -> float:
+    t0 = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - t0) / len(items)
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--stages", type=int, default=5000)
+    p.add_argument("--repeat", type=int, default=9)
+    args = p.parse_args(argv)
+
+    phases = {}
+    for kind, text in STAGES.items():
+        spans = [Line(text, i).span() for i in range(args.stages)]
+        stages = [_parse_stage(span) for span in spans]
+        bodies = [_compile_stage(stage, now_ms=None) for stage in stages]
+        phases[kind] = (
+            (_parse_stage, spans),
+            (lambda s: _compile_stage(s, now_ms=None), stages),
+            (lambda b: _decompile_stage(b, prefix="|"), bodies),
+        )
+
+    # Kinds are interleaved within each repeat so that drift in machine speed affects
+    # them alike; the best time per kind and phase is kept.
+    best = {kind: [float("inf")] * 3 for kind in STAGES}
+    for _ in range(args.repeat):
+        for kind, runs in phases.items():
+            for i, (fn, items) in enumerate(runs):
+                best[kind][i] = min(best[kind][i], _time(fn, items))
+
+    print(f"{'kind':16s} {'parse':>10s} {'compile':>10s} {'decompile':>10s}  (ns/stage)")
+    for kind, (parse_s, compile_s, decompile_s) in best.items():
+        print(f"{kind:16s} {parse_s * 1e9:10.0f} {compile_s * 1e9:10.0f} {decompile_s * 1e9:10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
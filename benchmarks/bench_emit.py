@@ -0,0 +1,67 @@
+"""Peak-memory and time benchmark: compile + json.dump vs the streaming emitter.
+
+Usage:
+  PYTHONPATH=src python benchmarks/bench_emit.py [--stages 2000 20000] [--indent 2]
+
+Both paths write the same bytes to a discarding binary sink; peak memory is the
+tracemalloc high-water mark while serializing an already parsed `Query`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import time
+import tracemalloc
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.emit import write_body
+
+from bench_parse import make_dsl
+
+
+class _NullSink(io.RawIOBase):
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:  # type: ignore[override]
+        return len(b)
+
+
+def _dict_path(query, indent):
+    body = compile_to_pendo_aggregation(query)
+    _NullSink().write(json.dumps(body, indent=indent, ensure_ascii=False).encode("utf-8"))
+
+
+def _stream_path(query, indent):
+    write_body(query, _NullSink(), indent=indent)
+
+
+def _measure(fn, query, indent) -> tuple[float, float]:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(query, indent)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--stages", type=int, nargs="+", default=[2000, 20000])
+    p.add_argument("--indent", type=int, default=2)
+    args = p.parse_args(argv)
+    indent = args.indent if args.indent > 0 else None
+
+    for n in args.stages:
+        query = parse(make_dsl(n))
+        for label, fn in (("dict+dumps", _dict_path), ("stream", _stream_path)):
+            elapsed, peak = _measure(fn, query, indent)
+            print(f"stages={n:6d} {label:10s} time={elapsed * 1000:9.2f}ms peak={peak:8.2f}MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+"""Latency benchmark: one urllib connection per request vs the keep-alive pool.
+
+Usage:
+  PYTHONPATH=src:. python benchmarks/bench_http_pool.py [--requests 300] [--connect-delay-ms 20]
+
+A local HTTP/1.1 server stands in for the Pendo aggregation endpoint. Each new
+connection waits `--connect-delay-ms` before its first response, standing in for
+the TCP and TLS handshakes a remote HTTPS endpoint costs; `--query-ms` is the
+time spent per request once connected.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tools.pendo.http_pool import HttpPool
+
+_PAYLOAD = {"response": {"mimeType": "application/json"}, "request": {"pipeline": [{"source": {"events": None}}]}}
+_RESPONSE = json.dumps({"results": [{"visitorId": "v1", "count": 3}]}).encode("utf-8")
+
+
+def _make_handler(connect_delay: float, query_delay: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self) -> None:
+            super().setup()
+            time.sleep(connect_delay)
+
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(query_delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(_RESPONSE)))
+            self.end_headers()
+            self.wfile.write(_RESPONSE)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    return Handler
+
+
+def _urllib_post(url: str) -> None:
+    req = urllib.request.Request(url, data=json.dumps(_PAYLOAD).encode("utf-8"), method="POST")
+    req.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        json.loads(resp.read())
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--requests", type=int, default=300)
+    p.add_argument("--connect-delay-ms", type=float, default=20.0)
+    p.add_argument("--query-ms", type=float, default=2.0)
+    args = p.parse_args(argv)
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), _make_handler(args.connect_delay_ms / 1000, args.query_ms / 1000)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/v1/aggregation"
+
+    try:
+        t0 = time.perf_counter()
+        for _ in range(args.requests):
+            _urllib_post(url)
+        fresh = time.perf_counter() - t0
+
+        with HttpPool() as pool:
+            t0 = time.perf_counter()
+            for _ in range(args.requests):
+                pool.post_json(url, _PAYLOAD)
+            pooled = time.perf_counter() - t0
+            opened = pool.connections_opened
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    n = args.requests
+    print(f"urllib    {n} requests  {fresh:7.2f}s  {fresh / n * 1000:7.2f} ms/request  {n} connections")
+    print(f"pool      {n} requests  {pooled:7.2f}s  {pooled / n * 1000:7.2f} ms/request  {opened} connections")
+    print(f"speedup   {fresh / pooled:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,117 @@
+"""Parse-time benchmark on large generated DSL documents.
+
+Usage:
+  PYTHONPATH=src python benchmarks/bench_parse.py [--stages 200 1000 5000] [--repeat 5]
+  PYTHONPATH=src python benchmarks/bench_parse.py --depth 10 50 100
+  PYTHONPATH=src python benchmarks/bench_parse.py --payload-lines 1000 5000 20000
+
+Reports the best-of-N wall time for `aggdsl.parse` per document size. With `--depth`,
+documents are nested fork blocks of the given depth instead; with `--payload-lines`,
+they hold multiline raw/bulkExpand/sessionReplays/fork JSON payloads and a multiline
+group block of about that many lines each.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from aggdsl import parse
+
+
+def make_dsl(n_stages: int) -> str:
+    lines = [
+        "RESPONSE mimeType=application/json",
+        'REQUEST name="Bench"',
+        "FROM event([source=pageEvents,appId=-323232,blacklist=\"apply\"])",
+        "TIMESERIES period=dayRange first=date(2024, 1, 1, 0, 0, 0) last=date(2024, 12, 31, 23, 59, 59)",
+    ]
+    for i in range(n_stages):
+        k = i % 5
+        if k == 0:
+            lines.append(f'| filter pageId == "p{i}" && !isNull(parameters.value) && count > {i}')
+        elif k == 1:
+            lines.append(
+                "| eval { "
+                + ", ".join(f'f{i}_{j}=if(isNull(a{j}), "x, y", concat(a{j}, b{j}))' for j in range(8))
+                + " }"
+            )
+        elif k == 2:
+            lines.append(
+                "| select { " + ", ".join(f'"col{j}"=field{j}' for j in range(12)) + " }"
+            )
+        elif k == 3:
+            lines.append(
+                f"| group by visitorId,accountId fields {{ "
+                + ", ".join(f"s{j}=sum(numEvents{j})" for j in range(6))
+                + ", info=inactivityPeriods({ start=recordingStartTime, end=recordingEndTime }) }"
+            )
+        else:
+            lines.append(
+                f'| switch out{i} from pollResponse {{ "1"=="promoter", "2"=="passive", "3"=="detractor" }}'
+            )
+    return "\n".join(lines) + "\n"
+
+
+def make_nested_dsl(depth: int, stages_per_level: int = 20) -> str:
+    """Nest fork blocks `depth` levels deep, each branch ending in a merge block."""
+    lines = ["PIPELINE"]
+    prefix = "|"
+    for level in range(depth):
+        lines.extend(f"{prefix} filter level{level} != {i}" for i in range(stages_per_level))
+        lines.extend([f"{prefix} fork", "branch"])
+        prefix = "||"
+    lines.extend(["|| merge fields [visitorId]", "PIPELINE", "| limit 1", "endmerge"])
+    for _ in range(depth):
+        lines.extend(["endbranch", "endfork"])
+    return "\n".join(lines) + "\n"
+
+
+def make_payload_dsl(n_lines: int) -> str:
+    """Large inline JSON payloads spread over `n_lines` lines per stage."""
+    items = [f'  "k{i}": {{"v": [{i}, "a\\"{{b}}", null], "s": "x,]y"}},' for i in range(n_lines)]
+    items[-1] = items[-1].rstrip(",")
+    obj = ["{", *items, "}"]
+    arr = ["[", *(f'  [{{"limit": {i}}}],' for i in range(n_lines)), '  [{"limit": 0}]', "]"]
+    group = ["| group by visitorId fields {"]
+    group.extend(f"  s{i}=sum(n{i})," for i in range(n_lines))
+    group.append("  last=count(null) }")
+
+    lines = ["PIPELINE"]
+    for stage in ("raw", "bulkExpand", "sessionReplays"):
+        lines.append(f"| {stage} {obj[0]}")
+        lines.extend(obj[1:])
+    lines.append(f"| fork {arr[0]}")
+    lines.extend(arr[1:])
+    lines.extend(group)
+    return "\n".join(lines) + "\n"
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--stages", type=int, nargs="+", default=[200, 1000, 5000])
+    p.add_argument("--depth", type=int, nargs="+", default=None)
+    p.add_argument("--payload-lines", type=int, nargs="+", default=None)
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args(argv)
+
+    if args.depth:
+        cases = [(f"depth={d:6d}", make_nested_dsl(d)) for d in args.depth]
+    elif args.payload_lines:
+        cases = [(f"payload={n:6d}", make_payload_dsl(n)) for n in args.payload_lines]
+    else:
+        cases = [(f"stages={n:6d}", make_dsl(n)) for n in args.stages]
+
+    for label, dsl in cases:
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            parse(dsl)
+            best = min(best, time.perf_counter() - t0)
+        mb = len(dsl.encode("utf-8")) / 1e6
+        print(f"{label} size={mb:7.2f}MB best={best * 1000:9.2f}ms {mb / best:7.2f}MB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
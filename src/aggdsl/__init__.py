@@ -1,15 +1,37 @@
 __all__ = [
 	"parse",
+	"parse_documents",
 	"compile_to_pendo_aggregation",
 	"compile_to_pendo_aggregation_with_format",
 	"compile_pipeline",
 	"decompile_pendo_aggregation_to_dsl",
+	"decompile_to_stream",
+	"decompile_json_stream",
+	"CompileCache",
+	"compile_stream",
+	"compile_template",
+	"Template",
+	"estimate_cost",
+	"explain",
+	"parse_expression",
+	"format_expression",
+	"register_stage",
+	"unregister_stage",
+	"__version__",
 ]
 
-from .parser import parse
+from ._version import __version__
+from .parser import parse, parse_documents
 from .compiler import (
 	compile_pipeline,
 	compile_to_pendo_aggregation,
 	compile_to_pendo_aggregation_with_format,
 )
-from .decompiler import decompile_pendo_aggregation_to_dsl
+from .decompiler import decompile_pendo_aggregation_to_dsl, decompile_to_stream
+from .decompile_stream import decompile_json_stream
+from .cache import CompileCache
+from .stream import compile_stream
+from .template import Template, compile_template
+from .cost import estimate_cost, explain
+from .expr import format_expression, parse_expression
+from .stages import register_stage, unregister_stage
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+try:
+    from ._version import __version__
+    from .compiler import compile_to_pendo_aggregation
+    from .dsl_ast import Branches, Query
+    from .parser import parse
+except ImportError:  # pragma: no cover
+    from _version import __version__  # type: ignore
+    from compiler import compile_to_pendo_aggregation  # type: ignore
+    from dsl_ast import Branches, Query  # type: ignore
+    from parser import parse  # type: ignore
+
+
+# A path from the body root to a `timeSeries` object whose `first`/`last` is `now()`.
+_NowSlot = tuple[tuple[Any, ...], str]
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
+class _Entry:
+    __slots__ = ("query", "body", "now_slots")
+
+    def __init__(self, query: Query) -> None:
+        self.query = query
+        # Compiled with `now_ms=None`, i.e. with literal "now()" values left in place.
+        self.body: dict[str, Any] | None = None
+        self.now_slots: list[_NowSlot] = []
+
+
+class CompileCache:
+    """Opt-in, content-addressed cache for `parse` and `compile_to_pendo_aggregation`.
+
+    Entries are keyed by a hash of the DSL text and the aggdsl version, and evicted in
+    least-recently-used order once `maxsize` documents are cached. The compiled body is
+    cached without `now()` resolution, so compiling the same DSL with a different
+    `now_ms` only copies the few objects that hold a resolved time.
+
+    Returned values share structure with the cache and must be treated as read-only.
+    Parse errors are not cached.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def parse(self, dsl: str) -> Query:
+        return self._entry(dsl).query
+
+    def compile(self, dsl: str, *, now_ms: int | None = None) -> dict[str, Any]:
+        entry = self._entry(dsl)
+        body = entry.body
+        if body is None:
+            body, entry.now_slots = _compile_template(entry.query)
+            entry.body = body
+        if now_ms is None or not entry.now_slots:
+            return body
+        return _resolve_now(body, entry.now_slots, now_ms)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                size=len(self._entries),
+                maxsize=self.maxsize,
+            )
+
+    def clear(self) -> None:
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _entry(self, dsl: str) -> _Entry:
+        key = cache_key(dsl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+            self._misses += 1
+
+        # Parse outside the lock; a concurrent miss on the same key parses twice and
+        # the last writer wins, which is harmless.
+        entry = _Entry(parse(dsl))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return entry
+
+
+class DiskCache:
+    """Persistent compile cache shared between processes (e.g. CLI runs in CI).
+
+    Each entry is one JSON file holding the compiled body (with `now()` unresolved)
+    and the locations of its `now()` slots, keyed by the DSL text, the aggdsl version
+    and the compile options. Files are written atomically (temp file + `os.replace`),
+    so concurrent writers never expose partial entries. Entries live in 16 shard
+    directories; when a write pushes a shard over its share of `max_bytes`, the least
+    recently used files of that shard are deleted.
+
+    Cache I/O failures and unreadable entries are treated as misses, never as errors.
+    """
+
+    _SHARDS = "0123456789abcdef"
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str] | None = None,
+        *,
+        max_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be >= 1")
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def compile(self, dsl: str, *, now_ms: int | None = None) -> dict[str, Any]:
+        path = self._path(cache_key(dsl, "body", "request_format=object"))
+        cached = self._load(path)
+        if cached is None:
+            body, slots = _compile_template(parse(dsl))
+            self._store(path, body, slots)
+        else:
+            body, slots = cached
+        if now_ms is None or not slots:
+            return body
+        return _resolve_now(body, slots, now_ms)
+
+    def clear(self) -> None:
+        for shard in self._SHARDS:
+            for entry in _scan_shard(self.directory / shard):
+                _unlink(entry.path)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[0] / f"{key}.json"
+
+    def _load(self, path: Path) -> tuple[dict[str, Any], list[_NowSlot]] | None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            body = data["body"]
+            slots = [(tuple(p), str(field)) for p, field in data["now_slots"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        try:
+            # Refresh the access time used for eviction.
+            os.utime(path)
+        except OSError:
+            pass
+        return body, slots
+
+    def _store(self, path: Path, body: dict[str, Any], slots: list[_NowSlot]) -> None:
+        data = {"body": body, "now_slots": [[list(p), field] for p, field in slots]}
+        # `json.dumps` uses the C encoder; `json.dump` streams through the Python one.
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        tmp_name: str | None = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=path.parent, suffix=".tmp", delete=False
+            ) as f:
+                tmp_name = f.name
+                f.write(payload)
+            os.replace(tmp_name, path)
+            tmp_name = None
+            self._prune(path.parent)
+        except OSError:
+            pass
+        finally:
+            if tmp_name is not None:
+                _unlink(Path(tmp_name))
+
+    def _prune(self, shard: Path) -> None:
+        limit = self.max_bytes // len(self._SHARDS)
+        entries = []
+        total = 0
+        for entry in _scan_shard(shard):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        if total <= limit:
+            return
+        entries.sort()
+        for _, size, name in entries:
+            if total <= limit:
+                break
+            _unlink(Path(name))
+            total -= size
+
+
+def default_cache_dir() -> Path:
+    """`$AGGDSL_CACHE_DIR`, else `$XDG_CACHE_HOME/aggdsl`, else `~/.cache/aggdsl`."""
+    explicit = os.environ.get("AGGDSL_CACHE_DIR")
+    if explicit:
+        return Path(explicit)
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "aggdsl"
+
+
+def _scan_shard(shard: Path) -> list[os.DirEntry[str]]:
+    try:
+        with os.scandir(shard) as it:
+            return [e for e in it if e.name.endswith(".json") and e.is_file()]
+    except OSError:
+        return []
+
+
+def _unlink(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+def cache_key(dsl: str, *options: str) -> str:
+    """Content address of a DSL document for this aggdsl version and compile options."""
+    h = hashlib.sha256(__version__.encode("utf-8"))
+    for part in options:
+        h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    h.update(b"\0\0")
+    h.update(dsl.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _compile_template(query: Query) -> tuple[dict[str, Any], list[_NowSlot]]:
+    """Compile with `now()` left unresolved, plus the locations to fill in later."""
+    return compile_to_pendo_aggregation(query), _find_now_slots(query)
+
+
+def _find_now_slots(query: Query) -> list[_NowSlot]:
+    slots: list[_NowSlot] = []
+    _collect_now_slots(query, ("request", "pipeline"), slots)
+    return slots
+
+
+def _collect_now_slots(query: Query, path: tuple[Any, ...], slots: list[_NowSlot]) -> None:
+    # Mirrors the layout produced by `compile_pipeline`.
+    offset = 0
+    if query.event_source is not None:
+        offset = 1
+        ts = query.time_series
+        if ts is not None:
+            ts_path = (*path, 0, "source", "timeSeries")
+            if ts.first == "now()":
+                slots.append((ts_path, "first"))
+            if ts.last == "now()":
+                slots.append((ts_path, "last"))
+
+    for i, stage in enumerate(query.stages, start=offset):
+        if stage.kind == "merge":
+            _collect_now_slots(stage.payload.query, (*path, i, "merge", "pipeline"), slots)
+        elif stage.kind in ("fork", "spawn") and isinstance(stage.payload, Branches):
+            for j, branch in enumerate(stage.payload):
+                _collect_now_slots(branch, (*path, i, stage.kind, j), slots)
+
+
+def _resolve_now(body: dict[str, Any], slots: list[_NowSlot], now_ms: int) -> dict[str, Any]:
+    """Return `body` with `now()` slots set to `now_ms`, copying only the touched path."""
+    root: dict[str, Any] = dict(body)
+    copied: set[tuple[Any, ...]] = {()}
+    for path, field in slots:
+        node: Any = root
+        for depth, key in enumerate(path, start=1):
+            child = node[key]
+            if path[:depth] not in copied:
+                child = dict(child) if isinstance(child, dict) else list(child)
+                node[key] = child
+                copied.add(path[:depth])
+            node = child
+        node[field] = now_ms
+    return root
@@ -1,12 +1,26 @@
 from __future__ import annotations
 
 import argparse
+import glob
 import json
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable
 
+from .cache import CompileCache, DiskCache
 from .compiler import compile_to_pendo_aggregation
-from .decompiler import decompile_pendo_aggregation_to_dsl
-from .parser import DslParseError, parse
+from .cost import estimate_cost, format_estimate
+from .decompile_stream import decompile_json_stream
+from .dsl_ast import Query
+from .emit import dumps, iter_body, iter_dumps
+from .fold import FoldError, fold_constants, resolve_timezone
+from .optimize import optimize as optimize_query
+from .parser import DslParseError, parse, parse_documents
+from .roundtrip import RoundTripError, roundtrip_body
+from .stream import compile_stream
 
 
 def main(argv: list[str] | None = None) -> int:
@@ -14,29 +28,166 @@ def main(argv: list[str] | None = None) -> int:
     sub = parser.add_subparsers(dest="cmd", required=True)
 
     compile_p = sub.add_parser("compile", help="Compile DSL to Pendo Aggregation JSON")
-    compile_p.add_argument("path", help="Path to a .dsl file")
+    compile_p.add_argument(
+        "paths",
+        nargs="*",
+        metavar="path",
+        help="Path to a .dsl file; several files, directories or globs compile in batch mode",
+    )
+    compile_p.add_argument(
+        "--jsonl",
+        action="store_true",
+        help='Read {"id","dsl"} JSON Lines from the path (or stdin) and write '
+        '{"id","body"} / {"id","error"} lines',
+    )
+    compile_p.add_argument(
+        "--documents",
+        choices=["array", "jsonl"],
+        default=None,
+        help="Compile every '---'-separated document in one file into a JSON array "
+        "or one JSON body per line",
+    )
     compile_p.add_argument(
         "--now-ms",
         type=int,
         default=None,
         help="Override current time in epoch ms (useful for deterministic compilation)",
     )
+    compile_p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the on-disk compile cache",
+    )
+    compile_p.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Compile cache directory (default: $AGGDSL_CACHE_DIR or ~/.cache/aggdsl)",
+    )
+    compile_p.add_argument(
+        "--raw-passthrough",
+        action="store_true",
+        help="Validate JSON payload stages (raw, bulkExpand, ...) but copy their source "
+        "text into the output instead of re-serializing it (implies --no-cache)",
+    )
+    compile_p.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Merge adjacent filters, move filters ahead of independent eval/select "
+        "stages, drop sorts before groups and collapse limits (bypasses the disk cache)",
+    )
+    compile_p.add_argument(
+        "--explain-optimizations",
+        action="store_true",
+        help="Like --optimize, and list each rewrite on stderr",
+    )
+    compile_p.add_argument(
+        "--fold-constants",
+        action="store_true",
+        help="Evaluate constant arithmetic, now() (with --now-ms) and date(...) (with "
+        "--timezone) to epoch-ms integers (bypasses the disk cache)",
+    )
+    compile_p.add_argument(
+        "--timezone",
+        default=None,
+        help="--fold-constants: IANA time zone of the subscription, used to fold date(...)",
+    )
+    compile_p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Batch mode: number of worker processes (default: CPU count)",
+    )
+    compile_p.add_argument(
+        "--out-dir",
+        default=None,
+        help="Batch mode: write <name>.json files here instead of next to the inputs",
+    )
+    compile_p.add_argument(
+        "--check",
+        action="store_true",
+        help="Batch mode: only report which files compile; write no output files",
+    )
 
     decompile_p = sub.add_parser(
         "decompile", help="Translate Pendo Aggregation JSON to aggdsl DSL"
     )
     decompile_p.add_argument("path", help="Path to a .json file")
 
+    explain_p = sub.add_parser(
+        "explain", help="Print the stage tree of a DSL file with a static cost estimate"
+    )
+    explain_p.add_argument("path", help="Path to a .dsl file")
+    explain_p.add_argument(
+        "--max-cost",
+        type=float,
+        default=None,
+        help="Exit with status 1 when the estimated cost exceeds this budget",
+    )
+
+    roundtrip_p = sub.add_parser(
+        "roundtrip",
+        help="Check that decompile -> parse -> compile reproduces each JSON body",
+    )
+    roundtrip_p.add_argument(
+        "paths",
+        nargs="+",
+        metavar="path",
+        help="JSON files, directories (searched recursively for *.json) or globs",
+    )
+    roundtrip_p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: CPU count)",
+    )
+
     args = parser.parse_args(argv)
 
     if args.cmd == "compile":
+        args.optimize = args.optimize or args.explain_optimizations
+        if args.timezone is not None:
+            if not args.fold_constants:
+                parser.error("--timezone requires --fold-constants")
+            try:
+                resolve_timezone(args.timezone)
+            except FoldError as e:
+                parser.error(str(e))
+        if args.jsonl:
+            if args.optimize or args.fold_constants:
+                parser.error("--optimize and --fold-constants are not supported with --jsonl")
+            if len(args.paths) > 1:
+                parser.error("--jsonl takes at most one input path")
+            return _compile_jsonl(args)
+        if not args.paths:
+            parser.error("compile requires at least one path")
+        if args.documents is not None:
+            if len(args.paths) > 1:
+                parser.error("--documents takes a single input path")
+            return _compile_documents(args)
+        if _is_batch(args):
+            if args.explain_optimizations:
+                parser.error("--explain-optimizations takes a single input path")
+            return _compile_batch(args)
         try:
-            with open(args.path, "r", encoding="utf-8") as f:
+            with open(args.paths[0], "r", encoding="utf-8") as f:
                 dsl = f.read()
-            q = parse(dsl)
-            body = compile_to_pendo_aggregation(q, now_ms=args.now_ms)
-            json.dump(body, sys.stdout, indent=2, sort_keys=False, ensure_ascii=False)
-            sys.stdout.write("\n")
+            chunks = _compile_chunks(
+                dsl,
+                now_ms=args.now_ms,
+                cache_dir=args.cache_dir,
+                no_cache=args.no_cache,
+                raw_text=args.raw_passthrough,
+                optimize=args.optimize,
+                explain=args.explain_optimizations,
+                fold=args.fold_constants,
+                timezone=args.timezone,
+            )
+            write = sys.stdout.write
+            for chunk in chunks:
+                write(chunk)
+            write("\n")
             return 0
         except (OSError, DslParseError, ValueError) as e:
             print(f"error: {e}", file=sys.stderr)
@@ -44,13 +195,392 @@ def main(argv: list[str] | None = None) -> int:
 
     if args.cmd == "decompile":
         try:
+            # Streamed, so large exports decompile in bounded memory.
             with open(args.path, "r", encoding="utf-8") as f:
-                body = json.load(f)
-            dsl = decompile_pendo_aggregation_to_dsl(body)
-            sys.stdout.write(dsl)
+                decompile_json_stream(f, sys.stdout)
             return 0
-        except (OSError, json.JSONDecodeError, ValueError) as e:
+        except (OSError, ValueError) as e:
             print(f"error: {e}", file=sys.stderr)
             return 2
 
+    if args.cmd == "explain":
+        try:
+            with open(args.path, "r", encoding="utf-8") as f:
+                estimate = estimate_cost(parse(f.read()))
+        except (OSError, DslParseError, ValueError) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        sys.stdout.write(format_estimate(estimate))
+        if args.max_cost is not None and estimate.cost > args.max_cost:
+            print(
+                f"error: estimated cost {estimate.cost:.0f} exceeds --max-cost {args.max_cost:.0f}",
+                file=sys.stderr,
+            )
+            return 1
+        return 0
+
+    if args.cmd == "roundtrip":
+        return _roundtrip(args)
+
     return 1
+
+
+def _compile_text(
+    dsl: str,
+    *,
+    now_ms: int | None,
+    cache_dir: str | None,
+    no_cache: bool,
+    raw_text: bool = False,
+    optimize: bool = False,
+    fold: bool = False,
+    timezone: str | None = None,
+) -> dict[str, Any]:
+    if no_cache or raw_text or optimize or fold:
+        query = _parse(
+            dsl, raw_text=raw_text, optimize=optimize, fold=fold, now_ms=now_ms, timezone=timezone
+        )
+        return compile_to_pendo_aggregation(query, now_ms=now_ms)
+    return DiskCache(cache_dir).compile(dsl, now_ms=now_ms)
+
+
+def _compile_chunks(
+    dsl: str,
+    *,
+    now_ms: int | None,
+    cache_dir: str | None,
+    no_cache: bool,
+    raw_text: bool = False,
+    optimize: bool = False,
+    explain: bool = False,
+    fold: bool = False,
+    timezone: str | None = None,
+) -> Iterable[str]:
+    """Pretty-printed body text for `dsl`.
+
+    Without the disk cache the body is streamed by `iter_body` instead of being built in
+    memory first; a cached body is serialized stage by stage by `iter_dumps`. Parse
+    errors are still raised before any chunk is produced.
+    """
+    if no_cache or raw_text or optimize or fold:
+        query = _parse(
+            dsl,
+            raw_text=raw_text,
+            optimize=optimize,
+            explain=explain,
+            fold=fold,
+            now_ms=now_ms,
+            timezone=timezone,
+        )
+        return iter_body(query, now_ms=now_ms, indent=2)
+    return iter_dumps(DiskCache(cache_dir).compile(dsl, now_ms=now_ms), indent=2)
+
+
+def _parse(
+    dsl: str,
+    *,
+    raw_text: bool,
+    optimize: bool,
+    explain: bool = False,
+    fold: bool = False,
+    now_ms: int | None = None,
+    timezone: str | None = None,
+) -> Query:
+    query = parse(dsl, raw_text=raw_text)
+    if fold:
+        query = _fold(query, now_ms=now_ms, timezone=timezone, explain=explain)
+    return _optimize(query, explain=explain) if optimize else query
+
+
+def _fold(
+    query: Query, *, now_ms: int | None, timezone: str | None, explain: bool, label: str = ""
+) -> Query:
+    # Folding runs before the optimizer so merged filters see the folded text.
+    query, folds = fold_constants(query, now_ms=now_ms, timezone=timezone)
+    if explain:
+        print(f"{label}constants folded: {len(folds)}", file=sys.stderr)
+        for fold in folds:
+            print(f"  {fold}", file=sys.stderr)
+    return query
+
+
+def _optimize(query: Query, *, explain: bool, label: str = "") -> Query:
+    query, rewrites = optimize_query(query)
+    if explain:
+        print(f"{label}optimizations applied: {len(rewrites)}", file=sys.stderr)
+        for rewrite in rewrites:
+            print(f"  {rewrite}", file=sys.stderr)
+    return query
+
+
+def _is_batch(args: argparse.Namespace) -> bool:
+    if len(args.paths) > 1 or args.out_dir is not None or args.check:
+        return True
+    path = args.paths[0]
+    return os.path.isdir(path) or glob.has_magic(path)
+
+
+def _expand_inputs(paths: list[str], pattern: str = "*.dsl") -> list[tuple[str, str]]:
+    """Resolve files, directories (recursively, `pattern`) and globs.
+
+    Returns (input_path, output_name) pairs in a stable order, where `output_name` is
+    the input's path relative to the directory it was found in, with a `.json` suffix.
+    Paths that do not exist are kept so they are reported as failures.
+    """
+    jobs: list[tuple[str, str]] = []
+    seen: set[str] = set()
+
+    def add(path: Path, rel: Path) -> None:
+        key = os.path.normpath(path)
+        if key not in seen:
+            seen.add(key)
+            jobs.append((str(path), str(rel.with_suffix(".json"))))
+
+    for raw in paths:
+        if os.path.isdir(raw):
+            root = Path(raw)
+            for path in sorted(root.rglob(pattern)):
+                if path.is_file():
+                    add(path, path.relative_to(root))
+        elif glob.has_magic(raw):
+            for match in sorted(glob.glob(raw, recursive=True)):
+                if os.path.isfile(match):
+                    add(Path(match), Path(Path(match).name))
+        else:
+            add(Path(raw), Path(Path(raw).name))
+    return jobs
+
+
+def _compile_file(
+    job: tuple[str, str | None, int | None, str | None, bool, bool, bool, bool, str | None]
+) -> str | None:
+    """Worker: compile one file and write its output. Returns an error message or None."""
+    path, out_path, now_ms, cache_dir, no_cache, raw_text, optimize, fold, timezone = job
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            dsl = f.read()
+        if out_path is None:
+            _compile_text(
+                dsl,
+                now_ms=now_ms,
+                cache_dir=cache_dir,
+                no_cache=no_cache,
+                raw_text=raw_text,
+                optimize=optimize,
+                fold=fold,
+                timezone=timezone,
+            )
+            return None
+        chunks = _compile_chunks(
+            dsl,
+            now_ms=now_ms,
+            cache_dir=cache_dir,
+            no_cache=no_cache,
+            raw_text=raw_text,
+            optimize=optimize,
+            fold=fold,
+            timezone=timezone,
+        )
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        try:
+            with open(out_path, "w", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                f.write("\n")
+        except BaseException:
+            # Do not leave a truncated output behind.
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            raise
+        return None
+    except Exception as e:
+        # Any failure is reported per file; one bad input must not abort the batch.
+        return str(e)
+
+
+def _compile_batch(args: argparse.Namespace) -> int:
+    inputs = _expand_inputs(args.paths)
+    if not inputs:
+        print("error: no .dsl files found", file=sys.stderr)
+        return 2
+    if args.out_dir is not None and not args.check:
+        # Two inputs with the same output name would overwrite each other, and with
+        # several workers which one wins is not deterministic.
+        claimed: dict[str, str] = {}
+        for path, rel in inputs:
+            key = os.path.normcase(os.path.normpath(rel))
+            if key in claimed:
+                print(
+                    f"error: {claimed[key]} and {path} would both write {os.path.join(args.out_dir, rel)}",
+                    file=sys.stderr,
+                )
+                return 2
+            claimed[key] = path
+
+    jobs = []
+    for path, rel in inputs:
+        if args.check:
+            out_path = None
+        elif args.out_dir is not None:
+            out_path = os.path.join(args.out_dir, rel)
+        else:
+            out_path = str(Path(path).with_suffix(".json"))
+        jobs.append(
+            (
+                path,
+                out_path,
+                args.now_ms,
+                args.cache_dir,
+                args.no_cache,
+                args.raw_passthrough,
+                args.optimize,
+                args.fold_constants,
+                args.timezone,
+            )
+        )
+
+    workers = args.jobs if args.jobs is not None else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        errors = [_compile_file(job) for job in jobs]
+    else:
+        # Chunks amortize inter-process overhead; small files compile in well under 1ms.
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            errors = list(pool.map(_compile_file, jobs, chunksize=chunksize))
+
+    failed = 0
+    for (path, _), error in zip(inputs, errors):
+        if error is None:
+            print(f"ok   {path}")
+        else:
+            failed += 1
+            print(f"FAIL {path}: {error}")
+    print(f"Total: {len(jobs)}  Passed: {len(jobs) - failed}  Failed: {failed}")
+    return 0 if failed == 0 else 2
+
+
+# Differences listed per file; the rest are counted.
+_MAX_REPORTED_DIFFERENCES = 10
+
+
+def _roundtrip_file(path: str) -> tuple[int, str | None, list[str]]:
+    """Worker: round-trip one JSON file. Returns (size in bytes, error, differences)."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        body = json.loads(data)
+    except (OSError, ValueError) as e:
+        return 0, f"read: {e}", []
+    try:
+        return len(data), None, roundtrip_body(body)
+    except RoundTripError as e:
+        return len(data), str(e), []
+    except Exception as e:
+        # Any failure is reported per file; one bad input must not abort the run.
+        return len(data), f"{type(e).__name__}: {e}", []
+
+
+def _roundtrip(args: argparse.Namespace) -> int:
+    paths = [path for path, _ in _expand_inputs(args.paths, "*.json")]
+    if not paths:
+        print("error: no .json files found", file=sys.stderr)
+        return 2
+
+    workers = args.jobs if args.jobs is not None else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(paths)))
+    start = time.perf_counter()
+    if workers == 1:
+        results = [_roundtrip_file(path) for path in paths]
+    else:
+        chunksize = max(1, len(paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_roundtrip_file, paths, chunksize=chunksize))
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    failed = 0
+    total_bytes = 0
+    for path, (size, error, differences) in zip(paths, results):
+        total_bytes += size
+        if error is not None:
+            failed += 1
+            print(f"FAIL {path}: {error}")
+        elif differences:
+            failed += 1
+            print(f"FAIL {path}: {len(differences)} difference{'s' if len(differences) != 1 else ''}")
+            for line in differences[:_MAX_REPORTED_DIFFERENCES]:
+                print(f"  {line}")
+            if len(differences) > _MAX_REPORTED_DIFFERENCES:
+                print(f"  ... and {len(differences) - _MAX_REPORTED_DIFFERENCES} more")
+    print(f"Total: {len(paths)}  Passed: {len(paths) - failed}  Failed: {failed}")
+    print(
+        f"Throughput: {len(paths) / elapsed:.1f} files/s, {total_bytes / elapsed / 1e6:.2f} MB/s "
+        f"({elapsed:.2f}s, {workers} worker{'s' if workers != 1 else ''})"
+    )
+    return 0 if failed == 0 else 2
+
+
+def _compile_jsonl(args: argparse.Namespace) -> int:
+    path = args.paths[0] if args.paths else "-"
+    # A bounded in-process cache: generated variants often repeat DSL text.
+    cache = None if args.no_cache or args.raw_passthrough else CompileCache(maxsize=1024)
+    failed = False
+    try:
+        src = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    try:
+        write = sys.stdout.write
+        results = compile_stream(
+            src, now_ms=args.now_ms, cache=cache, raw_text=args.raw_passthrough
+        )
+        for result in results:
+            failed = failed or "error" in result
+            write(dumps(result))
+            write("\n")
+    finally:
+        if src is not sys.stdin:
+            src.close()
+    return 2 if failed else 0
+
+
+def _compile_documents(args: argparse.Namespace) -> int:
+    write = sys.stdout.write
+    count = 0
+    try:
+        with open(args.paths[0], "r", encoding="utf-8") as f:
+            # Documents are read, parsed and written one at a time.
+            for number, query in enumerate(
+                parse_documents(f, raw_text=args.raw_passthrough), start=1
+            ):
+                if args.fold_constants:
+                    query = _fold(
+                        query,
+                        now_ms=args.now_ms,
+                        timezone=args.timezone,
+                        explain=args.explain_optimizations,
+                        label=f"document {number}: ",
+                    )
+                if args.optimize:
+                    query = _optimize(
+                        query, explain=args.explain_optimizations, label=f"document {number}: "
+                    )
+                body = compile_to_pendo_aggregation(query, now_ms=args.now_ms)
+                if args.documents == "jsonl":
+                    write(dumps(body))
+                    write("\n")
+                    continue
+                # Same layout as json.dump(list_of_bodies, indent=2).
+                text = dumps(body, indent=2)
+                write("[\n  " if count == 0 else ",\n  ")
+                write(text.replace("\n", "\n  "))
+                count += 1
+    except (OSError, DslParseError, ValueError) as e:
+        if count:
+            write("\n]\n")
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    if args.documents == "array":
+        write("\n]\n" if count else "[]\n")
+    return 0
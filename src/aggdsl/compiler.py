@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from typing import Any
+from typing import Callable
 from typing import Literal
 
 import json
@@ -8,10 +9,10 @@ import sys
 
 try:
     # Normal package import path
-    from .dsl_ast import Query, Stage
+    from .dsl_ast import Branches, Query, RawJson, Stage
 except ImportError:  # pragma: no cover
     # Allows running this file directly: `python src/aggdsl/compiler.py ...`
-    from dsl_ast import Query, Stage  # type: ignore
+    from dsl_ast import Branches, Query, RawJson, Stage  # type: ignore
 
 
 class CompileError(ValueError):
@@ -22,6 +23,17 @@ def compile_pipeline(query: Query, *, now_ms: int | None = None) -> list[dict[st
     """Compile a parsed DSL query into a list of Pendo pipeline stages."""
     pipeline: list[dict[str, Any]] = []
 
+    source = _compile_source(query, now_ms=now_ms)
+    if source is not None:
+        pipeline.append(source)
+
+    for stage in query.stages:
+        pipeline.append(_compile_stage(stage, now_ms=now_ms))
+
+    return pipeline
+
+
+def _compile_source(query: Query, *, now_ms: int | None) -> dict[str, Any] | None:
     # FROM mode: emit an initial source stage.
     if query.event_source is not None:
         source_obj: dict[str, Any] = {
@@ -51,12 +63,8 @@ def compile_pipeline(query: Query, *, now_ms: int | None = None) -> list[dict[st
                 ts["last"] = int(last) if isinstance(last, int) else str(last)
             source_obj["timeSeries"] = ts
 
-        pipeline.append({"source": source_obj})
-
-    for stage in query.stages:
-        pipeline.append(_compile_stage(stage, now_ms=now_ms))
-
-    return pipeline
+        return {"source": source_obj}
+    return None
 
 
 def compile_to_pendo_aggregation(query: Query, *, now_ms: int | None = None) -> dict[str, Any]:
@@ -74,15 +82,17 @@ def compile_to_pendo_aggregation_with_format(
 
     Pendo aggregation requests are always sent as an object containing `pipeline`.
     """
-    pipeline = compile_pipeline(query, now_ms=now_ms)
+    if request_format != "object":
+        raise CompileError(f"Unsupported request_format: {request_format}")
+
+    return _compile_body(query, compile_pipeline(query, now_ms=now_ms))
 
+
+def _compile_body(query: Query, pipeline: Any) -> dict[str, Any]:
     body: dict[str, Any] = {
         "response": {"location": "request", "mimeType": query.response_mime_type},
     }
 
-    if request_format != "object":
-        raise CompileError(f"Unsupported request_format: {request_format}")
-
     req_obj: dict[str, Any] = {"pipeline": pipeline}
     if query.request_name is not None:
         req_obj["name"] = query.request_name
@@ -91,112 +101,167 @@ def compile_to_pendo_aggregation_with_format(
     return body
 
 
-def _compile_stage(stage: Stage, *, now_ms: int | None) -> dict[str, Any]:
-    if stage.kind == "filter":
-        return {"filter": str(stage.payload)}
+# Compiles the nested pipeline of a merge/fork/spawn stage.
+_PipelineCompiler = Callable[..., Any]
+# Compiles one stage's payload: (payload, now_ms, compile_query) -> stage object.
+_StageCompiler = Callable[[Any, int | None, _PipelineCompiler], Any]
 
-    if stage.kind == "identified":
-        return {"identified": str(stage.payload)}
+# Stage compilers by `Stage.kind`, so each stage costs one lookup however many kinds
+# there are. `aggdsl.stages.register_stage` adds user kinds.
+_STAGE_COMPILERS: dict[str, _StageCompiler] = {}
 
-    if stage.kind == "eval":
-        return {"eval": dict(stage.payload)}
 
-    if stage.kind == "select":
-        return {"select": dict(stage.payload)}
+def _compiles(kind: str) -> Callable[[_StageCompiler], _StageCompiler]:
+    def register(fn: _StageCompiler) -> _StageCompiler:
+        _STAGE_COMPILERS[kind] = fn
+        return fn
 
-    if stage.kind == "join":
-        return {"join": dict(stage.payload)}
+    return register
 
-    if stage.kind == "merge":
-        fields = list(stage.payload["fields"])
-        mappings_in = stage.payload.get("mappings")
-        query = stage.payload["query"]
-        if not isinstance(query, Query):
-            raise CompileError("merge stage requires a parsed Query for pipeline")
 
-        merge_obj: dict[str, Any] = {
-            "fields": fields,
-            "pipeline": compile_pipeline(query, now_ms=now_ms),
-        }
-        if mappings_in is not None:
-            merge_obj["mappings"] = dict(mappings_in)
-
-        return {"merge": merge_obj}
-
-    if stage.kind == "unmarshal":
-        return {"unmarshal": dict(stage.payload)}
-
-    if stage.kind == "unwind":
-        return {"unwind": dict(stage.payload)}
-
-    if stage.kind == "segment":
-        return {"segment": dict(stage.payload)}
-
-    if stage.kind == "bulkExpand":
-        return {"bulkExpand": dict(stage.payload)}
-
-    if stage.kind == "fork":
-        # Two forms are supported:
-        # - Inline JSON array: `| fork [ ... ]` -> payload is a list of JSON values.
-        # - Fork block: `| fork` with `branch ... endbranch` blocks -> payload is list[Query].
-        if isinstance(stage.payload, list) and all(isinstance(x, Query) for x in stage.payload):
-            fork_pipelines = [compile_pipeline(q, now_ms=now_ms) for q in stage.payload]
-            return {"fork": fork_pipelines}
-
-        if not isinstance(stage.payload, list):
-            raise CompileError("fork stage payload must be a JSON array or list of Queries")
-
-        return {"fork": stage.payload}
-
-    if stage.kind == "sessionReplays":
-        if not isinstance(stage.payload, dict):
-            raise CompileError("sessionReplays stage payload must be a JSON object")
-        return {"sessionReplays": dict(stage.payload)}
-
-    if stage.kind == "pes":
-        if not isinstance(stage.payload, dict):
-            raise CompileError("pes stage payload must be a JSON object")
-        return {"pes": dict(stage.payload)}
-
-    if stage.kind == "switch":
-        out_var = stage.payload["out"]
-        field = stage.payload["field"]
-        cases = list(stage.payload["cases"])
-        return {"switch": {out_var: {field: cases}}}
-
-    if stage.kind == "spawn":
-        branches = stage.payload
-        spawn_pipelines = [compile_pipeline(q, now_ms=now_ms) for q in branches]
-        return {"spawn": spawn_pipelines}
-
-    if stage.kind == "raw":
-        # User-provided stage object.
-        return dict(stage.payload)
-
-    if stage.kind == "limit":
-        return {"limit": int(stage.payload)}
-
-    if stage.kind == "sort":
-        keys = list(stage.payload)
-        return {"sort": keys}
-
-    if stage.kind == "group":
-        grp = stage.payload
-        if getattr(grp, "emit_map", False):
-            fields_map: dict[str, Any] = {}
-            for alias, agg, arg in grp.fields:
-                fields_map[alias] = {agg: None if arg is None else arg}
-            return {"group": {"group": grp.group, "fields": fields_map}}
-
-        fields_json: list[dict[str, Any]] = []
-        for alias, agg, arg in grp.fields:
-            if arg is None:
-                fields_json.append({alias: {agg: None}})
-            else:
-                fields_json.append({alias: {agg: arg}})
-        return {"group": {"group": grp.group, "fields": fields_json}}
-
-    raise CompileError(f"Unknown stage kind: {stage.kind}")
+def _compile_stage(
+    stage: Stage,
+    *,
+    now_ms: int | None,
+    compile_query: _PipelineCompiler = compile_pipeline,
+) -> dict[str, Any]:
+    """Compile one stage; nested pipelines are produced by `compile_query`.
+
+    `aggdsl.emit` passes a lazy `compile_query` so nested pipelines are serialized
+    incrementally instead of being built up front.
+    """
+    compile_payload = _STAGE_COMPILERS.get(stage.kind)
+    if compile_payload is None:
+        raise CompileError(f"Unknown stage kind: {stage.kind}")
+    return compile_payload(stage.payload, now_ms, compile_query)
+
+
+@_compiles("filter")
+def _compile_filter(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    return {"filter": str(payload)}
+
+
+@_compiles("identified")
+def _compile_identified(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    return {"identified": str(payload)}
+
+
+def _compile_map(kind: str) -> _StageCompiler:
+    def compile_map(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+        return {kind: dict(payload)}
+
+    return compile_map
+
+
+_STAGE_COMPILERS.update(
+    {kind: _compile_map(kind) for kind in ("eval", "select", "unmarshal", "unwind", "segment")}
+)
+
+
+@_compiles("join")
+def _compile_join(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    return {"join": {"fields": list(payload.fields)}}
+
+
+@_compiles("merge")
+def _compile_merge(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    query = payload.query
+    if not isinstance(query, Query):
+        raise CompileError("merge stage requires a parsed Query for pipeline")
+
+    merge_obj: dict[str, Any] = {
+        "fields": list(payload.fields),
+        "pipeline": compile_query(query, now_ms=now_ms),
+    }
+    if payload.mappings is not None:
+        merge_obj["mappings"] = dict(payload.mappings)
+
+    return {"merge": merge_obj}
+
+
+@_compiles("bulkExpand")
+def _compile_bulk_expand(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    if isinstance(payload, RawJson):
+        return {"bulkExpand": payload}
+    return {"bulkExpand": dict(payload)}
+
+
+@_compiles("fork")
+def _compile_fork(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    # Two forms are supported:
+    # - Inline JSON array: `| fork [ ... ]` -> payload is a list of JSON values.
+    # - Fork block: `| fork` with `branch ... endbranch` blocks -> payload is Branches.
+    if isinstance(payload, Branches):
+        return {"fork": [compile_query(q, now_ms=now_ms) for q in payload]}
+
+    if isinstance(payload, RawJson):
+        return {"fork": payload}
+
+    if not isinstance(payload, list):
+        raise CompileError("fork stage payload must be a JSON array or fork branches")
+
+    return {"fork": payload}
+
+
+def _compile_json_object(kind: str) -> _StageCompiler:
+    def compile_json_object(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+        if isinstance(payload, RawJson):
+            return {kind: payload}
+        if not isinstance(payload, dict):
+            raise CompileError(f"{kind} stage payload must be a JSON object")
+        return {kind: dict(payload)}
+
+    return compile_json_object
+
+
+_STAGE_COMPILERS.update({kind: _compile_json_object(kind) for kind in ("sessionReplays", "pes")})
+
+
+@_compiles("switch")
+def _compile_switch(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    cases = [{"value": case.value, "==": case.equals} for case in payload.cases]
+    return {"switch": {payload.out: {payload.field: cases}}}
+
+
+@_compiles("spawn")
+def _compile_spawn(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    return {"spawn": [compile_query(q, now_ms=now_ms) for q in payload]}
+
+
+@_compiles("raw")
+def _compile_raw(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    # User-provided stage object.
+    if isinstance(payload, RawJson):
+        # Kept as source text; `aggdsl.emit` splices it into the output.
+        return payload
+    return dict(payload)
+
+
+@_compiles("limit")
+def _compile_limit(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    return {"limit": int(payload)}
+
+
+@_compiles("sort")
+def _compile_sort(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    return {"sort": list(payload)}
+
+
+@_compiles("group")
+def _compile_group(payload: Any, now_ms: int | None, compile_query: _PipelineCompiler) -> Any:
+    if payload.emit_map:
+        fields_map: dict[str, Any] = {}
+        for alias, agg, arg in payload.fields:
+            fields_map[alias] = {agg: None if arg is None else arg}
+        return {"group": {"group": list(payload.group), "fields": fields_map}}
+
+    fields_json: list[dict[str, Any]] = []
+    for alias, agg, arg in payload.fields:
+        if arg is None:
+            fields_json.append({alias: {agg: None}})
+        else:
+            fields_json.append({alias: {agg: arg}})
+    return {"group": {"group": list(payload.group), "fields": fields_json}}
 
 
 def _main(argv: list[str]) -> int:
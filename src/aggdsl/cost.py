@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from typing import Any, Mapping
+
+try:
+    from .dsl_ast import Branches, Query, RawJson, Stage
+except ImportError:  # pragma: no cover
+    from dsl_ast import Branches, Query, RawJson, Stage  # type: ignore
+
+
+# The estimate is static: it knows nothing about the subscription, so row counts are
+# those of a notional mid-sized tenant. They are only meant to rank queries against
+# each other and against a budget; pass `source_rows` to calibrate them.
+
+# Rows per day of window for event sources.
+DEFAULT_EVENT_ROWS_PER_DAY: dict[str, float] = {
+    "events": 50_000,
+    "singleEvents": 200_000,
+    "pageEvents": 20_000,
+    "featureEvents": 20_000,
+    "trackEvents": 5_000,
+    "guideEvents": 5_000,
+    "guidesSeen": 2_000,
+    "pollEvents": 1_000,
+    "pollsSeen": 1_000,
+    "emailEvents": 1_000,
+    "recordingMetadata": 2_000,
+    "agenticEvents": 2_000,
+}
+
+# Rows for snapshot-style object sources, whatever the window.
+DEFAULT_OBJECT_ROWS: dict[str, float] = {
+    "visitors": 100_000,
+    "accounts": 10_000,
+    "doNotProcessAccounts": 100,
+    "pages": 1_000,
+    "features": 1_000,
+    "guides": 500,
+    "groups": 100,
+    "guidesSeenEver": 200_000,
+    "pollsSeenEver": 50_000,
+}
+
+_UNKNOWN_EVENT_ROWS_PER_DAY = 20_000
+_UNKNOWN_OBJECT_ROWS = 10_000
+# Window assumed when its length is not a constant (e.g. `last=now()`).
+_UNKNOWN_WINDOW_DAYS = 30.0
+
+_PERIOD_DAYS = {"hourRange": 1 / 24, "dayRange": 1.0, "weekRange": 7.0, "monthRange": 30.0}
+
+# Row multipliers: the fraction of rows a filter keeps, and the rows an unwind makes
+# out of one row.
+_FILTER_SELECTIVITY = 0.5
+_IDENTIFIED_SELECTIVITY = 0.8
+_SEGMENT_SELECTIVITY = 0.5
+_JOIN_RATIO = 0.5
+_GROUP_RATIO = 0.1
+_UNWIND_FANOUT = 5.0
+
+# Work per input row, relative to reading one source row.
+_STAGE_WEIGHT = {
+    "filter": 0.1,
+    "identified": 0.1,
+    "eval": 0.2,
+    "select": 0.1,
+    "switch": 0.1,
+    "unmarshal": 0.5,
+    "unwind": 0.2,
+    "segment": 0.5,
+    "join": 0.5,
+    "group": 0.3,
+    "merge": 0.5,
+    "bulkExpand": 2.0,
+    "limit": 0.0,
+}
+# Stages whose internals are opaque JSON; they are charged one unit per row.
+_OPAQUE_WEIGHT = 1.0
+
+# Stages after which a filter is more expensive than before them: they multiply the
+# rows or do per-row lookups.
+_EXPENSIVE_STAGES = frozenset({"unwind", "merge", "bulkExpand", "join", "unmarshal", "segment"})
+
+
+@dataclass(frozen=True, slots=True)
+class CostNode:
+    """The estimate for one source or stage; `children` are nested queries/branches."""
+
+    label: str
+    rows_in: float
+    rows_out: float
+    # Work done by this node, including its children.
+    cost: float
+    notes: tuple[str, ...] = ()
+    children: tuple[CostNode, ...] = ()
+
+
+@dataclass(frozen=True, slots=True)
+class CostEstimate:
+    """The static cost of a query: total work, rows returned and the annotated tree."""
+
+    cost: float
+    rows: float
+    window_days: float | None
+    nodes: tuple[CostNode, ...]
+    merges: int
+    bulk_expands: int
+    branches: int
+    warnings: tuple[str, ...]
+
+
+@dataclass(slots=True)
+class _Totals:
+    merges: int = 0
+    bulk_expands: int = 0
+    branches: int = 0
+    window_days: float | None = None
+    warnings: list[str] = field(default_factory=list)
+
+
+def estimate_cost(query: Query, *, source_rows: Mapping[str, float] | None = None) -> CostEstimate:
+    """Estimate the cost of `query` from its structure alone.
+
+    Rows start from the source (rows per day of window for event sources, a fixed
+    count for object sources, overridable per source type through `source_rows`) and
+    flow through the stages: filters keep half the rows, `unwind` multiplies them,
+    `group` reduces them, and `merge`/`spawn`/`fork` add the cost of their nested
+    queries. The cost is the sum of rows read and rows processed by each stage,
+    weighted by stage type. Filters that run after row-multiplying or lookup stages
+    are reported in `warnings`.
+    """
+    totals = _Totals()
+    nodes, rows, cost = _estimate_query(query, 0.0, "pipeline", totals, dict(source_rows or {}))
+    return CostEstimate(
+        cost=cost,
+        rows=rows,
+        window_days=totals.window_days,
+        nodes=nodes,
+        merges=totals.merges,
+        bulk_expands=totals.bulk_expands,
+        branches=totals.branches,
+        warnings=tuple(totals.warnings),
+    )
+
+
+def explain(query: Query, *, source_rows: Mapping[str, float] | None = None) -> str:
+    """The stage tree of `query` annotated with `estimate_cost`, as printable text."""
+    return format_estimate(estimate_cost(query, source_rows=source_rows))
+
+
+def format_estimate(estimate: CostEstimate) -> str:
+    window = "unknown" if estimate.window_days is None else _days(estimate.window_days)
+    lines = [
+        f"estimated cost: {_num(estimate.cost)}  rows out: {_num(estimate.rows)}  "
+        f"window: {window}  merges: {estimate.merges}  bulkExpands: {estimate.bulk_expands}  "
+        f"branches: {estimate.branches}",
+    ]
+    _format_nodes(estimate.nodes, 0, lines)
+    if estimate.warnings:
+        lines.append("warnings:")
+        lines.extend(f"  {w}" for w in estimate.warnings)
+    return "\n".join(lines) + "\n"
+
+
+def _format_nodes(nodes: tuple[CostNode, ...], depth: int, lines: list[str]) -> None:
+    for node in nodes:
+        label = "  " * depth + node.label
+        line = f"{label:<52} rows {_num(node.rows_in):>6} -> {_num(node.rows_out):>6}  cost {_num(node.cost):>6}"
+        if node.notes:
+            line += "  (" + "; ".join(node.notes) + ")"
+        lines.append(line)
+        _format_nodes(node.children, depth + 1, lines)
+
+
+def _estimate_query(
+    query: Query,
+    rows: float,
+    location: str,
+    totals: _Totals,
+    source_rows: dict[str, float],
+) -> tuple[tuple[CostNode, ...], float, float]:
+    """Nodes, output rows and cost of `query`, fed `rows` input rows if it has no source."""
+    nodes: list[CostNode] = []
+    cost = 0.0
+    if query.event_source is not None:
+        node = _estimate_source(query, totals, source_rows)
+        nodes.append(node)
+        rows = node.rows_out
+        cost += node.cost
+
+    expensive: tuple[int, str] | None = None
+    for pos, stage in enumerate(query.stages, start=1):
+        if stage.kind == "filter" and expensive is not None:
+            totals.warnings.append(
+                f"{location}: stage {pos}: filter runs after {expensive[1]} (stage {expensive[0]}); "
+                "if it does not use that stage's output, filter earlier"
+            )
+        node = _estimate_stage(stage, rows, f"{location}/{stage.kind}@{pos}", totals, source_rows)
+        nodes.append(node)
+        rows = node.rows_out
+        cost += node.cost
+        if stage.kind in _EXPENSIVE_STAGES and expensive is None:
+            expensive = (pos, stage.kind)
+    return tuple(nodes), rows, cost
+
+
+def _estimate_source(query: Query, totals: _Totals, source_rows: dict[str, float]) -> CostNode:
+    source = query.event_source
+    assert source is not None
+    kind = source.source_type
+    ts = query.time_series
+    notes: list[str] = []
+
+    if ts is None or kind in DEFAULT_OBJECT_ROWS:
+        rows = source_rows.get(kind, DEFAULT_OBJECT_ROWS.get(kind, _UNKNOWN_OBJECT_ROWS))
+        label = f"source {kind}"
+        if ts is None and kind in DEFAULT_EVENT_ROWS_PER_DAY:
+            notes.append("no TIMESERIES")
+    else:
+        days, note = _window_days(ts.period, ts.first, ts.count, ts.last)
+        if note:
+            notes.append(note)
+        totals.window_days = days if totals.window_days is None else max(totals.window_days, days)
+        per_day = source_rows.get(kind, DEFAULT_EVENT_ROWS_PER_DAY.get(kind, _UNKNOWN_EVENT_ROWS_PER_DAY))
+        rows = per_day * days
+        label = f"source {kind} {ts.period} ({_days(days)})"
+    if kind not in source_rows and kind not in DEFAULT_OBJECT_ROWS and kind not in DEFAULT_EVENT_ROWS_PER_DAY:
+        notes.append("unknown source type")
+    return CostNode(label=label, rows_in=0.0, rows_out=rows, cost=rows, notes=tuple(notes))
+
+
+def _window_days(
+    period: str, first: int | str, count: int | None, last: int | str | None
+) -> tuple[float, str | None]:
+    if count is not None:
+        per = _PERIOD_DAYS.get(period)
+        if per is None:
+            return _UNKNOWN_WINDOW_DAYS, f"period {period} has no fixed length; assuming {_days(_UNKNOWN_WINDOW_DAYS)}"
+        return abs(count) * per, None
+    if isinstance(first, int) and isinstance(last, int):
+        return abs(last - first) / 86_400_000, None
+    return _UNKNOWN_WINDOW_DAYS, f"window length is not constant; assuming {_days(_UNKNOWN_WINDOW_DAYS)}"
+
+
+def _estimate_stage(
+    stage: Stage,
+    rows: float,
+    location: str,
+    totals: _Totals,
+    source_rows: dict[str, float],
+) -> CostNode:
+    kind = stage.kind
+    payload = stage.payload
+    label = _describe(stage)
+    cost = rows * _STAGE_WEIGHT.get(kind, _OPAQUE_WEIGHT)
+    out = rows
+    notes: list[str] = []
+    children: tuple[CostNode, ...] = ()
+
+    if kind == "filter":
+        out = rows * _FILTER_SELECTIVITY
+    elif kind == "identified":
+        out = rows * _IDENTIFIED_SELECTIVITY
+    elif kind == "segment":
+        out = rows * _SEGMENT_SELECTIVITY
+    elif kind == "join":
+        out = rows * _JOIN_RATIO
+    elif kind == "unwind":
+        out = rows * _UNWIND_FANOUT
+        cost = out * _STAGE_WEIGHT["unwind"]
+        notes.append(f"fan-out x{_num(_UNWIND_FANOUT)}")
+    elif kind == "group":
+        out = 1.0 if not payload.group else max(1.0, rows * _GROUP_RATIO)
+    elif kind == "sort":
+        cost = rows * math.log2(rows) * 0.05 if rows > 1 else 0.0
+    elif kind == "limit":
+        out = min(rows, float(payload))
+    elif kind == "bulkExpand":
+        totals.bulk_expands += 1
+        notes.append("per-row lookup")
+    elif kind == "merge":
+        totals.merges += 1
+        nested, nested_rows, nested_cost = _estimate_query(payload.query, 0.0, location, totals, source_rows)
+        children = nested
+        cost += nested_cost + nested_rows * _STAGE_WEIGHT["merge"]
+    elif kind in ("fork", "spawn") and isinstance(payload, Branches):
+        totals.branches += len(payload)
+        branch_nodes = []
+        cost = out = 0.0
+        for i, branch in enumerate(payload, start=1):
+            # Fork branches read the incoming rows; spawn branches are whole queries.
+            fed = rows if kind == "fork" else 0.0
+            nested, nested_rows, nested_cost = _estimate_query(
+                branch, fed, f"{location}/branch {i}", totals, source_rows
+            )
+            branch_nodes.append(
+                CostNode(label=f"branch {i}", rows_in=fed, rows_out=nested_rows, cost=nested_cost, children=nested)
+            )
+            out += nested_rows
+            cost += nested_cost
+        children = tuple(branch_nodes)
+    elif kind not in _STAGE_WEIGHT:
+        notes.append("opaque JSON stage; cost not modelled")
+    return CostNode(label=label, rows_in=rows, rows_out=out, cost=cost, notes=tuple(notes), children=children)
+
+
+def _describe(stage: Stage) -> str:
+    kind = stage.kind
+    payload = stage.payload
+    if kind in ("filter", "identified"):
+        detail = str(payload)
+    elif kind == "limit":
+        detail = str(payload)
+    elif kind == "sort":
+        detail = ",".join(payload)
+    elif kind == "group":
+        detail = f"by {', '.join(payload.group)}" if payload.group else "(all rows)"
+    elif kind in ("join", "merge"):
+        detail = f"fields [{', '.join(payload.fields)}]"
+    elif kind in ("fork", "spawn"):
+        n = len(payload) if isinstance(payload, Branches) else len(_json(payload))
+        detail = f"({n} branches)"
+    elif kind == "unwind":
+        detail = str(payload.get("field", ""))
+    elif isinstance(payload, dict) and kind in ("eval", "select", "unmarshal", "segment"):
+        detail = ", ".join(payload)
+    else:
+        detail = ""
+    text = f"| {kind} {detail}".rstrip()
+    return text if len(text) <= 48 else text[:45] + "..."
+
+
+def _json(payload: Any) -> Any:
+    return payload.loads() if isinstance(payload, RawJson) else payload
+
+
+def _num(value: float) -> str:
+    for limit, suffix in ((1e9, "G"), (1e6, "M"), (1e3, "k")):
+        if value >= limit:
+            return f"{value / limit:.3g}{suffix}"
+    return f"{value:.3g}"
+
+
+def _days(days: float) -> str:
+    return f"{days:.3g} day" if days == 1 else f"{days:.3g} days"
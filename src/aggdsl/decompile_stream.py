@@ -0,0 +1,480 @@
+from __future__ import annotations
+
+import io
+import json
+import re
+import tempfile
+from typing import Any, Callable, Iterator, TextIO
+
+try:
+    from .decompiler import (
+        _STAGE_DECOMPILERS,
+        DecompileError,
+        _decompile_source_stage,
+        _decompile_stage,
+        _format_brace_map,
+        _header_lines,
+    )
+except ImportError:  # pragma: no cover
+    from decompiler import (  # type: ignore
+        _STAGE_DECOMPILERS,
+        DecompileError,
+        _decompile_source_stage,
+        _decompile_stage,
+        _format_brace_map,
+        _header_lines,
+    )
+
+
+_CHUNK = 1 << 16
+# Values up to this many characters of JSON are decoded whole (by the C decoder) and
+# stages that fit are decompiled exactly like `decompile_pendo_aggregation_to_dsl`
+# does; bigger containers are walked element by element.
+_DECODE_LIMIT = 1 << 20
+# Spooled text stays in memory up to this many characters, then moves to a temp file.
+_SPOOL_LIMIT = 1 << 20
+
+# Stages whose DSL form is their JSON payload on one line; large ones are copied through.
+_JSON_PAYLOAD_STAGES = ("bulkExpand", "sessionReplays")
+# Stages with a streamed form in `_large_stage`; other kinds with a DSL form are decoded.
+_STREAMED_STAGES = frozenset({*_JSON_PAYLOAD_STAGES, "fork", "spawn", "merge"})
+
+_SKIP_WHITESPACE = re.compile(r"[ \t\n\r]*").match
+_DELIMITERS = frozenset(" \t\n\r,]}:")
+_DECODER = json.JSONDecoder()
+# `_json_one_line` with a single encoder instead of one per element.
+_ONE_LINE = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+Write = Callable[[str], Any]
+
+
+def decompile_json_stream(src: TextIO, out: TextIO, *, chunk_size: int = _CHUNK) -> None:
+    """Decompile the aggregation body (or pipeline array) read from `src` into `out`.
+
+    Writes the same text as `decompile_pendo_aggregation_to_dsl(json.load(src))`, but
+    reads `src` incrementally and decodes one stage at a time. Stages bigger than about
+    1 MB of JSON (typically inline `bulkExpand` data or `fork` arrays) are never decoded
+    whole: their payloads are re-encoded piece by piece, and spooled to a temporary file
+    where the DSL has to look ahead (e.g. to tell a `fork` block from a JSON-array
+    fork). Memory therefore stays bounded by the largest single string and the spool
+    threshold, not by the size of the export.
+
+    DSL is written as it is produced; if the input turns out to be invalid, `out` holds
+    a partial result when `DecompileError` is raised. Headers that follow the pipeline
+    in the JSON (a `name` after `pipeline`, as the compiler emits it) are handled by
+    spooling the pipeline's DSL until the request object ends.
+    """
+    reader = _Reader(src, chunk_size)
+    first = reader.peek()
+    if first == "[":
+        _pipeline(reader, out.write, "|")
+    elif first == "{":
+        _body(reader, out.write)
+    else:
+        raise DecompileError("Expected a JSON object (aggregation body) or a pipeline array")
+    if reader.peek():
+        raise reader.error("unexpected data after the body")
+
+
+class _Reader:
+    """Pull reader over JSON text: containers are walked, everything else is decoded."""
+
+    __slots__ = ("_src", "_chunk", "_buf", "_pos", "_eof")
+
+    def __init__(self, src: TextIO, chunk_size: int = _CHUNK) -> None:
+        self._src = src
+        self._chunk = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def error(self, message: str) -> DecompileError:
+        return DecompileError(f"Invalid JSON: {message}")
+
+    def _fill(self, size: int) -> bool:
+        """Append at least `size` more characters (fewer at the end); False at the end."""
+        if self._eof:
+            return False
+        data = self._src.read(max(size, self._chunk))
+        if not data:
+            self._eof = True
+            return False
+        # Drop the consumed prefix while appending.
+        self._buf = self._buf[self._pos :] + data
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next non-whitespace character, or "" at the end of the input."""
+        while True:
+            pos = self._pos = _SKIP_WHITESPACE(self._buf, self._pos).end()
+            if pos < len(self._buf):
+                return self._buf[pos]
+            if not self._fill(self._chunk):
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise self.error(f"expected {char!r}, found {found or 'end of input'!r}")
+        self._pos += 1
+
+    def decode(self, limit: int | None = None) -> tuple[bool, Any]:
+        """Decode the next value: (True, value), or (False, None) with nothing consumed
+        when it is an array/object longer than `limit` characters."""
+        first = self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                # Incomplete (or invalid) so far; read more, doubling the window.
+                pending = len(self._buf) - self._pos
+                if limit is not None and pending > limit and first in "[{":
+                    return False, None
+                if not self._fill(pending):
+                    raise self.error(e.msg) from None
+                continue
+            if first not in '"[{' and self._buf[end : end + 1] not in _DELIMITERS:
+                # A number cut at the end of the buffer (`15`, `1500.`) decodes as a
+                # shorter one; make sure it is followed by a delimiter or the end.
+                if self._fill(self._chunk):
+                    continue
+            self._pos = end
+            return True, value
+
+    def items(self) -> Iterator[None]:
+        """Walk an array: yields once per element, positioned on it; the caller must
+        consume each element (`decode`, `copy`, `skip`, ...)."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            found = self.peek()
+            self._pos += 1
+            if found == "]":
+                return
+            if found != ",":
+                raise self.error(f"expected ',' or ']', found {found or 'end of input'!r}")
+            if self.peek() == "]":
+                raise self.error("trailing ',' before ']'")
+
+    def members(self) -> Iterator[str]:
+        """Walk an object: yields each key, positioned on its value (see `items`)."""
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise self.error("expected a string key")
+            key = self.decode()[1]
+            self.expect(":")
+            yield key
+            found = self.peek()
+            self._pos += 1
+            if found == "}":
+                return
+            if found != ",":
+                raise self.error(f"expected ',' or '}}', found {found or 'end of input'!r}")
+
+    def copy(self, write: Write | None) -> bool:
+        """Write the next value as compact JSON, as `_json_one_line` would; with
+        `write=None`, skip it. Returns whether the value is an array of arrays (the
+        shape of `fork`/`spawn` branches)."""
+        done, value = self.decode(_DECODE_LIMIT)
+        if done:
+            if write is not None:
+                write(_ONE_LINE(value))
+            return type(value) is list and all(type(v) is list for v in value)
+        if self.peek() == "[":
+            sep = "["
+            nested = True
+            for _ in self.items():
+                nested = nested and self.peek() == "["
+                # Most elements of a large array are small: decode them inline.
+                done, value = self.decode(_DECODE_LIMIT)
+                if not done:
+                    if write is not None:
+                        write(sep)
+                    self.copy(write)
+                elif write is not None:
+                    write(sep + _ONE_LINE(value))
+                sep = ","
+            if write is not None:
+                write("[]" if sep == "[" else "]")
+            return nested
+        sep = "{"
+        for key in self.members():
+            if write is not None:
+                write(f"{sep}{_ONE_LINE(key)}:")
+            sep = ","
+            self.copy(write)
+        if write is not None:
+            write("{}" if sep == "{" else "}")
+        return False
+
+    def skip(self) -> None:
+        self.copy(None)
+
+
+class _Spool:
+    """Text written once and read back any number of times: in memory up to
+    `_SPOOL_LIMIT` characters, then in a temporary file."""
+
+    __slots__ = ("_parts", "_size", "_file", "first", "nested_arrays")
+
+    def __init__(self) -> None:
+        self._parts: list[str] = []
+        self._size = 0
+        self._file: Any = None
+        self.first = ""  # the first character written
+        self.nested_arrays = False  # whether the text is an array of arrays
+
+    def write(self, text: str) -> None:
+        if not self.first:
+            self.first = text[:1]
+        if self._file is not None:
+            self._file.write(text)
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size > _SPOOL_LIMIT:
+            self._file = tempfile.TemporaryFile("w+", encoding="utf-8")
+            self._file.write("".join(self._parts))
+            self._parts = []
+
+    def _open(self) -> TextIO:
+        if self._file is None:
+            return io.StringIO("".join(self._parts))
+        self._file.flush()
+        self._file.seek(0)
+        return self._file
+
+    def reader(self) -> _Reader:
+        return _Reader(self._open())
+
+    def copy_to(self, write: Write) -> None:
+        src = self._open()
+        while True:
+            chunk = src.read(_CHUNK)
+            if not chunk:
+                return
+            write(chunk)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+def _body(reader: _Reader, write: Write) -> None:
+    response: Any = None
+    response_seen = False
+    found_request = False
+    name: Any = None
+    # The pipeline's DSL, when headers may still follow it in the JSON.
+    spool: _Spool | None = None
+    try:
+        for key in reader.members():
+            if key == "response":
+                response = reader.decode()[1]
+                response_seen = True
+            elif key != "request":
+                reader.skip()
+            elif reader.peek() == "[":
+                found_request = True
+                if response_seen:
+                    _emit_headers(write, response, None)
+                    _pipeline(reader, write, "|")
+                else:
+                    spool = _Spool()
+                    _pipeline(reader, spool.write, "|")
+            elif reader.peek() == "{":
+                found_request = True
+                name, spool = _named_request(reader, write, response, response_seen)
+            else:
+                raise DecompileError("'request' must be a list or an object")
+        if not found_request:
+            raise DecompileError("Missing 'request' in aggregation body")
+        if spool is not None:
+            _emit_headers(write, response, name)
+            spool.copy_to(write)
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+def _named_request(
+    reader: _Reader, write: Write, response: Any, response_seen: bool
+) -> tuple[Any, _Spool | None]:
+    """Returns the request name and, unless it was written directly, the spooled DSL."""
+    name: Any = None
+    spool: _Spool | None = None
+    found_pipeline = False
+    for key in reader.members():
+        if key == "name":
+            name = reader.decode()[1]
+        elif key != "pipeline":
+            reader.skip()
+        elif reader.peek() != "[":
+            raise DecompileError("request.pipeline must be a list")
+        else:
+            found_pipeline = True
+            if response_seen and name is not None:
+                _emit_headers(write, response, name)
+                _pipeline(reader, write, "|")
+            else:
+                spool = _Spool()
+                _pipeline(reader, spool.write, "|")
+    if not found_pipeline:
+        raise DecompileError("Named request must contain 'pipeline'")
+    return name, spool
+
+
+def _emit_headers(write: Write, response: Any, name: Any) -> None:
+    for line in _header_lines(response, name):
+        write(line + "\n")
+
+
+def _write_lines(write: Write, lines: list[str]) -> None:
+    for line in lines:
+        write(line + "\n")
+
+
+def _pipeline(reader: _Reader, write: Write, prefix: str) -> None:
+    """Decompile the pipeline array at `reader`; branches use the `||` prefix."""
+    first = True
+    for _ in reader.items():
+        if not first:
+            _stage(reader, write, prefix)
+            continue
+        first = False
+        done, stage = reader.decode(_DECODE_LIMIT)
+        if not done:
+            members = _spool_members(reader)
+            try:
+                if any(key == "source" for key, _ in members):
+                    stage = {key: spool.reader().decode()[1] for key, spool in members}
+                else:
+                    write("PIPELINE\n")
+                    _large_stage(members, write, prefix)
+                    continue
+            finally:
+                for _, spool in members:
+                    spool.close()
+        if isinstance(stage, dict) and "source" in stage:
+            _write_lines(write, _decompile_source_stage(stage))
+        else:
+            write("PIPELINE\n")
+            _write_lines(write, _decompile_stage(stage, prefix=prefix))
+    if first:
+        write("PIPELINE\n")
+
+
+def _stage(reader: _Reader, write: Write, prefix: str) -> None:
+    done, stage = reader.decode(_DECODE_LIMIT)
+    if done:
+        _write_lines(write, _decompile_stage(stage, prefix=prefix))
+        return
+    if reader.peek() == "[":
+        write(f"{prefix} raw ")
+        reader.copy(write)
+        write("\n")
+        return
+    members = _spool_members(reader)
+    try:
+        _large_stage(members, write, prefix)
+    finally:
+        for _, spool in members:
+            spool.close()
+
+
+def _spool_members(reader: _Reader) -> list[tuple[str, _Spool]]:
+    members = []
+    for key in reader.members():
+        spool = _Spool()
+        spool.nested_arrays = reader.copy(spool.write)
+        members.append((key, spool))
+    return members
+
+
+def _large_stage(members: list[tuple[str, _Spool]], write: Write, prefix: str) -> None:
+    """Decompile a stage too large to decode whole, given its spooled members."""
+    if len(members) == 1:
+        key, spool = members[0]
+        if key in _JSON_PAYLOAD_STAGES and spool.first == "{":
+            write(f"{prefix} {key} ")
+            spool.copy_to(write)
+            write("\n")
+            return
+        if key in ("fork", "spawn") and spool.first == "[":
+            if spool.nested_arrays:
+                _branches(spool.reader(), write, prefix, key)
+                return
+            if key == "fork":
+                write(f"{prefix} fork ")
+                spool.copy_to(write)
+                write("\n")
+                return
+        elif key == "merge" and spool.first == "{":
+            if _merge(spool, write, prefix):
+                return
+        elif key not in _STREAMED_STAGES and key in _STAGE_DECOMPILERS:
+            # A large eval/select/group/... has no streamed form; decode it.
+            stage = {key: spool.reader().decode()[1]}
+            _write_lines(write, _decompile_stage(stage, prefix=prefix))
+            return
+
+    write(f"{prefix} raw ")
+    sep = "{"
+    for key, spool in members:
+        write(f"{sep}{_ONE_LINE(key)}:")
+        spool.copy_to(write)
+        sep = ","
+    write("{}\n" if sep == "{" else "}\n")
+
+
+def _branches(reader: _Reader, write: Write, prefix: str, kind: str) -> None:
+    write(f"{prefix} {kind}\n")
+    for _ in reader.items():
+        write("branch\n")
+        _pipeline(reader, write, "||")
+        write("endbranch\n")
+    write(f"| end{kind}\n" if prefix == "|" else f"{prefix} end{kind}\n")
+
+
+def _merge(spool: _Spool, write: Write, prefix: str) -> bool:
+    # Pass 1: the header parts (the pipeline may come before them).
+    fields: Any = None
+    mappings: Any = None
+    pipeline_kind = ""
+    reader = spool.reader()
+    for key in reader.members():
+        if key == "fields":
+            fields = reader.decode()[1]
+        elif key == "mappings":
+            mappings = reader.decode()[1]
+        else:
+            if key == "pipeline":
+                pipeline_kind = reader.peek()
+            reader.skip()
+    if not (isinstance(fields, list) and all(isinstance(x, str) for x in fields)):
+        return False
+    if pipeline_kind != "[" or not (mappings is None or isinstance(mappings, dict)):
+        return False
+
+    header = f"{prefix} merge fields [{','.join(fields)}]"
+    if mappings is not None:
+        header += f" mappings {_format_brace_map(mappings)}"
+    write(header + "\n")
+    # Pass 2: the pipeline.
+    reader = spool.reader()
+    for key in reader.members():
+        if key == "pipeline":
+            _pipeline(reader, write, "|")
+        else:
+            reader.skip()
+    write("endmerge\n")
+    return True
+
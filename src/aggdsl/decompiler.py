@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import json
-from typing import Any
+from typing import Any, Callable, Iterator, TextIO
 
 
 class DecompileError(ValueError):
@@ -18,13 +18,23 @@ def decompile_pendo_aggregation_to_dsl(body: Any) -> str:
 
     Unknown/unsupported stages are emitted as `| raw { ... }`.
     """
-    normalized = _normalize_body(body)
+    return "".join(_iter_lines(body))
 
-    lines: list[str] = []
 
-    response = normalized.get("response")
-    if isinstance(response, dict) and "mimeType" in response:
-        lines.append(f"RESPONSE mimeType={response['mimeType']}")
+def decompile_to_stream(body: Any, out: TextIO) -> None:
+    """Like `decompile_pendo_aggregation_to_dsl`, but write each stage's lines to `out`
+    as the pipeline is walked instead of building the whole text.
+
+    To decompile JSON that is too large to load, see `aggdsl.decompile_stream`.
+    """
+    write = out.write
+    for line in _iter_lines(body):
+        write(line)
+
+
+def _iter_lines(body: Any) -> Iterator[str]:
+    # Newline-terminated DSL lines.
+    normalized = _normalize_body(body)
 
     request = normalized["request"]
     request_name: str | None = None
@@ -39,22 +49,31 @@ def decompile_pendo_aggregation_to_dsl(body: Any) -> str:
     else:
         pipeline = request
 
-    if request_name is not None:
-        lines.append(f'REQUEST name="{request_name}"')
+    for line in _header_lines(normalized.get("response"), request_name):
+        yield line + "\n"
 
     # FROM mode if the first stage is a source stage.
     if pipeline and isinstance(pipeline[0], dict) and "source" in pipeline[0]:
-        from_lines = _decompile_source_stage(pipeline[0])
-        lines.extend(from_lines)
+        lines = _decompile_source_stage(pipeline[0])
         stage_start_idx = 1
     else:
-        lines.append("PIPELINE")
+        lines = ["PIPELINE"]
         stage_start_idx = 0
 
+    for line in lines:
+        yield line + "\n"
     for stage in pipeline[stage_start_idx:]:
-        lines.extend(_decompile_stage(stage, prefix="|"))
+        for line in _decompile_stage(stage, prefix="|"):
+            yield line + "\n"
+
 
-    return "\n".join(lines) + "\n"
+def _header_lines(response: Any, request_name: str | None) -> list[str]:
+    lines: list[str] = []
+    if isinstance(response, dict) and "mimeType" in response:
+        lines.append(f"RESPONSE mimeType={response['mimeType']}")
+    if request_name is not None:
+        lines.append(f'REQUEST name="{request_name}"')
+    return lines
 
 
 def _normalize_body(body: Any) -> dict[str, Any]:
@@ -129,177 +148,228 @@ def _decompile_source_stage(stage: dict[str, Any]) -> list[str]:
     return lines
 
 
-def _decompile_stage(stage: Any, *, prefix: str) -> list[str]:
-    if not isinstance(stage, dict) or not stage:
-        return [f"{prefix} raw {_json_one_line(stage)}"]
-
-    if "fork" in stage and len(stage) == 1 and isinstance(stage["fork"], list):
-        branches = stage["fork"]
-        # If it's a list-of-pipelines, prefer the block form.
-        if all(isinstance(b, list) for b in branches):
-            out: list[str] = [f"{prefix} fork"]
-            for branch in branches:
-                out.append("branch")
-                out.extend(_decompile_branch_pipeline(branch))
-                out.append("endbranch")
-            out.append("| endfork" if prefix == "|" else f"{prefix} endfork")
-            return out
-
-        # Otherwise fall back to the JSON-array form.
-        return [f"{prefix} fork {_json_one_line(branches)}"]
-
-    if "sessionReplays" in stage and len(stage) == 1 and isinstance(stage["sessionReplays"], dict):
-        return [f"{prefix} sessionReplays {_json_one_line(stage['sessionReplays'])}"]
-
-    if "filter" in stage and len(stage) == 1:
-        return [f"{prefix} filter {stage['filter']}"]
-
-    if "identified" in stage and len(stage) == 1:
-        return [f"{prefix} identified {stage['identified']}"]
-
-    if "eval" in stage and len(stage) == 1 and isinstance(stage["eval"], dict):
-        return [f"{prefix} eval {_format_brace_map(stage['eval'])}"]
-
-    if "select" in stage and len(stage) == 1 and isinstance(stage["select"], dict):
-        return [f"{prefix} select {_format_brace_map(stage['select'])}"]
-
-    if "join" in stage and len(stage) == 1 and isinstance(stage["join"], dict):
-        join = stage["join"]
-        fields = join.get("fields")
-        if isinstance(fields, list) and all(isinstance(x, str) for x in fields):
-            return [f"{prefix} join fields [{','.join(fields)}]"]
-
-    if "merge" in stage and len(stage) == 1 and isinstance(stage["merge"], dict):
-        merge = stage["merge"]
-        fields = merge.get("fields")
-        pipeline = merge.get("pipeline")
-        if (
-            isinstance(fields, list)
-            and all(isinstance(x, str) for x in fields)
-            and isinstance(pipeline, list)
-        ):
-            mappings = merge.get("mappings")
-            if mappings is None:
-                out: list[str] = [f"{prefix} merge fields [{','.join(fields)}]"]
-            elif isinstance(mappings, dict):
-                out = [
-                    f"{prefix} merge fields [{','.join(fields)}] mappings {_format_brace_map(mappings)}"
-                ]
-            else:
-                return [f"{prefix} raw {_json_one_line(stage)}"]
-
-            out.extend(_decompile_merge_pipeline(pipeline))
-            out.append("endmerge")
-            return out
-
-    if "unmarshal" in stage and len(stage) == 1 and isinstance(stage["unmarshal"], dict):
-        return [f"{prefix} unmarshal {_format_brace_map(stage['unmarshal'])}"]
-
-    if "unwind" in stage and len(stage) == 1 and isinstance(stage["unwind"], dict):
-        return [f"{prefix} unwind {_format_brace_map(stage['unwind'])}"]
-
-    if "segment" in stage and len(stage) == 1 and isinstance(stage["segment"], dict):
-        seg = stage["segment"]
-        seg_id = seg.get("id")
-        if isinstance(seg_id, (str, int)):
-            # Use quotes for safety; parser will unquote.
-            return [f"{prefix} segment id={json.dumps(str(seg_id), ensure_ascii=False)}"]
-
-    if "bulkExpand" in stage and len(stage) == 1 and isinstance(stage["bulkExpand"], dict):
-        return [f"{prefix} bulkExpand {_json_one_line(stage['bulkExpand'])}"]
-
-    if "switch" in stage and len(stage) == 1 and isinstance(stage["switch"], dict):
-        sw = stage["switch"]
-        if len(sw) == 1:
-            out_var = next(iter(sw.keys()))
-            inner = sw[out_var]
-            if isinstance(inner, dict) and len(inner) == 1:
-                field = next(iter(inner.keys()))
-                cases = inner[field]
-                if isinstance(cases, list):
-                    cases_text: list[str] = []
-                    for c in cases:
-                        if not isinstance(c, dict) or "value" not in c or "==" not in c:
-                            return [f"{prefix} raw {_json_one_line(stage)}"]
-                        cases_text.append(f"{_format_switch_scalar(c['value'])}=={_format_switch_scalar(c['=='])}")
-                    return [f"{prefix} switch {out_var} from {field} {{ " + ", ".join(cases_text) + " }"]
-
-    if "group" in stage and len(stage) == 1 and isinstance(stage["group"], dict):
-        grp = stage["group"]
-        group_fields = grp.get("group")
-        fields = grp.get("fields")
-        if isinstance(group_fields, list) and isinstance(fields, list):
-            group_text = ",".join(str(x) for x in group_fields)
-            agg_parts: list[str] = []
-            ok = True
-            for item in fields:
-                if not isinstance(item, dict) or len(item) != 1:
-                    ok = False
-                    break
-                alias = next(iter(item.keys()))
-                agg_obj = item[alias]
-                if not isinstance(agg_obj, dict) or len(agg_obj) != 1:
-                    ok = False
-                    break
-                agg = next(iter(agg_obj.keys()))
-                arg = agg_obj[agg]
-                if arg is None:
-                    agg_parts.append(f"{alias}={agg}(null)")
-                elif isinstance(arg, dict):
-                    agg_parts.append(f"{alias}={agg}({_format_brace_map(arg)})")
-                else:
-                    agg_parts.append(f"{alias}={agg}({arg})")
-            if ok:
-                return [f"{prefix} group by {group_text} fields {{ " + ", ".join(agg_parts) + " }"]
-
-        # Also support Pendo's object-map form: fields: { alias: {agg: arg}, ... }
-        if isinstance(group_fields, list) and isinstance(fields, dict):
-            group_text = ",".join(str(x) for x in group_fields)
-            agg_parts: list[str] = []
-            for alias, agg_obj in fields.items():
-                if not isinstance(agg_obj, dict) or len(agg_obj) != 1:
-                    return [f"{prefix} raw {_json_one_line(stage)}"]
-                agg = next(iter(agg_obj.keys()))
-                arg = agg_obj[agg]
-                if arg is None:
-                    agg_parts.append(f"{alias}={agg}(null)")
-                elif isinstance(arg, dict):
-                    agg_parts.append(f"{alias}={agg}({_format_brace_map(arg)})")
-                else:
-                    agg_parts.append(f"{alias}={agg}({arg})")
-            return [
-                f"{prefix} group by {group_text} fields map {{ "
-                + ", ".join(agg_parts)
-                + " }"
-            ]
-
-    if "sort" in stage and len(stage) == 1 and isinstance(stage["sort"], list):
-        keys = stage["sort"]
-        if all(isinstance(x, str) for x in keys):
-            # DSL sort uses comma-separated keys.
-            return [f"{prefix} sort " + ",".join(keys)]
-
-    if "limit" in stage and len(stage) == 1:
-        return [f"{prefix} limit {stage['limit']}"]
-
-    if "spawn" in stage and len(stage) == 1 and isinstance(stage["spawn"], list):
-        branches = stage["spawn"]
-        if not all(isinstance(b, list) for b in branches):
-            return [f"{prefix} raw {_json_one_line(stage)}"]
-
-        out: list[str] = [f"{prefix} spawn"]
-        for branch in branches:
-            out.append("branch")
-            out.extend(_decompile_branch_pipeline(branch))
-            out.append("endbranch")
-        out.append("| endspawn" if prefix == "|" else f"{prefix} endspawn")
-        return out
+# Decompiles the value of a single-key stage object: (value, prefix) -> DSL lines, or
+# None when the value has no DSL form (the stage is then emitted as `raw`).
+_StageDecompiler = Callable[[Any, str], list[str] | None]
 
-    # source stage that isn't first in the pipeline can't be expressed as FROM/TIMESERIES.
-    # Preserve it as a raw stage so the pipeline stays semantically equivalent.
+# Stage decompilers by the stage object's key, so each stage costs one lookup however
+# many kinds there are. `aggdsl.stages.register_stage` adds user kinds.
+_STAGE_DECOMPILERS: dict[str, _StageDecompiler] = {}
+
+
+def _decompiles(kind: str) -> Callable[[_StageDecompiler], _StageDecompiler]:
+    def register(fn: _StageDecompiler) -> _StageDecompiler:
+        _STAGE_DECOMPILERS[kind] = fn
+        return fn
+
+    return register
+
+
+def _decompile_stage(stage: Any, *, prefix: str) -> list[str]:
+    if isinstance(stage, dict) and len(stage) == 1:
+        kind = next(iter(stage))
+        decompile_value = _STAGE_DECOMPILERS.get(kind)
+        if decompile_value is not None:
+            lines = decompile_value(stage[kind], prefix)
+            if lines is not None:
+                return lines
+
+    # Unknown kinds, multi-key objects and values without a DSL form. This includes a
+    # source stage that isn't first in the pipeline, which can't be expressed as
+    # FROM/TIMESERIES; `raw` keeps the pipeline semantically equivalent.
     return [f"{prefix} raw {_json_one_line(stage)}"]
 
 
+@_decompiles("fork")
+def _decompile_fork(branches: Any, prefix: str) -> list[str] | None:
+    if not isinstance(branches, list):
+        return None
+    # If it's a list-of-pipelines, prefer the block form.
+    if all(isinstance(b, list) for b in branches):
+        return _branch_block("fork", branches, prefix)
+    # Otherwise fall back to the JSON-array form.
+    return [f"{prefix} fork {_json_one_line(branches)}"]
+
+
+@_decompiles("spawn")
+def _decompile_spawn(branches: Any, prefix: str) -> list[str] | None:
+    if not isinstance(branches, list) or not all(isinstance(b, list) for b in branches):
+        return None
+    return _branch_block("spawn", branches, prefix)
+
+
+def _branch_block(kind: str, branches: list[Any], prefix: str) -> list[str]:
+    out: list[str] = [f"{prefix} {kind}"]
+    for branch in branches:
+        out.append("branch")
+        out.extend(_decompile_branch_pipeline(branch))
+        out.append("endbranch")
+    out.append(f"| end{kind}" if prefix == "|" else f"{prefix} end{kind}")
+    return out
+
+
+def _decompile_json_object(kind: str) -> _StageDecompiler:
+    def decompile_json_object(value: Any, prefix: str) -> list[str] | None:
+        if not isinstance(value, dict):
+            return None
+        return [f"{prefix} {kind} {_json_one_line(value)}"]
+
+    return decompile_json_object
+
+
+def _decompile_text(kind: str) -> _StageDecompiler:
+    def decompile_text(value: Any, prefix: str) -> list[str] | None:
+        return [f"{prefix} {kind} {value}"]
+
+    return decompile_text
+
+
+def _decompile_brace_map(kind: str) -> _StageDecompiler:
+    def decompile_brace_map(value: Any, prefix: str) -> list[str] | None:
+        if not isinstance(value, dict):
+            return None
+        return [f"{prefix} {kind} {_format_brace_map(value)}"]
+
+    return decompile_brace_map
+
+
+_STAGE_DECOMPILERS.update(
+    {
+        "sessionReplays": _decompile_json_object("sessionReplays"),
+        "bulkExpand": _decompile_json_object("bulkExpand"),
+        "filter": _decompile_text("filter"),
+        "identified": _decompile_text("identified"),
+        "limit": _decompile_text("limit"),
+        "eval": _decompile_brace_map("eval"),
+        "select": _decompile_brace_map("select"),
+        "unmarshal": _decompile_brace_map("unmarshal"),
+        "unwind": _decompile_brace_map("unwind"),
+    }
+)
+
+
+@_decompiles("join")
+def _decompile_join(join: Any, prefix: str) -> list[str] | None:
+    if not isinstance(join, dict):
+        return None
+    fields = join.get("fields")
+    if isinstance(fields, list) and all(isinstance(x, str) for x in fields):
+        return [f"{prefix} join fields [{','.join(fields)}]"]
+    return None
+
+
+@_decompiles("merge")
+def _decompile_merge(merge: Any, prefix: str) -> list[str] | None:
+    if not isinstance(merge, dict):
+        return None
+    fields = merge.get("fields")
+    pipeline = merge.get("pipeline")
+    if not (
+        isinstance(fields, list)
+        and all(isinstance(x, str) for x in fields)
+        and isinstance(pipeline, list)
+    ):
+        return None
+    mappings = merge.get("mappings")
+    if mappings is None:
+        out: list[str] = [f"{prefix} merge fields [{','.join(fields)}]"]
+    elif isinstance(mappings, dict):
+        out = [f"{prefix} merge fields [{','.join(fields)}] mappings {_format_brace_map(mappings)}"]
+    else:
+        return None
+
+    out.extend(_decompile_merge_pipeline(pipeline))
+    out.append("endmerge")
+    return out
+
+
+@_decompiles("segment")
+def _decompile_segment(seg: Any, prefix: str) -> list[str] | None:
+    if not isinstance(seg, dict):
+        return None
+    seg_id = seg.get("id")
+    if isinstance(seg_id, (str, int)):
+        # Use quotes for safety; parser will unquote.
+        return [f"{prefix} segment id={json.dumps(str(seg_id), ensure_ascii=False)}"]
+    return None
+
+
+@_decompiles("switch")
+def _decompile_switch(sw: Any, prefix: str) -> list[str] | None:
+    if not isinstance(sw, dict) or len(sw) != 1:
+        return None
+    out_var = next(iter(sw.keys()))
+    inner = sw[out_var]
+    if not isinstance(inner, dict) or len(inner) != 1:
+        return None
+    field = next(iter(inner.keys()))
+    cases = inner[field]
+    if not isinstance(cases, list):
+        return None
+    cases_text: list[str] = []
+    for c in cases:
+        if not isinstance(c, dict) or "value" not in c or "==" not in c:
+            return None
+        cases_text.append(f"{_format_switch_scalar(c['value'])}=={_format_switch_scalar(c['=='])}")
+    return [f"{prefix} switch {out_var} from {field} {{ " + ", ".join(cases_text) + " }"]
+
+
+@_decompiles("group")
+def _decompile_group(grp: Any, prefix: str) -> list[str] | None:
+    if not isinstance(grp, dict):
+        return None
+    group_fields = grp.get("group")
+    fields = grp.get("fields")
+    if isinstance(group_fields, list) and isinstance(fields, list):
+        group_text = ",".join(str(x) for x in group_fields)
+        agg_parts: list[str] = []
+        ok = True
+        for item in fields:
+            if not isinstance(item, dict) or len(item) != 1:
+                ok = False
+                break
+            alias = next(iter(item.keys()))
+            agg_obj = item[alias]
+            if not isinstance(agg_obj, dict) or len(agg_obj) != 1:
+                ok = False
+                break
+            agg_parts.append(_format_aggregate(alias, agg_obj))
+        if ok:
+            return [f"{prefix} group by {group_text} fields {{ " + ", ".join(agg_parts) + " }"]
+
+    # Also support Pendo's object-map form: fields: { alias: {agg: arg}, ... }
+    if isinstance(group_fields, list) and isinstance(fields, dict):
+        group_text = ",".join(str(x) for x in group_fields)
+        agg_parts = []
+        for alias, agg_obj in fields.items():
+            if not isinstance(agg_obj, dict) or len(agg_obj) != 1:
+                return None
+            agg_parts.append(_format_aggregate(alias, agg_obj))
+        return [
+            f"{prefix} group by {group_text} fields map {{ "
+            + ", ".join(agg_parts)
+            + " }"
+        ]
+    return None
+
+
+def _format_aggregate(alias: str, agg_obj: dict[str, Any]) -> str:
+    ((agg, arg),) = agg_obj.items()
+    if arg is None:
+        return f"{alias}={agg}(null)"
+    if isinstance(arg, dict):
+        return f"{alias}={agg}({_format_brace_map(arg)})"
+    return f"{alias}={agg}({arg})"
+
+
+@_decompiles("sort")
+def _decompile_sort(keys: Any, prefix: str) -> list[str] | None:
+    if isinstance(keys, list) and all(isinstance(x, str) for x in keys):
+        # DSL sort uses comma-separated keys.
+        return [f"{prefix} sort " + ",".join(keys)]
+    return None
+
+
 def _decompile_merge_pipeline(pipeline: list[Any]) -> list[str]:
     """Decompile a merge.pipeline into merge-block lines.
 
@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import json
 from dataclasses import dataclass
-from typing import Any, Literal
+from typing import Any, Iterator, Literal, NamedTuple
 
 
 BlacklistBehavior = Literal["apply", "ignore", "only"]
 
+# All nodes are frozen and slotted: a parsed corpus can be held in memory (linting,
+# diffing, caching) without a per-node `__dict__`, and sequences are tuples.
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class TimeSeries:
     period: str
     # `first` may be an epoch-ms int, or a string expression (e.g. "date(`firstDate`)").
@@ -17,22 +21,97 @@ class TimeSeries:
     last: int | str | None = None
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class EventSource:
     source_type: str  # e.g. pageEvents, featureEvents, trackEvents
     params: dict[str, Any]
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
+class RawJson:
+    """Validated JSON source text, emitted verbatim instead of being re-serialized."""
+
+    text: str
+
+    def loads(self) -> Any:
+        return json.loads(self.text)
+
+
+@dataclass(frozen=True, slots=True)
+class JoinPayload:
+    fields: tuple[str, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class MergePayload:
+    fields: tuple[str, ...]
+    mappings: dict[str, Any] | None
+    query: Query
+
+
+class SwitchCase(NamedTuple):
+    value: str
+    equals: str  # emitted as the `==` key
+
+
+@dataclass(frozen=True, slots=True)
+class SwitchPayload:
+    out: str
+    field: str
+    cases: tuple[SwitchCase, ...]
+
+
+class GroupField(NamedTuple):
+    alias: str
+    agg: str
+    arg: Any  # None, a scalar or an object map
+
+
+@dataclass(frozen=True, slots=True)
+class GroupPayload:
+    group: tuple[str, ...]
+    fields: tuple[GroupField, ...]
+    emit_map: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class Branches:
+    """The branch pipelines of a `fork`/`spawn` block."""
+
+    queries: tuple[Query, ...]
+
+    def __iter__(self) -> Iterator[Query]:
+        return iter(self.queries)
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+
+@dataclass(frozen=True, slots=True)
 class Stage:
+    """One pipeline stage. The payload type depends on `kind`:
+
+    - `filter`, `identified`: str
+    - `limit`: int
+    - `sort`: tuple[str, ...]
+    - `eval`, `select`, `unmarshal`, `unwind`, `segment`: dict (emitted as-is)
+    - `join`: JoinPayload; `merge`: MergePayload; `switch`: SwitchPayload; `group`: GroupPayload
+    - `spawn`: Branches; `fork`: Branches, or a JSON array (list or RawJson)
+    - `raw`, `bulkExpand`, `sessionReplays`, `pes`: a JSON object (dict or RawJson)
+    """
+
     kind: str
     payload: Any
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Query:
     event_source: EventSource | None
     time_series: TimeSeries | None
-    stages: list[Stage]
+    stages: tuple[Stage, ...]
     response_mime_type: str = "application/json"
     request_name: str | None = None
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.stages, tuple):
+            object.__setattr__(self, "stages", tuple(self.stages))
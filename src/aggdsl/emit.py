@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import json
+import re
+import uuid
+from typing import IO, Any, Iterator
+
+try:
+    from .compiler import _compile_body, _compile_source, _compile_stage
+    from .dsl_ast import Query, RawJson
+except ImportError:  # pragma: no cover
+    from compiler import _compile_body, _compile_source, _compile_stage  # type: ignore
+    from dsl_ast import Query, RawJson  # type: ignore
+
+
+# Characters buffered before each write to the binary stream.
+_FLUSH_CHARS = 64 * 1024
+
+
+def dumps(body: Any, *, indent: int | None = None, ensure_ascii: bool = False) -> str:
+    """Serialize a compiled body, splicing `RawJson` payloads in as their source text.
+
+    Without `RawJson` values this is exactly `json.dumps(body, indent=..., ensure_ascii=...)`.
+    Raw payloads keep their original formatting; in compact mode (`indent=None`) their
+    line breaks become spaces so the output stays on one line (JSON strings cannot
+    contain raw line breaks, so only whitespace between tokens is affected).
+    """
+    return "".join(_Encoder(indent, ensure_ascii).iter_value(body, 0))
+
+
+def iter_dumps(body: Any, *, indent: int | None = None, ensure_ascii: bool = False) -> Iterator[str]:
+    """`dumps(body, ...)` as text chunks, for an already compiled body.
+
+    The `request.pipeline` list is serialized one stage at a time, so the full text is
+    never held in memory at once.
+    """
+    request = body.get("request") if isinstance(body, dict) else None
+    if isinstance(request, dict) and isinstance(request.get("pipeline"), list):
+        body = {**body, "request": {**request, "pipeline": _Stages(request["pipeline"])}}
+    return _Encoder(indent, ensure_ascii).iter_value(body, 0)
+
+
+def iter_body(
+    query: Query,
+    *,
+    now_ms: int | None = None,
+    indent: int | None = None,
+    ensure_ascii: bool = False,
+) -> Iterator[str]:
+    """Yield the Pendo aggregation body for `query` as text chunks.
+
+    The chunks join to exactly `dumps(compile_to_pendo_aggregation(query, now_ms=...))`,
+    but the body is never built as a whole: stages are compiled and serialized one at a
+    time, and merge/fork/spawn pipelines are expanded only when the writer reaches them.
+    """
+    body = _compile_body(query, _LazyPipeline(query, now_ms=now_ms))
+    return _Encoder(indent, ensure_ascii).iter_value(body, 0)
+
+
+def write_body(
+    query: Query,
+    fp: IO[bytes],
+    *,
+    now_ms: int | None = None,
+    indent: int | None = None,
+    ensure_ascii: bool = False,
+) -> None:
+    """Write the body for `query` to a binary stream as UTF-8, incrementally.
+
+    If compiling a stage fails, the exception propagates after the preceding output has
+    already been written.
+    """
+    buf: list[str] = []
+    size = 0
+    for chunk in iter_body(query, now_ms=now_ms, indent=indent, ensure_ascii=ensure_ascii):
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= _FLUSH_CHARS:
+            fp.write("".join(buf).encode("utf-8"))
+            buf.clear()
+            size = 0
+    if buf:
+        fp.write("".join(buf).encode("utf-8"))
+
+
+def dump(body: Any, fp: IO[str], *, indent: int | None = None, ensure_ascii: bool = False) -> None:
+    fp.write(dumps(body, indent=indent, ensure_ascii=ensure_ascii))
+
+
+class _LazyPipeline:
+    """Stands in for `compile_pipeline(query)` until the encoder reaches it."""
+
+    __slots__ = ("query", "now_ms")
+
+    def __init__(self, query: Query, *, now_ms: int | None) -> None:
+        self.query = query
+        self.now_ms = now_ms
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        source = _compile_source(self.query, now_ms=self.now_ms)
+        if source is not None:
+            yield source
+        for stage in self.query.stages:
+            yield _compile_stage(stage, now_ms=self.now_ms, compile_query=_LazyPipeline)
+
+
+class _Stages:
+    """A compiled pipeline list whose stages the encoder serializes one at a time."""
+
+    __slots__ = ("stages",)
+
+    def __init__(self, stages: list[Any]) -> None:
+        self.stages = stages
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.stages)
+
+
+class _Encoder:
+    """`json.dumps` layout, with `RawJson`, `_LazyPipeline` and `_Stages` values filled in later.
+
+    Each value is encoded by `json.dumps` with placeholder strings for the deferred
+    values; the text is then re-indented to its nesting level and the placeholders are
+    replaced by the raw text or by the recursively encoded pipeline.
+    """
+
+    def __init__(self, indent: int | None, ensure_ascii: bool) -> None:
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        # A per-encoder token makes collisions with real string values practically impossible.
+        self.token = f"aggdsl-deferred-{uuid.uuid4().hex}-"
+        self.token_re = re.compile(rf'"{re.escape(self.token)}(\d+)"')
+
+    def iter_value(self, obj: Any, level: int) -> Iterator[str]:
+        deferred: list[Any] = []
+
+        def placeholder(value: Any) -> str:
+            if isinstance(value, (RawJson, _LazyPipeline, _Stages)):
+                deferred.append(value)
+                return f"{self.token}{len(deferred) - 1}"
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+        text = json.dumps(
+            obj, indent=self.indent, ensure_ascii=self.ensure_ascii, default=placeholder
+        )
+        if level and self.indent is not None:
+            text = text.replace("\n", "\n" + " " * (self.indent * level))
+        if not deferred:
+            yield text
+            return
+
+        pos = 0
+        for m in self.token_re.finditer(text):
+            yield text[pos : m.start()]
+            pos = m.end()
+            value = deferred[int(m.group(1))]
+            # Nested values are indented relative to the line the placeholder is on.
+            line = text[text.rfind("\n", 0, m.start()) + 1 : m.start()]
+            leading = len(line) - len(line.lstrip(" "))
+            if isinstance(value, RawJson):
+                yield self._raw_text(value, leading)
+            else:
+                sub_level = leading // self.indent if self.indent else 0
+                yield from self._iter_pipeline(value, sub_level)
+        yield text[pos:]
+
+    def _raw_text(self, raw: RawJson, leading: int) -> str:
+        if self.ensure_ascii and not raw.text.isascii():
+            text = json.dumps(raw.loads(), indent=self.indent, ensure_ascii=True)
+            return text.replace("\n", "\n" + " " * leading) if leading else text
+        return raw.text if self.indent is not None else raw.text.replace("\n", " ")
+
+    def _iter_pipeline(self, pipeline: _LazyPipeline | _Stages, level: int) -> Iterator[str]:
+        if self.indent is None:
+            first, sep, close = "[", ", ", "]"
+        else:
+            inner = "\n" + " " * (self.indent * (level + 1))
+            first, sep, close = "[" + inner, "," + inner, "\n" + " " * (self.indent * level) + "]"
+
+        empty = True
+        for element in pipeline:
+            yield first if empty else sep
+            empty = False
+            yield from self.iter_value(element, level + 1)
+        yield "[]" if empty else close
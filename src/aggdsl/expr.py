@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import json
+import re
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Iterator, Union
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+# Expression nodes are frozen and slotted like the stage AST; `parse_expression`
+# caches them per distinct string, so equal expressions share one tree.
+
+
+@dataclass(frozen=True, slots=True)
+class Literal:
+    """A number, string, `true`/`false` or `null`/`nil`; `text` is the source token."""
+
+    value: Any
+    text: str
+
+
+@dataclass(frozen=True, slots=True)
+class Field:
+    path: tuple[str, ...]  # `metadata.auto.accountid` -> ("metadata", "auto", "accountid")
+
+
+@dataclass(frozen=True, slots=True)
+class Member:
+    """`.name` applied to something other than a field path (e.g. a call or index)."""
+
+    target: Expr
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class Index:
+    target: Expr
+    index: Expr
+
+
+@dataclass(frozen=True, slots=True)
+class Slice:
+    target: Expr
+    start: Expr | None
+    end: Expr | None
+
+
+@dataclass(frozen=True, slots=True)
+class Call:
+    name: str
+    args: tuple[Expr, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class ListExpr:
+    items: tuple[Expr, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class Unary:
+    op: str  # "!" or "-"
+    operand: Expr
+
+
+@dataclass(frozen=True, slots=True)
+class Binary:
+    op: str
+    left: Expr
+    right: Expr
+
+
+Expr = Union[Literal, Field, Member, Index, Slice, Call, ListExpr, Unary, Binary]
+
+
+# Binding strength of binary operators; unary operators bind tighter than all of them.
+_BINARY_PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "==": 3,
+    "!=": 3,
+    "<": 3,
+    "<=": 3,
+    ">": 3,
+    ">=": 3,
+    "+": 4,
+    "-": 4,
+    "*": 5,
+    "/": 5,
+    "%": 5,
+}
+_UNARY_PRECEDENCE = 6
+_POSTFIX_PRECEDENCE = 7
+
+_KEYWORDS = {"true": True, "false": False, "null": None, "nil": None}
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:"
+    r"(?P<num>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)"
+    r'|(?P<str>"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|`[^`]*`)'
+    r"|(?P<name>[A-Za-z_$][\w$]*)"
+    r"|(?P<op>&&|\|\||==|!=|<=|>=|[-+*/%<>!()\[\],.:])"
+    r")"
+)
+
+# Token kinds.
+_NUM = "num"
+_STR = "str"
+_NAME = "name"
+_OP = "op"
+_END = "end"
+
+
+@lru_cache(maxsize=4096)
+def parse_expression(text: str) -> Expr:
+    """Parse a filter/eval/select expression; raises `ExpressionError` on bad syntax.
+
+    Results are cached per distinct string (see `parse_expression.cache_info()`), and
+    nodes are immutable, so callers may share them freely.
+    """
+    return _Parser(text).parse()
+
+
+def format_expression(expr: Expr) -> str:
+    """Canonical text for `expr`: single spaces around binary operators and only the
+    parentheses the precedence rules need. `parse_expression` of the result gives back
+    an equal tree."""
+    return _format(expr)
+
+
+def walk(expr: Expr) -> Iterator[Expr]:
+    """`expr` and all nodes below it, parents before children."""
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, Binary):
+            stack += (node.right, node.left)
+        elif isinstance(node, Unary):
+            stack.append(node.operand)
+        elif isinstance(node, (Call, ListExpr)):
+            stack += reversed(node.args if isinstance(node, Call) else node.items)
+        elif isinstance(node, Member):
+            stack.append(node.target)
+        elif isinstance(node, Index):
+            stack += (node.index, node.target)
+        elif isinstance(node, Slice):
+            stack += [e for e in (node.end, node.start) if e is not None]
+            stack.append(node.target)
+
+
+def field_paths(expr: Expr) -> frozenset[str]:
+    """The dotted field paths `expr` reads (`metadata.auto.accountid`, ...)."""
+    return frozenset(".".join(node.path) for node in walk(expr) if isinstance(node, Field))
+
+
+class _Parser:
+    __slots__ = ("text", "tokens", "pos")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def parse(self) -> Expr:
+        expr = self._binary(1)
+        kind, value, start = self.tokens[self.pos]
+        if kind != _END:
+            raise self._error(f"Unexpected {value!r}", start)
+        return expr
+
+    def _error(self, message: str, start: int) -> ExpressionError:
+        return ExpressionError(f"{message} at column {start + 1} in expression: {self.text}")
+
+    def _next(self) -> tuple[str, str, int]:
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def _peek_op(self, *ops: str) -> bool:
+        kind, value, _ = self.tokens[self.pos]
+        return kind == _OP and value in ops
+
+    def _expect(self, op: str) -> None:
+        kind, value, start = self._next()
+        if kind != _OP or value != op:
+            found = "end of expression" if kind == _END else repr(value)
+            raise self._error(f"Expected {op!r}, found {found}", start)
+
+    def _binary(self, min_prec: int) -> Expr:
+        left = self._unary()
+        while True:
+            kind, op, _ = self.tokens[self.pos]
+            prec = _BINARY_PRECEDENCE.get(op) if kind == _OP else None
+            if prec is None or prec < min_prec:
+                return left
+            self.pos += 1
+            left = Binary(op, left, self._binary(prec + 1))
+
+    def _unary(self) -> Expr:
+        if self._peek_op("!", "-"):
+            op = self._next()[1]
+            return Unary(op, self._unary())
+        return self._postfix(self._primary())
+
+    def _primary(self) -> Expr:
+        kind, value, start = self._next()
+        if kind == _NUM:
+            number = float(value) if any(c in value for c in ".eE") else int(value)
+            return Literal(number, value)
+        if kind == _STR:
+            return Literal(_unquote(value), value)
+        if kind == _NAME:
+            if value in _KEYWORDS:
+                return Literal(_KEYWORDS[value], value)
+            path = [sys.intern(value)]
+            while self._peek_op(".") and self.tokens[self.pos + 1][0] == _NAME:
+                self.pos += 1
+                path.append(sys.intern(self._next()[1]))
+            if self._peek_op("("):
+                self.pos += 1
+                return Call(".".join(path), self._items(")"))
+            return Field(tuple(path))
+        if kind == _OP and value == "(":
+            expr = self._binary(1)
+            self._expect(")")
+            return expr
+        if kind == _OP and value == "[":
+            return ListExpr(self._items("]"))
+        found = "end of expression" if kind == _END else repr(value)
+        raise self._error(f"Unexpected {found}", start)
+
+    def _items(self, closer: str) -> tuple[Expr, ...]:
+        items: list[Expr] = []
+        if self._peek_op(closer):
+            self.pos += 1
+            return ()
+        while True:
+            items.append(self._binary(1))
+            if self._peek_op(","):
+                self.pos += 1
+                continue
+            self._expect(closer)
+            return tuple(items)
+
+    def _postfix(self, expr: Expr) -> Expr:
+        while True:
+            if self._peek_op("["):
+                self.pos += 1
+                start = None if self._peek_op(":") else self._binary(1)
+                if self._peek_op(":"):
+                    self.pos += 1
+                    end = None if self._peek_op("]") else self._binary(1)
+                    self._expect("]")
+                    expr = Slice(expr, start, end)
+                else:
+                    self._expect("]")
+                    assert start is not None
+                    expr = Index(expr, start)
+            elif self._peek_op(".") and self.tokens[self.pos + 1][0] == _NAME:
+                self.pos += 1
+                expr = Member(expr, sys.intern(self._next()[1]))
+            else:
+                return expr
+
+
+def _tokenize(text: str) -> list[tuple[str, str, int]]:
+    tokens: list[tuple[str, str, int]] = []
+    pos = 0
+    end = len(text.rstrip())
+    while pos < end:
+        m = _TOKEN_RE.match(text, pos)
+        if m is None or m.lastgroup is None:
+            col = end - len(text[pos:end].lstrip())
+            raise ExpressionError(
+                f"Unexpected character {text[col]!r} at column {col + 1} in expression: {text}"
+            )
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind), m.start(kind)))
+        pos = m.end()
+    tokens.append((_END, "", len(text)))
+    return tokens
+
+
+def _unquote(token: str) -> str:
+    quote, body = token[0], token[1:-1]
+    if quote == "`":
+        return body
+    if quote == "'":
+        body = body.replace("\\'", "'").replace('"', '\\"')
+    try:
+        return json.loads(f'"{body}"')
+    except ValueError:
+        return body
+
+
+def _format(expr: Expr, parent_prec: int = 0) -> str:
+    if isinstance(expr, Literal):
+        return expr.text
+    if isinstance(expr, Field):
+        return ".".join(expr.path)
+    if isinstance(expr, Call):
+        return f"{expr.name}({', '.join(_format(a) for a in expr.args)})"
+    if isinstance(expr, ListExpr):
+        return f"[{', '.join(_format(i) for i in expr.items)}]"
+    if isinstance(expr, Member):
+        return f"{_format(expr.target, _POSTFIX_PRECEDENCE)}.{expr.name}"
+    if isinstance(expr, Index):
+        return f"{_format(expr.target, _POSTFIX_PRECEDENCE)}[{_format(expr.index)}]"
+    if isinstance(expr, Slice):
+        start = "" if expr.start is None else _format(expr.start)
+        end = "" if expr.end is None else _format(expr.end)
+        return f"{_format(expr.target, _POSTFIX_PRECEDENCE)}[{start}:{end}]"
+    if isinstance(expr, Unary):
+        operand = _format(expr.operand, _UNARY_PRECEDENCE)
+        # `- -x`, not `--x`, which many expression languages read as a decrement.
+        text = f"- {operand}" if expr.op == "-" and operand.startswith("-") else expr.op + operand
+        return f"({text})" if parent_prec > _UNARY_PRECEDENCE else text
+    prec = _BINARY_PRECEDENCE[expr.op]
+    # Binary operators are left-associative: a right operand of equal precedence keeps
+    # its parentheses.
+    text = f"{_format(expr.left, prec)} {expr.op} {_format(expr.right, prec + 1)}"
+    return f"({text})" if parent_prec > prec else text
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+from dataclasses import replace
+from datetime import datetime, timezone as dt_timezone, tzinfo
+from typing import Any
+
+try:
+    from .dsl_ast import Branches, MergePayload, Query, Stage, TimeSeries
+    from .expr import (
+        Binary,
+        Call,
+        Expr,
+        ExpressionError,
+        Index,
+        ListExpr,
+        Literal,
+        Member,
+        Slice,
+        Unary,
+        format_expression,
+        parse_expression,
+    )
+    from .optimize import Rewrite
+except ImportError:  # pragma: no cover
+    from dsl_ast import Branches, MergePayload, Query, Stage, TimeSeries  # type: ignore
+    from expr import (  # type: ignore
+        Binary,
+        Call,
+        Expr,
+        ExpressionError,
+        Index,
+        ListExpr,
+        Literal,
+        Member,
+        Slice,
+        Unary,
+        format_expression,
+        parse_expression,
+    )
+    from optimize import Rewrite  # type: ignore
+
+
+class FoldError(ValueError):
+    pass
+
+
+_ARITHMETIC = frozenset({"+", "-", "*"})
+
+
+def fold_constants(
+    query: Query, *, now_ms: int | None = None, timezone: str | tzinfo | None = None
+) -> tuple[Query, list[Rewrite]]:
+    """Evaluate constant sub-expressions in TIMESERIES values and filter/eval/select.
+
+    Folded are: `now()` when `now_ms` is given; `date(year, month, day[, hour[, min[,
+    sec]]])` with integer arguments when `timezone` is given (Pendo evaluates `date` in
+    the subscription's time zone, so it cannot be folded without one); and `+`, `-`, `*`
+    on integer literals. A TIMESERIES value that folds completely becomes an epoch-ms
+    int. Expressions that do not parse are left alone. Returns the folded query and a
+    `fold-constant` rewrite for each changed expression.
+    """
+    tz = resolve_timezone(timezone) if isinstance(timezone, str) else timezone
+    rewrites: list[Rewrite] = []
+    return _fold_query(query, _Folder(now_ms, tz), "pipeline", rewrites), rewrites
+
+
+def resolve_timezone(name: str) -> tzinfo:
+    """The `tzinfo` for an IANA time zone name (`UTC`, `Europe/Paris`, ...)."""
+    if name.upper() == "UTC":
+        return dt_timezone.utc
+    try:
+        from zoneinfo import ZoneInfo
+
+        return ZoneInfo(name)
+    except (ImportError, ValueError, KeyError) as e:
+        # `ZoneInfoNotFoundError` is a `KeyError`.
+        raise FoldError(f"Unknown time zone: {name}") from e
+
+
+class _Folder:
+    __slots__ = ("now_ms", "tz")
+
+    def __init__(self, now_ms: int | None, tz: tzinfo | None) -> None:
+        self.now_ms = now_ms
+        self.tz = tz
+
+    def text(self, value: str) -> Expr | None:
+        """The folded tree for `value`, or None when nothing changed."""
+        try:
+            expr = parse_expression(value)
+        except ExpressionError:
+            return None
+        folded = self.fold(expr)
+        return None if folded is expr else folded
+
+    def fold(self, expr: Expr) -> Expr:
+        # Returns `expr` itself when nothing below it changed.
+        if isinstance(expr, Binary):
+            left, right = self.fold(expr.left), self.fold(expr.right)
+            if expr.op in _ARITHMETIC and _is_int(left) and _is_int(right):
+                a, b = left.value, right.value  # type: ignore[union-attr]
+                return _int(a + b if expr.op == "+" else a - b if expr.op == "-" else a * b)
+            if left is expr.left and right is expr.right:
+                return expr
+            return Binary(expr.op, left, right)
+        if isinstance(expr, Unary):
+            operand = self.fold(expr.operand)
+            if operand is expr.operand:
+                return expr  # `-7` is already as folded as it gets
+            if expr.op == "-" and _is_int(operand):
+                return _int(-operand.value)  # type: ignore[union-attr]
+            return Unary(expr.op, operand)
+        if isinstance(expr, Call):
+            args = tuple(self.fold(a) for a in expr.args)
+            if expr.name == "now" and not args and self.now_ms is not None:
+                return _int(self.now_ms)
+            if expr.name == "date" and self.tz is not None and 3 <= len(args) <= 6:
+                if all(_is_int(a) for a in args):
+                    ms = _date_ms([a.value for a in args], self.tz)  # type: ignore[union-attr]
+                    if ms is not None:
+                        return _int(ms)
+            if all(a is b for a, b in zip(args, expr.args)):
+                return expr
+            return Call(expr.name, args)
+        if isinstance(expr, ListExpr):
+            items = tuple(self.fold(i) for i in expr.items)
+            return expr if all(a is b for a, b in zip(items, expr.items)) else ListExpr(items)
+        if isinstance(expr, Index):
+            target, index = self.fold(expr.target), self.fold(expr.index)
+            return expr if target is expr.target and index is expr.index else Index(target, index)
+        if isinstance(expr, Slice):
+            target = self.fold(expr.target)
+            start = None if expr.start is None else self.fold(expr.start)
+            end = None if expr.end is None else self.fold(expr.end)
+            if target is expr.target and start is expr.start and end is expr.end:
+                return expr
+            return Slice(target, start, end)
+        if isinstance(expr, Member):
+            target = self.fold(expr.target)
+            return expr if target is expr.target else Member(target, expr.name)
+        return expr
+
+
+def _is_int(expr: Expr) -> bool:
+    return isinstance(expr, Literal) and type(expr.value) is int
+
+
+def _int(value: int) -> Literal:
+    return Literal(value, str(value))
+
+
+def _date_ms(parts: list[int], tz: tzinfo) -> int | None:
+    try:
+        moment = datetime(*parts, tzinfo=tz)  # type: ignore[misc]
+    except (ValueError, OverflowError):
+        return None
+    return int(moment.timestamp()) * 1000
+
+
+def _fold_query(query: Query, folder: _Folder, location: str, rewrites: list[Rewrite]) -> Query:
+    ts = query.time_series
+    if ts is not None:
+        ts = _fold_time_series(ts, folder, location, rewrites)
+
+    stages: list[Stage] = []
+    for pos, stage in enumerate(query.stages, start=1):
+        here = f"{location}/{stage.kind}@{pos}"
+        payload = stage.payload
+        if stage.kind == "filter":
+            folded = folder.text(payload)
+            if folded is not None:
+                text = format_expression(folded)
+                rewrites.append(Rewrite("fold-constant", location, f"stage {pos} filter: {payload} -> {text}"))
+                payload = text
+        elif stage.kind in ("eval", "select"):
+            payload = _fold_map(payload, folder, location, f"stage {pos} {stage.kind}", rewrites)
+        elif stage.kind == "merge":
+            nested = _fold_query(payload.query, folder, here, rewrites)
+            if nested is not payload.query:
+                payload = MergePayload(payload.fields, payload.mappings, nested)
+        elif stage.kind in ("fork", "spawn") and isinstance(payload, Branches):
+            branches = tuple(
+                _fold_query(q, folder, f"{here}/branch {i}", rewrites)
+                for i, q in enumerate(payload, start=1)
+            )
+            if any(a is not b for a, b in zip(branches, payload)):
+                payload = Branches(branches)
+        stages.append(stage if payload is stage.payload else Stage(stage.kind, payload))
+
+    if ts is query.time_series and all(a is b for a, b in zip(stages, query.stages)):
+        return query
+    return replace(query, time_series=ts, stages=tuple(stages))
+
+
+def _fold_time_series(ts: TimeSeries, folder: _Folder, location: str, rewrites: list[Rewrite]) -> TimeSeries:
+    changes: dict[str, Any] = {}
+    for name in ("first", "last"):
+        value = getattr(ts, name)
+        if not isinstance(value, str):
+            continue
+        folded = folder.text(value)
+        if folded is None:
+            continue
+        new: int | str = folded.value if _is_int(folded) else format_expression(folded)  # type: ignore[union-attr]
+        rewrites.append(Rewrite("fold-constant", location, f"TIMESERIES {name}: {value} -> {new}"))
+        changes[name] = new
+    return replace(ts, **changes) if changes else ts
+
+
+def _fold_map(
+    payload: dict[str, Any], folder: _Folder, location: str, where: str, rewrites: list[Rewrite]
+) -> dict[str, Any]:
+    out: dict[str, Any] | None = None
+    for key, value in payload.items():
+        if not isinstance(value, str):
+            continue
+        folded = folder.text(value)
+        if folded is None:
+            continue
+        text = format_expression(folded)
+        rewrites.append(Rewrite("fold-constant", location, f"{where} {key}: {value} -> {text}"))
+        if out is None:
+            out = dict(payload)
+        out[key] = text
+    return payload if out is None else out
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from itertools import islice
+from typing import Any, Iterable, Iterator, NamedTuple
+
+
+# Structural tokens only: quoted strings, escapes, brackets and commas. Everything
+# between two structural tokens is plain content and is never materialized. Whitespace
+# runs are only tokenized on request (`key=value key=value` header lines).
+_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"?|\\.?|[()\[\]{},]')
+_SPACED_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"?|\\.?|[()\[\]{},]|\s+')
+
+_OPENERS = "([{"
+_CLOSERS = ")]}"
+
+# Token kinds. Brackets and commas use the character itself as their kind.
+STRING = '"'
+ESCAPE = "\\"
+SPACE = " "
+COMMA = ","
+
+
+# Fast path for splitting: one regex that matches a whole top-level item, including
+# quoted strings and bracket groups nested up to `_MAX_FAST_DEPTH` levels. The patterns
+# are written as unrolled loops so a failed match backtracks linearly. Inputs the regex
+# cannot cover (deeper nesting, unbalanced brackets) fall back to the token scanner.
+_MAX_FAST_DEPTH = 6
+_STR = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_ESC = r"\\."
+_IN_GROUP = r'[^"\\()\[\]{}]'
+
+
+def _item_pattern(plain: str) -> re.Pattern[str]:
+    group = rf"[(\[{{]{_IN_GROUP}*(?:(?:{_STR}|{_ESC}){_IN_GROUP}*)*[)\]}}]"
+    for _ in range(_MAX_FAST_DEPTH - 1):
+        group = rf"[(\[{{]{_IN_GROUP}*(?:(?:{_STR}|{_ESC}|{group}){_IN_GROUP}*)*[)\]}}]"
+    return re.compile(rf"{plain}*(?:(?:{_STR}|{_ESC}|{group}){plain}*)*")
+
+
+_COMMA_ITEM_RE = _item_pattern(r'[^"\\()\[\]{},]')
+_SPACE_ITEM_RE = _item_pattern(r'[^\s"\\()\[\]{}]')
+_SPACE_RUN_RE = re.compile(r"\s+")
+_QUOTED_RE = re.compile(r'"(?:[^"\\]|\\.)*"?|\\.?')
+
+
+class Token(NamedTuple):
+    kind: str
+    start: int
+    end: int
+    # Bracket nesting depth of the container the token belongs to. Opening and closing
+    # brackets report the depth outside of the group they delimit.
+    depth: int
+
+
+def _scan(text: str, pattern: re.Pattern[str]) -> list[Token]:
+    # Plain tuples are built in the loop (this is the hot path); they are
+    # structurally identical to `Token`.
+    tokens: list[Any] = []
+    append = tokens.append
+    depth = 0
+    for m in pattern.finditer(text):
+        start, end = m.span()
+        ch = text[start]
+        if ch in _OPENERS:
+            append((ch, start, end, depth))
+            depth += 1
+        elif ch in _CLOSERS:
+            if depth > 0:
+                depth -= 1
+            append((ch, start, end, depth))
+        elif ch.isspace():
+            append((SPACE, start, end, depth))
+        else:
+            append((ch, start, end, depth))
+    return tokens
+
+
+class Line:
+    """One logical DSL line with comments and surrounding whitespace removed.
+
+    Tokens are scanned on first use and cached, so lines whose payload is never split
+    (filter expressions, JSON payloads) are not tokenized at all.
+    """
+
+    __slots__ = ("text", "number", "_tokens", "_spaced_tokens")
+
+    def __init__(self, text: str, number: int = 0) -> None:
+        self.text = text
+        self.number = number
+        self._tokens: list[Token] | None = None
+        self._spaced_tokens: list[Token] | None = None
+
+    def __repr__(self) -> str:
+        return f"Line({self.text!r}, number={self.number})"
+
+    @property
+    def tokens(self) -> list[Token]:
+        if self._tokens is None:
+            self._tokens = _scan(self.text, _TOKEN_RE)
+        return self._tokens
+
+    @property
+    def spaced_tokens(self) -> list[Token]:
+        """Like `tokens`, plus `SPACE` tokens for whitespace runs."""
+        if self._spaced_tokens is None:
+            self._spaced_tokens = _scan(self.text, _SPACED_TOKEN_RE)
+        return self._spaced_tokens
+
+    def brace_counts(self) -> tuple[int, int]:
+        """Number of `{` and `}` outside of quoted strings."""
+        text = self.text
+        if '"' in text or "\\" in text:
+            text = _QUOTED_RE.sub("", text)
+        return text.count("{"), text.count("}")
+
+    def span(self, start: int = 0, end: int | None = None) -> Span:
+        return Span(self, start, self.text[start:end])
+
+
+class Span:
+    """A slice of a `Line` that shares the line's tokens."""
+
+    __slots__ = ("line", "start", "text")
+
+    def __init__(self, line: Line, start: int, text: str) -> None:
+        self.line = line
+        self.start = start
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"Span({self.text!r})"
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+    def sub(self, start: int, end: int | None = None) -> Span:
+        """Return the sub-span at offsets relative to this span."""
+        return Span(self.line, self.start + start, self.text[start:end])
+
+    def strip(self) -> Span:
+        return _stripped(self.line, self.start, self.text)
+
+    def inner(self) -> Span:
+        """Drop the first and last character (the delimiters of a bracketed group)."""
+        return _stripped(self.line, self.start + 1, self.text[1:-1])
+
+    def partition(self, sep: str) -> tuple[Span, Span] | None:
+        """Split at the first occurrence of `sep`; both halves are stripped."""
+        text = self.text
+        pos = text.find(sep)
+        if pos < 0:
+            return None
+        after = pos + len(sep)
+        return (
+            _stripped(self.line, self.start, text[:pos]),
+            _stripped(self.line, self.start + after, text[after:]),
+        )
+
+    def split(self, kind: str) -> list[Span]:
+        """Split on top-level separators (`COMMA` or `SPACE`).
+
+        Separators nested inside quotes or brackets do not split. Parts are stripped
+        and empty parts are dropped.
+        """
+        parts = self._split_fast(kind)
+        if parts is None:
+            parts = self._split_tokens(kind)
+        return parts
+
+    def _split_fast(self, kind: str) -> list[Span] | None:
+        text = self.text
+        n = len(text)
+        line = self.line
+        offset = self.start
+        item_match = (_SPACE_ITEM_RE if kind == SPACE else _COMMA_ITEM_RE).match
+        parts: list[Span] = []
+        pos = 0
+        while True:
+            end = item_match(text, pos).end()
+            if end > pos:
+                piece = text[pos:end]
+                if not piece.isspace():
+                    parts.append(_stripped(line, offset + pos, piece))
+            if end == n:
+                return parts
+            if kind == SPACE:
+                sep = _SPACE_RUN_RE.match(text, end)
+                if sep is None:
+                    return None
+                pos = sep.end()
+            elif text[end] == ",":
+                pos = end + 1
+            else:
+                return None
+
+    def _split_tokens(self, kind: str) -> list[Span]:
+        line = self.line
+        tokens = line.spaced_tokens if kind == SPACE else line.tokens
+        start = self.start
+        end = start + len(self.text)
+
+        # Find the first token inside the span and the container depth at that point.
+        idx = bisect_left(tokens, start, key=_token_start)
+        base = 0
+        if idx:
+            prev = tokens[idx - 1]
+            base = prev[3] + 1 if prev[0] in _OPENERS else prev[3]
+
+        text = line.text
+        parts: list[Span] = []
+        part_start = start
+        for tok in islice(tokens, idx, None):
+            if tok[1] >= end:
+                break
+            if tok[0] == kind and tok[3] == base:
+                piece = text[part_start : tok[1]]
+                if piece and not piece.isspace():
+                    parts.append(_stripped(line, part_start, piece))
+                part_start = tok[2]
+        piece = text[part_start:end]
+        if piece and not piece.isspace():
+            parts.append(_stripped(line, part_start, piece))
+        return parts
+
+
+def _token_start(tok: Token) -> int:
+    return tok[1]
+
+
+def _stripped(line: Line, start: int, text: str) -> Span:
+    stripped = text.strip()
+    if stripped is not text and stripped:
+        # The first occurrence of the stripped text starts at the first non-space char.
+        start += text.find(stripped)
+    return Span(line, start, stripped)
+
+
+def tokenize(dsl: str | Iterable[str]) -> Iterator[Line]:
+    """Yield the meaningful lines of a DSL document in a single pass.
+
+    `dsl` is either the document text or an iterable of raw lines (e.g. an open file,
+    which is then read lazily). Whole-line `//` comments, `#` lines and blank lines are
+    skipped; inline comments are treated as content.
+    """
+    raw_lines = dsl.splitlines() if isinstance(dsl, str) else dsl
+    for number, raw in enumerate(raw_lines, start=1):
+        text = raw.strip()
+        if not text or text.startswith("#") or text.startswith("//"):
+            continue
+        yield Line(text, number)
@@ -0,0 +1,677 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, fields, is_dataclass, replace
+from typing import Any, Hashable, Iterable
+
+try:
+    from .dsl_ast import Branches, GroupPayload, MergePayload, Query, Stage, SwitchPayload
+    from .expr import ExpressionError, field_paths, parse_expression
+except ImportError:  # pragma: no cover
+    from dsl_ast import (  # type: ignore
+        Branches,
+        GroupPayload,
+        MergePayload,
+        Query,
+        Stage,
+        SwitchPayload,
+    )
+    from expr import ExpressionError, field_paths, parse_expression  # type: ignore
+
+
+# Aggregates whose result does not depend on the order of the rows in a group; a
+# `sort` directly before a `group` that only uses these has no observable effect.
+# Anything else (`first`, `list`, unknown functions) keeps the sort.
+_ORDER_INSENSITIVE_AGGREGATES = frozenset(
+    {"sum", "count", "countIf", "avg", "mean", "median", "min", "max"}
+)
+
+# Fallback for expressions `parse_expression` rejects: dotted identifiers outside
+# string literals that are not function names or literals.
+_EXPR_TOKEN_RE = re.compile(
+    r'"(?:[^"\\]|\\.)*"'
+    r"|'(?:[^'\\]|\\.)*'"
+    r"|(?P<name>[A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*)*)(?P<call>\s*\()?"
+)
+_LITERAL_NAMES = frozenset({"true", "false", "null", "nil"})
+
+
+@dataclass(frozen=True, slots=True)
+class Rewrite:
+    """One applied optimization, for `--explain-optimizations`.
+
+    `location` names the pipeline (`pipeline`, `pipeline/merge@3/fork@1/branch 2`, ...) and
+    stage numbers are 1-based positions in that pipeline as rewritten so far.
+    """
+
+    rule: str
+    location: str
+    detail: str
+
+    def __str__(self) -> str:
+        return f"{self.location}: {self.detail}"
+
+
+def optimize(query: Query) -> tuple[Query, list[Rewrite]]:
+    """Rewrite `query` into an equivalent query with fewer, earlier-filtering stages.
+
+    Rules, applied in one left-to-right pass over each pipeline (nested merge, fork
+    and spawn pipelines included):
+
+    - `filter` moves ahead of `eval`/`select` stages it does not depend on: an `eval`
+      whose computed fields it does not reference, or a `select` that passes every
+      field it references through unchanged.
+    - Adjacent `filter` stages merge into one `(a) && (b)` expression.
+    - A `sort` directly before a `group` with only order-insensitive aggregates is dropped.
+    - Consecutive `limit` stages collapse to the smallest limit.
+    - Stages shared by every branch of a `fork` block are hoisted ahead of the fork
+      (each branch receives the same input stream). A `spawn` that starts a pipeline
+      without a source, and whose branches all scan the same `FROM`/`TIMESERIES`,
+      becomes that source followed by their shared stages and a `fork` of the rest,
+      so the event window is scanned once. Prefixes shared where no rewrite is
+      possible are reported only (rule `shared-prefix`).
+
+    A second, backward pass then pushes projections down (see `_push_down`): once a
+    later `select`/`group` decides which fields survive, earlier `select`, `eval` and
+    `unmarshal` stages and `merge` mappings are narrowed to the fields actually read
+    downstream, and `select` stages are inserted ahead of `merge`/`unwind` stages and
+    at the end of `merge` pipelines.
+
+    Returns the optimized query and the rewrites applied, in order.
+    """
+    rewrites: list[Rewrite] = []
+    query = _optimize_query(query, "pipeline", rewrites, standalone=True)
+    return _push_down(query, None, "pipeline", rewrites), rewrites
+
+
+def _optimize_query(
+    query: Query, location: str, rewrites: list[Rewrite], *, standalone: bool = False
+) -> Query:
+    """Apply the forward rules. `standalone` queries (the top level and merge pipelines)
+    receive no input rows, so a leading `spawn` may be turned into a source."""
+    original = query
+    if standalone:
+        query = _hoist_spawn_source(query, location, rewrites)
+
+    out: list[Stage] = []
+    # The last filter produced by merging, already in `(a) && (b)` form. Only that one
+    # can be reached by a later filter, since filters cannot move past each other.
+    conjunction: Stage | None = None
+    # Stages left to process, last first; hoisted fork prefixes are pushed back here so
+    # the rules also apply to them.
+    pending = list(reversed(query.stages))
+    hoisted_fork: Stage | None = None
+    while pending:
+        stage = pending.pop()
+        if stage is not hoisted_fork:
+            location_here = f"{location}/{stage.kind}@{len(out) + 1}"
+            stage = _optimize_nested(stage, location_here, rewrites)
+            if stage.kind in ("fork", "spawn") and isinstance(stage.payload, Branches):
+                prefix, stage = _hoist_branch_prefix(stage, location, len(out) + 1, rewrites)
+                if prefix:
+                    hoisted_fork = stage
+                    pending.append(stage)
+                    pending.extend(reversed(prefix))
+                    continue
+
+        if stage.kind == "filter":
+            passed: list[Stage] = []
+            while out and not _filter_depends_on(stage.payload, out[-1]):
+                passed.append(out.pop())
+            if passed:
+                rewrites.append(
+                    Rewrite(
+                        "hoist-filter",
+                        location,
+                        f"stage {len(out) + len(passed) + 1}: moved filter ahead of "
+                        + ", ".join(s.kind for s in reversed(passed))
+                        + f" (now stage {len(out) + 1})",
+                    )
+                )
+            if out and out[-1].kind == "filter":
+                previous = out[-1]
+                left = previous.payload if previous is conjunction else f"({previous.payload})"
+                merged = f"{left} && ({stage.payload})"
+                rewrites.append(
+                    Rewrite(
+                        "merge-filters",
+                        location,
+                        f"stages {len(out)}+{len(out) + 1}: merged adjacent filters into {merged}",
+                    )
+                )
+                stage = conjunction = Stage(kind="filter", payload=merged)
+                out.pop()
+            out.append(stage)
+            out.extend(reversed(passed))
+            continue
+
+        if stage.kind == "limit" and out and out[-1].kind == "limit":
+            previous = out.pop()
+            n = min(int(previous.payload), int(stage.payload))
+            rewrites.append(
+                Rewrite(
+                    "collapse-limits",
+                    location,
+                    f"stages {len(out) + 1}+{len(out) + 2}: collapsed limit "
+                    f"{previous.payload}, {stage.payload} into limit {n}",
+                )
+            )
+            stage = Stage(kind="limit", payload=n)
+
+        elif (
+            stage.kind == "group"
+            and out
+            and out[-1].kind == "sort"
+            and _order_insensitive(stage.payload)
+        ):
+            dropped = out.pop()
+            rewrites.append(
+                Rewrite(
+                    "drop-sort-before-group",
+                    location,
+                    f"stage {len(out) + 1}: dropped sort {','.join(dropped.payload)} before group",
+                )
+            )
+
+        out.append(stage)
+
+    if len(out) == len(original.stages) and all(a is b for a, b in zip(out, original.stages)):
+        return original
+    return replace(query, stages=tuple(out))
+
+
+def _optimize_nested(stage: Stage, location: str, rewrites: list[Rewrite]) -> Stage:
+    payload = stage.payload
+    if isinstance(payload, MergePayload):
+        nested = _optimize_query(payload.query, location, rewrites, standalone=True)
+        if nested is not payload.query:
+            return replace(stage, payload=replace(payload, query=nested))
+    elif isinstance(payload, Branches):
+        branches = tuple(
+            _optimize_query(q, f"{location}/branch {i}", rewrites)
+            for i, q in enumerate(payload.queries, start=1)
+        )
+        if any(a is not b for a, b in zip(branches, payload.queries)):
+            return replace(stage, payload=Branches(branches))
+    return stage
+
+
+def structural_key(node: Any) -> Hashable:
+    """A hashable key for an AST node or payload value.
+
+    Nodes with equal keys compile to identical JSON: the key keeps dict order and
+    tells apart values that compare equal in Python but not in JSON (`1`, `1.0`, `True`).
+    """
+    if node is None or isinstance(node, (str, int, float)):
+        return (type(node).__name__, node)
+    if isinstance(node, dict):
+        return ("{}", tuple((k, structural_key(v)) for k, v in node.items()))
+    if isinstance(node, (list, tuple)):
+        return ("[]", tuple(structural_key(v) for v in node))
+    if is_dataclass(node):
+        return (
+            type(node).__name__,
+            tuple(structural_key(getattr(node, f.name)) for f in fields(node)),
+        )
+    raise TypeError(f"Unsupported AST value: {type(node).__name__}")
+
+
+def prefix_hashes(query: Query) -> list[int]:
+    """Rolling structural hashes of the prefixes of `query`.
+
+    Element 0 covers the source (`FROM` and `TIMESERIES`); element i covers the source
+    and the first i stages. Queries with equal elements i almost certainly share that
+    prefix; confirm with `structural_key` before relying on it.
+    """
+    h = hash((structural_key(query.event_source), structural_key(query.time_series)))
+    hashes = [h]
+    for stage in query.stages:
+        h = hash((h, structural_key(stage)))
+        hashes.append(h)
+    return hashes
+
+
+def _shared_stages(branches: tuple[Query, ...], hashes: list[list[int]]) -> int:
+    """The number of leading stages all `branches` share (sources must match too)."""
+    first = branches[0]
+    if any(
+        structural_key((q.event_source, q.time_series))
+        != structural_key((first.event_source, first.time_series))
+        for q in branches[1:]
+    ):
+        return -1
+    n = 0
+    limit = min(len(q.stages) for q in branches)
+    while n < limit and all(h[n + 1] == hashes[0][n + 1] for h in hashes[1:]):
+        key = structural_key(first.stages[n])
+        if any(structural_key(q.stages[n]) != key for q in branches[1:]):
+            break
+        n += 1
+    return n
+
+
+def _hoist_branch_prefix(
+    stage: Stage, location: str, pos: int, rewrites: list[Rewrite]
+) -> tuple[list[Stage], Stage]:
+    """Split the stages shared by every branch of a fork block off ahead of it."""
+    branches = stage.payload.queries
+    if len(branches) < 2:
+        return [], stage
+    hashes = [prefix_hashes(q) for q in branches]
+    shared = _shared_stages(branches, hashes)
+    sourced = branches[0].event_source is not None or branches[0].time_series is not None
+
+    if stage.kind == "spawn" or sourced:
+        # Spawn branches (and fork branches with a FROM) do not read the input stream;
+        # only a leading spawn in a source-less pipeline can be rewritten, earlier.
+        _report_shared(stage.kind, branches, hashes, location, pos, rewrites)
+        return [], stage
+
+    # Every branch keeps at least one stage.
+    n = min(shared, min(len(q.stages) for q in branches) - 1)
+    if n <= 0:
+        _report_shared(stage.kind, branches, hashes, location, pos, rewrites)
+        return [], stage
+
+    prefix = list(branches[0].stages[:n])
+    rewrites.append(
+        Rewrite(
+            "hoist-shared-prefix",
+            location,
+            f"stage {pos}: hoisted {_describe(prefix)} shared by all {len(branches)} "
+            f"fork branches ahead of the fork",
+        )
+    )
+    rest = Branches(tuple(replace(q, stages=q.stages[n:]) for q in branches))
+    return prefix, replace(stage, payload=rest)
+
+
+def _hoist_spawn_source(query: Query, location: str, rewrites: list[Rewrite]) -> Query:
+    """Turn `PIPELINE | spawn <branches with the same source>` into one source scan.
+
+    `FROM s | x | y` and `FROM s | x | z` become `FROM s | x | fork [ y ] [ z ]`: spawn and
+    fork both concatenate their branch outputs, and fork feeds every branch the same
+    stream, so the shared source and stages run once.
+    """
+    if query.event_source is not None or query.time_series is not None or not query.stages:
+        return query
+    spawn = query.stages[0]
+    if spawn.kind != "spawn" or not isinstance(spawn.payload, Branches):
+        return query
+    branches = spawn.payload.queries
+    if len(branches) < 2 or branches[0].event_source is None:
+        return query
+
+    hashes = [prefix_hashes(q) for q in branches]
+    shared = _shared_stages(branches, hashes)
+    n = min(shared, min(len(q.stages) for q in branches) - 1)
+    if n < 0:
+        return query
+
+    first = branches[0]
+    rest = tuple(
+        replace(q, event_source=None, time_series=None, stages=q.stages[n:]) for q in branches
+    )
+    prefix = first.stages[:n]
+    rewrites.append(
+        Rewrite(
+            "hoist-spawn-source",
+            location,
+            f"stage 1: spawn branches all scan {first.event_source.source_type}; scanned once "
+            + (f"with {_describe(prefix)} " if prefix else "")
+            + f"and forked into {len(branches)} branches",
+        )
+    )
+    return replace(
+        query,
+        event_source=first.event_source,
+        time_series=first.time_series,
+        stages=(*prefix, Stage(kind="fork", payload=Branches(rest)), *query.stages[1:]),
+    )
+
+
+def _report_shared(
+    kind: str,
+    branches: tuple[Query, ...],
+    hashes: list[list[int]],
+    location: str,
+    pos: int,
+    rewrites: list[Rewrite],
+) -> None:
+    # Group branches by source, then report each group's shared prefix.
+    groups: dict[int, list[int]] = {}
+    for i, h in enumerate(hashes):
+        groups.setdefault(h[0], []).append(i)
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        group = tuple(branches[i] for i in members)
+        shared = _shared_stages(group, [hashes[i] for i in members])
+        if shared < 0:
+            continue
+        source = group[0].event_source
+        parts = [f"FROM {source.source_type}"] if source is not None else []
+        if shared:
+            parts.append(_describe(group[0].stages[:shared]))
+        if not parts:
+            continue
+        rewrites.append(
+            Rewrite(
+                "shared-prefix",
+                location,
+                f"stage {pos}: {kind} branches "
+                + ", ".join(str(i + 1) for i in members)
+                + f" share {' + '.join(parts)} (not hoisted)",
+            )
+        )
+
+
+def _describe(stages: Iterable[Stage]) -> str:
+    kinds = [s.kind for s in stages]
+    return f"{len(kinds)} stage{'s' if len(kinds) != 1 else ''} ({', '.join(kinds)})"
+
+
+def _filter_depends_on(expr: str, stage: Stage) -> bool:
+    """Whether a filter after `stage` must stay after it."""
+    if stage.kind == "eval":
+        computed = {_root(k) for k in stage.payload}
+        return any(_root(name) in computed for name in _field_refs(expr))
+    if stage.kind == "select":
+        # Only fields the select passes through unchanged exist before and after it.
+        # Keys are compared as written: a quoted key names a different field.
+        passthrough = {k for k, v in stage.payload.items() if k == v}
+        return any(_root(name) not in passthrough for name in _field_refs(expr))
+    return True
+
+
+def _field_refs(expr: str) -> set[str]:
+    try:
+        return set(field_paths(parse_expression(expr)))
+    except ExpressionError:
+        pass
+    refs = set()
+    for m in _EXPR_TOKEN_RE.finditer(expr):
+        name = m.group("name")
+        if name and not m.group("call") and name not in _LITERAL_NAMES:
+            refs.add(name)
+    return refs
+
+
+def _root(name: str) -> str:
+    return name.split(".", 1)[0]
+
+
+def _order_insensitive(group: GroupPayload) -> bool:
+    return all(field.agg in _ORDER_INSENSITIVE_AGGREGATES for field in group.fields)
+
+
+# Projection pushdown.
+#
+# `needed` is the set of root field names (`a` for `a.b.c`) that stages after a point
+# in the pipeline may read, or None when any field may be read: at the end of a query
+# (its output is the result) and before stages whose reads are unknown (join, raw JSON,
+# fork/spawn, ...). Only a `select` or `group` turns None into a known set, since their
+# output contains nothing else; reads are over-approximated, never missed.
+
+_Needed = frozenset[str] | None
+
+# Stages that define their complete output; a select right before them is redundant.
+_PROJECTIONS = ("select", "group")
+
+
+def _push_down(
+    query: Query,
+    needed: _Needed,
+    location: str,
+    rewrites: list[Rewrite],
+    *,
+    project_output: bool = False,
+) -> Query:
+    """Narrow `query` given the fields its consumers read (None: all of them).
+
+    Stages are narrowed back to front. A forward sweep then inserts a `select` ahead
+    of each `merge`/`unwind` (and, with `project_output`, at the end) wherever the rows
+    may still carry fields that are not needed.
+    """
+    narrowed: list[tuple[int, Stage, _Needed]] = []
+    needed_before = needed
+    for pos in range(len(query.stages), 0, -1):
+        stage, needed_before = _push_down_stage(
+            query.stages[pos - 1], needed_before, location, pos, rewrites
+        )
+        if stage is not None:
+            narrowed.append((pos, stage, needed_before))
+    narrowed.reverse()
+
+    out: list[Stage] = []
+    schema: _Needed = None  # The fields rows are known to have; None if unknown.
+    for pos, stage, stage_needs in narrowed:
+        if stage.kind in ("merge", "unwind") and _wider(schema, stage_needs):
+            out.append(_identity_select(stage_needs))
+            schema = stage_needs
+            rewrites.append(
+                Rewrite(
+                    "insert-select",
+                    location,
+                    f"stage {pos}: inserted select {{ {', '.join(sorted(stage_needs))} }} "
+                    f"before {stage.kind}",
+                )
+            )
+        out.append(stage)
+        schema = _schema_after(stage, schema)
+
+    if project_output and _wider(schema, needed):
+        out.append(_identity_select(needed))
+        rewrites.append(
+            Rewrite(
+                "insert-select",
+                location,
+                f"end: inserted select {{ {', '.join(sorted(needed))} }}",
+            )
+        )
+
+    stages = tuple(out)
+    if len(stages) == len(query.stages) and all(a is b for a, b in zip(stages, query.stages)):
+        return query
+    return replace(query, stages=stages)
+
+
+def _wider(schema: _Needed, needed: _Needed) -> bool:
+    """Whether rows with `schema` may hold fields outside a known, non-empty `needed`."""
+    if not needed:
+        return False
+    return schema is None or not schema <= needed
+
+
+def _schema_after(stage: Stage, schema: _Needed) -> _Needed:
+    """The fields rows have after `stage`, given the fields they had before it."""
+    kind = stage.kind
+    payload = stage.payload
+    if kind == "select":
+        return frozenset(_root(k) for k in payload)
+    if isinstance(payload, GroupPayload):
+        return frozenset({_root(g) for g in payload.group} | {f.alias for f in payload.fields})
+    if schema is None:
+        return None
+    if kind in ("filter", "identified", "sort", "limit"):
+        return schema
+    if kind in ("eval", "unmarshal"):
+        return schema | {_root(k) for k in payload}
+    if isinstance(payload, SwitchPayload):
+        return schema | {payload.out}
+    if kind == "unwind" and isinstance(payload.get("index"), str):
+        return schema | {payload["index"]}
+    if kind == "unwind":
+        return schema
+    if isinstance(payload, MergePayload) and payload.mappings is not None:
+        return schema | {_root(out) for out in payload.mappings}
+    return None
+
+
+def _push_down_stage(
+    stage: Stage, after: _Needed, location: str, pos: int, rewrites: list[Rewrite]
+) -> tuple[Stage | None, _Needed]:
+    """Narrow one stage. Returns the stage (None if dropped) and the fields it needs."""
+    kind = stage.kind
+    payload = stage.payload
+
+    if kind == "filter":
+        return stage, _union(after, _field_refs(payload))
+    if kind == "identified":
+        return stage, _union(after, {_root(payload)})
+    if kind == "sort":
+        return stage, _union(after, {_root(k.lstrip("+-")) for k in payload})
+    if kind == "limit":
+        return stage, after
+
+    if kind in ("eval", "unmarshal"):
+        if after is not None:
+            keep = _referenced_keys(payload, after)
+            if not keep:
+                rewrites.append(
+                    Rewrite(f"drop-{kind}", location, f"stage {pos}: dropped unused {kind}")
+                )
+                return None, after
+            if len(keep) < len(payload):
+                rewrites.append(
+                    Rewrite(
+                        f"narrow-{kind}",
+                        location,
+                        f"stage {pos}: dropped unused {kind} fields "
+                        + ", ".join(k for k in payload if k not in keep),
+                    )
+                )
+                payload = {k: v for k, v in payload.items() if k in keep}
+                stage = replace(stage, payload=payload)
+            # Computed fields replace the input fields of the same name.
+            after = after - {k for k in payload if "." not in k}
+        return stage, _union(after, _value_refs(payload.values()))
+
+    if kind == "select":
+        if after is not None:
+            keep = {k for k in payload if _root(k) in after}
+            if keep and len(keep) < len(payload):
+                rewrites.append(
+                    Rewrite(
+                        "narrow-select",
+                        location,
+                        f"stage {pos}: dropped unused select fields "
+                        + ", ".join(k for k in payload if k not in keep),
+                    )
+                )
+                payload = {k: v for k, v in payload.items() if k in keep}
+                stage = replace(stage, payload=payload)
+        return stage, frozenset(_value_refs(payload.values()))
+
+    if isinstance(payload, GroupPayload):
+        reads = {_root(g) for g in payload.group} | _value_refs(f.arg for f in payload.fields)
+        return stage, frozenset(reads)
+
+    if isinstance(payload, SwitchPayload):
+        if after is None:
+            return stage, None
+        return stage, (after - {payload.out}) | {_root(payload.field)}
+
+    if kind == "unwind":
+        if after is None or not set(payload) <= {"field", "index", "keepEmpty"}:
+            return stage, None
+        needed = set(after)
+        if isinstance(payload.get("index"), str):
+            needed.discard(payload["index"])
+        if isinstance(payload.get("field"), str):
+            needed.add(_root(payload["field"]))
+        return stage, frozenset(needed)
+
+    if isinstance(payload, MergePayload):
+        return _push_down_merge(stage, payload, after, location, pos, rewrites)
+
+    if isinstance(payload, Branches):
+        branches = tuple(
+            _push_down(q, None, f"{location}/{kind}@{pos}/branch {i}", rewrites)
+            for i, q in enumerate(payload.queries, start=1)
+        )
+        if any(a is not b for a, b in zip(branches, payload.queries)):
+            stage = replace(stage, payload=Branches(branches))
+        return stage, None
+
+    return stage, None
+
+
+def _push_down_merge(
+    stage: Stage,
+    payload: MergePayload,
+    after: _Needed,
+    location: str,
+    pos: int,
+    rewrites: list[Rewrite],
+) -> tuple[Stage, _Needed]:
+    nested_location = f"{location}/merge@{pos}"
+    if payload.mappings is None:
+        # Every field of the merged rows is copied in, and may shadow a main-pipeline
+        # field: neither side can be narrowed.
+        nested = _push_down(payload.query, None, nested_location, rewrites)
+        if nested is not payload.query:
+            stage = replace(stage, payload=replace(payload, query=nested))
+        return stage, None
+
+    mappings = payload.mappings
+    if after is not None:
+        kept = {out: src for out, src in mappings.items() if _root(out) in after}
+        if kept and len(kept) < len(mappings):
+            rewrites.append(
+                Rewrite(
+                    "trim-merge-mappings",
+                    location,
+                    f"stage {pos}: dropped unused merge mappings "
+                    + ", ".join(out for out in mappings if out not in kept),
+                )
+            )
+            mappings = kept
+
+    # Merged rows only need the join fields and the mapped sources.
+    nested_needed = frozenset({_root(f) for f in payload.fields} | _value_refs(mappings.values()))
+    nested = _push_down(
+        payload.query, nested_needed, nested_location, rewrites, project_output=True
+    )
+    stage = replace(stage, payload=replace(payload, mappings=mappings, query=nested))
+
+    if after is None:
+        return stage, None
+    outputs = {out for out in mappings if "." not in out}
+    return stage, (after - outputs) | {_root(f) for f in payload.fields}
+
+
+def _referenced_keys(assignments: dict[str, Any], after: frozenset[str]) -> set[str]:
+    """The keys of an eval map read downstream, plus the keys those read in turn."""
+    keep = {k for k in assignments if _root(k) in after}
+    pending = list(keep)
+    while pending:
+        refs = _value_refs([assignments[pending.pop()]])
+        for k in assignments:
+            if k not in keep and _root(k) in refs:
+                keep.add(k)
+                pending.append(k)
+    return keep
+
+
+def _value_refs(values: Iterable[Any]) -> set[str]:
+    """Root fields read by expression values (strings, or nested maps and lists of them)."""
+    roots: set[str] = set()
+    for value in values:
+        if isinstance(value, str):
+            roots.update(_root(name) for name in _field_refs(value))
+        elif isinstance(value, dict):
+            roots |= _value_refs(value.values())
+        elif isinstance(value, (list, tuple)):
+            roots |= _value_refs(value)
+    return roots
+
+
+def _union(needed: _Needed, refs: Iterable[str]) -> _Needed:
+    if needed is None:
+        return None
+    return needed | {_root(r) for r in refs}
+
+
+def _identity_select(fields: frozenset[str]) -> Stage:
+    return Stage(kind="select", payload={f: f for f in sorted(fields)})
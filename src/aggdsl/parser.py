@@ -2,14 +2,42 @@ from __future__ import annotations
 
 import json
 import re
-from dataclasses import dataclass
-from typing import Any
+import sys
+from typing import Any, Callable, Iterable, Iterator
 
 try:
-    from .dsl_ast import EventSource, Query, Stage, TimeSeries
+    from .dsl_ast import (
+        Branches,
+        EventSource,
+        GroupField,
+        GroupPayload,
+        JoinPayload,
+        MergePayload,
+        Query,
+        RawJson,
+        Stage,
+        SwitchCase,
+        SwitchPayload,
+        TimeSeries,
+    )
+    from .lexer import COMMA, SPACE, Line, Span, tokenize
 except ImportError:  
     # Allows running/importing from within src/aggdsl directly
-    from dsl_ast import EventSource, Query, Stage, TimeSeries  # type: ignore
+    from dsl_ast import (  # type: ignore
+        Branches,
+        EventSource,
+        GroupField,
+        GroupPayload,
+        JoinPayload,
+        MergePayload,
+        Query,
+        RawJson,
+        Stage,
+        SwitchCase,
+        SwitchPayload,
+        TimeSeries,
+    )
+    from lexer import COMMA, SPACE, Line, Span, tokenize  # type: ignore
 
 
 class DslParseError(ValueError):
@@ -20,180 +48,89 @@ _WS_RE = re.compile(r"\s+")
 _MOUSTACHE_PLACEHOLDER_RE = re.compile(r"^\{\{[^{}]+\}\}$")
 
 
-def _strip_comment(line: str) -> str:
-    """Drop whole-line // comments; inline comments are treated as content."""
-    stripped = line.lstrip()
-    if stripped.startswith("//"):
-        return ""
-    return line
+def _names(text: str) -> tuple[str, ...]:
+    """Split a comma-separated list of field names.
+
+    Names are interned: the same fields recur across every query of a corpus.
+    """
+    return tuple(sys.intern(f.strip()) for f in text.split(",") if f.strip())
 
 
-def _split_kv_pairs(text: str) -> dict[str, Any]:
+def _split_kv_pairs(src: Span) -> dict[str, Any]:
     """Parse `key=value` pairs separated by whitespace.
 
-    Values may be quoted strings or bare tokens.
+    Values may be quoted strings or bare tokens. Whitespace inside quotes or brackets
+    does not separate pairs, e.g. `first=now() last=date(2025, 1, 1, 12, 30, 00)`.
     """
-    parts = _split_tokens_preserving_groups(text.strip())
     out: dict[str, Any] = {}
-    for part in parts:
-        if "=" not in part:
-            raise DslParseError(f"Expected key=value, got: {part}")
-        key, value = part.split("=", 1)
-        out[key.strip()] = _parse_scalar(value.strip())
+    for part in src.split(SPACE):
+        kv = part.partition("=")
+        if kv is None:
+            raise DslParseError(f"Expected key=value, got: {part.text}")
+        key, value = kv
+        out[key.text] = _parse_scalar(value)
     return out
 
 
-def _split_tokens_preserving_groups(text: str) -> list[str]:
-    """Split by whitespace, but keep whitespace inside quotes or parentheses.
-
-    Example:
-      'first=now() last=date(2025, 1, 1, 12, 30, 00)'
-    becomes:
-      ['first=now()', 'last=date(2025, 1, 1, 12, 30, 00)']
-    """
-    tokens: list[str] = []
-    buf: list[str] = []
-    in_quotes = False
-    escape = False
-    paren_depth = 0
-
-    def flush() -> None:
-        s = "".join(buf).strip()
-        if s:
-            tokens.append(s)
-
-    for ch in text:
-        if escape:
-            buf.append(ch)
-            escape = False
-            continue
-        if ch == "\\":
-            escape = True
-            buf.append(ch)
-            continue
-        if ch == '"':
-            in_quotes = not in_quotes
-            buf.append(ch)
-            continue
-
-        if not in_quotes:
-            if ch == "(":
-                paren_depth += 1
-            elif ch == ")" and paren_depth > 0:
-                paren_depth -= 1
-
-            if ch.isspace() and paren_depth == 0:
-                flush()
-                buf = []
-                continue
-
-        buf.append(ch)
-
-    flush()
-    return tokens
-
-
-def _parse_scalar(token: str) -> Any:
-    tok = token.strip()
+def _parse_scalar(src: Span) -> Any:
+    tok = src.text
     if _MOUSTACHE_PLACEHOLDER_RE.match(tok):
         return tok
-    if tok.lower() == "true":
+    lowered = tok.lower()
+    if lowered == "true":
         return True
-    if tok.lower() == "false":
+    if lowered == "false":
         return False
     if tok.startswith("{") and tok.endswith("}"):
-        return _parse_inline_object(tok)
+        return _parse_inline_object(src)
     if tok.startswith('"') and tok.endswith('"') and len(tok) >= 2:
         return tok[1:-1]
     if tok.startswith("'") and tok.endswith("'") and len(tok) >= 2:
         return tok[1:-1]
     if tok.startswith("[") and tok.endswith("]"):
-        inner = tok[1:-1].strip()
-        if not inner:
-            return []
-        return [
-            _parse_scalar(part.strip())
-            for part in _split_by_comma_respecting_groups(inner)
-            if part.strip()
-        ]
+        return [_parse_scalar(part) for part in src.inner().split(COMMA)]
     if tok.isdigit() or (tok.startswith("-") and tok[1:].isdigit()):
         return int(tok)
     return tok
 
 
-def _parse_inline_object(token: str) -> dict[str, Any]:
-    s = token.strip()
-    if not (s.startswith("{") and s.endswith("}")):
-        raise DslParseError(f"Expected object literal: {token}")
-    inner = s[1:-1].strip()
-    if not inner:
-        return {}
+def _parse_inline_object(src: Span) -> dict[str, Any]:
+    if not (src.text.startswith("{") and src.text.endswith("}")):
+        raise DslParseError(f"Expected object literal: {src.text}")
 
     out: dict[str, Any] = {}
-    for item in _split_by_comma_respecting_groups(inner):
-        if not item:
-            continue
-        if "=" in item:
-            key, value = item.split("=", 1)
-        elif ":" in item:
-            key, value = item.split(":", 1)
-        else:
-            raise DslParseError(f"Expected key=value or key:value, got: {item}")
-
-        key_val = _parse_scalar(key.strip())
+    for item in src.inner().split(COMMA):
+        kv = item.partition("=") or item.partition(":")
+        if kv is None:
+            raise DslParseError(f"Expected key=value or key:value, got: {item.text}")
+        key, value = kv
+        key_val = _parse_scalar(key)
         key_str = key_val if isinstance(key_val, str) else str(key_val)
-        out[key_str] = _parse_scalar(value.strip())
+        out[key_str] = _parse_scalar(value)
     return out
 
 
-def _parse_bracket_args(text: str) -> dict[str, Any]:
+def _parse_bracket_args(src: Span) -> dict[str, Any]:
     """Parse `[a=1,b="x"]` style lists with quotes."""
-    s = text.strip()
-    if not (s.startswith("[") and s.endswith("]")):
-        raise DslParseError(f"Expected [..] argument list, got: {text}")
-    inner = s[1:-1].strip()
-    if not inner:
-        return {}
-
-    items: list[str] = []
-    buf: list[str] = []
-    in_quotes = False
-    escape = False
-    for ch in inner:
-        if escape:
-            buf.append(ch)
-            escape = False
-            continue
-        if ch == "\\":
-            escape = True
-            buf.append(ch)
-            continue
-        if ch == '"':
-            in_quotes = not in_quotes
-            buf.append(ch)
-            continue
-        if ch == "," and not in_quotes:
-            items.append("".join(buf).strip())
-            buf = []
-            continue
-        buf.append(ch)
-    if buf:
-        items.append("".join(buf).strip())
+    s = src.strip()
+    if not (s.text.startswith("[") and s.text.endswith("]")):
+        raise DslParseError(f"Expected [..] argument list, got: {src.text}")
 
     out: dict[str, Any] = {}
-    for item in items:
-        if not item:
-            continue
-        if "=" not in item:
-            raise DslParseError(f"Expected key=value inside [], got: {item}")
-        key, value = item.split("=", 1)
-        out[key.strip()] = _parse_scalar(value.strip())
+    for item in s.inner().split(COMMA):
+        kv = item.partition("=")
+        if kv is None:
+            raise DslParseError(f"Expected key=value inside [], got: {item.text}")
+        key, value = kv
+        out[key.text] = _parse_scalar(value)
     return out
 
 
 _FROM_RE = re.compile(r"^FROM\s+event\((?P<args>\[.*\])\)\s*$", re.IGNORECASE)
 _TIMESERIES_RE = re.compile(r"^TIMESERIES\s+(?P<rest>.+)$", re.IGNORECASE)
 _PIPE_RE = re.compile(r"^\|\s*(?P<rest>.+)$")
+_BRANCH_PIPE_RE = re.compile(r"^\|\|\s*(?P<rest>.+)$")
+_LEGACY_PIPE_RE = re.compile(r"^>>\s*(?P<rest>.+)$")
 _RESPONSE_RE = re.compile(r"^RESPONSE\s+(?P<rest>.+)$", re.IGNORECASE)
 _REQUEST_RE = re.compile(r"^REQUEST\s+(?P<rest>.+)$", re.IGNORECASE)
 _PIPELINE_RE = re.compile(r"^PIPELINE\s*$", re.IGNORECASE)
@@ -201,42 +138,96 @@ _SWITCH_RE = re.compile(
     r"^switch\s+(?P<out>[A-Za-z_][A-Za-z0-9_]*)\s+from\s+(?P<field>[A-Za-z_][A-Za-z0-9_.]*)\s*\{(?P<body>.*)\}\s*$",
     re.IGNORECASE,
 )
+_JOIN_FIELDS_RE = re.compile(r"^fields\s*\[(?P<fields>.*)\]\s*$", re.IGNORECASE)
+_SWITCH_CASE_RE = re.compile(r"^(?P<value>.+?)\s*==\s*(?P<id>.+?)\s*$")
 _MERGE_HEADER_RE = re.compile(
     r"^merge\s+fields\s*\[(?P<fields>[^\]]*)\](?:\s+mappings\s*(?P<mappings>\{.*\}))?\s*$",
     re.IGNORECASE,
 )
 
 
-@dataclass(frozen=True)
-class _GroupFields:
-    group: list[str]
-    fields: list[tuple[str, str, Any]]
-    emit_map: bool = False
+def parse(dsl: str, *, raw_text: bool = False) -> Query:
+    """Parse one DSL document.
 
-
-def parse(dsl: str) -> Query:
-    lines = [_strip_comment(ln).strip() for ln in dsl.splitlines()]
-    lines = [ln for ln in lines if ln and not ln.startswith("#")]
+    With `raw_text=True`, JSON payloads (`raw`, `bulkExpand`, `sessionReplays`, `pes` and
+    inline `fork [...]`) are validated but kept as `RawJson` source text instead of
+    Python objects, so `aggdsl.emit` can splice them into the output unchanged.
+    """
+    lines = list(tokenize(dsl))
     if not lines:
         raise DslParseError("Empty DSL")
+    query, _ = _parse_query(lines, 0, raw_text=raw_text)
+    return query
+
+
+# A line consisting of exactly this marker separates documents in a multi-document file.
+DOCUMENT_SEPARATOR = "---"
+
+
+def parse_documents(dsl: str | Iterable[str], *, raw_text: bool = False) -> Iterator[Query]:
+    """Lazily parse a multi-document DSL source, one `Query` per document.
+
+    Documents are separated by `---` lines and each has its own optional
+    `RESPONSE`/`REQUEST` headers. `dsl` may be text or an iterable of lines (such as an
+    open file); each document is parsed only when the iterator reaches it. Empty
+    documents (e.g. a leading or trailing `---`) are skipped. Errors are raised as
+    `DslParseError` naming the 1-based document number, and end the iteration.
+    `raw_text` is as for `parse`.
+    """
+    number = 0
+    lines: list[Line] = []
+    for line in tokenize(dsl):
+        if line.text != DOCUMENT_SEPARATOR:
+            lines.append(line)
+            continue
+        if lines:
+            number += 1
+            yield _parse_document(lines, number, raw_text)
+            lines = []
+    if lines:
+        yield _parse_document(lines, number + 1, raw_text)
 
+
+def _parse_document(lines: list[Line], number: int, raw_text: bool) -> Query:
+    try:
+        query, _ = _parse_query(lines, 0, raw_text=raw_text)
+    except DslParseError as e:
+        raise DslParseError(f"document {number}: {e}") from e
+    return query
+
+
+def _parse_query(
+    lines: list[Line],
+    idx: int,
+    *,
+    block: str | None = None,
+    raw_text: bool = False,
+) -> tuple[Query, int]:
+    """Parse one query starting at lines[idx].
+
+    Nested blocks share the caller's line list: `block` names the enclosing construct
+    (`None` for the top level, `"merge"`, or `"spawn"`/`"fork"` for a branch), which
+    decides the stage prefix (`|` or `||`) and the line that ends the query. Returns
+    (query, index_after_consumed_lines), so each line is visited once regardless of
+    nesting depth. `raw_text` is passed down to nested blocks (see `parse`).
+    """
     response_mime_type = "application/json"
     request_name: str | None = None
 
     # Optional header lines before FROM
-    idx = 0
     while idx < len(lines):
-        rm = _RESPONSE_RE.match(lines[idx])
+        line = lines[idx]
+        rm = _RESPONSE_RE.match(line.text)
         if rm:
-            kv = _split_kv_pairs(rm.group("rest"))
+            kv = _split_kv_pairs(line.span(rm.start("rest")))
             if "mimeType" in kv:
                 response_mime_type = str(kv["mimeType"])
             idx += 1
             continue
 
-        rq = _REQUEST_RE.match(lines[idx])
+        rq = _REQUEST_RE.match(line.text)
         if rq:
-            kv = _split_kv_pairs(rq.group("rest"))
+            kv = _split_kv_pairs(line.span(rq.start("rest")))
             if "name" in kv:
                 request_name = str(kv["name"])
             idx += 1
@@ -250,24 +241,30 @@ def parse(dsl: str) -> Query:
     event_source: EventSource | None = None
     time_series: TimeSeries | None = None
 
-    if _PIPELINE_RE.match(lines[idx]):
+    if _PIPELINE_RE.match(lines[idx].text):
         # Pipeline-only query: stages start immediately after PIPELINE.
         idx += 1
+    elif block in _BRANCH_BLOCKS and lines[idx].text.startswith("|"):
+        # Allow branch pipelines that start directly with stages (e.g. `|| filter ...`)
+        # without an explicit `PIPELINE` line.
+        pass
     else:
-        m = _FROM_RE.match(lines[idx])
+        line = lines[idx]
+        m = _FROM_RE.match(line.text)
         if not m:
             raise DslParseError("Expected: FROM event([..]) or PIPELINE")
-        args = _parse_bracket_args(m.group("args"))
+        args = _parse_bracket_args(line.span(*m.span("args")))
         if "source" not in args:
             raise DslParseError("FROM event([...]) requires source=...")
-        source_type = str(args.pop("source"))
+        source_type = sys.intern(str(args.pop("source")))
         event_source = EventSource(source_type=source_type, params=args)
 
         idx += 1
         if idx < len(lines):
-            tm = _TIMESERIES_RE.match(lines[idx])
+            line = lines[idx]
+            tm = _TIMESERIES_RE.match(line.text)
             if tm:
-                kv = _split_kv_pairs(tm.group("rest"))
+                kv = _split_kv_pairs(line.span(tm.start("rest")))
                 if "period" not in kv or "first" not in kv:
                     raise DslParseError("TIMESERIES requires period=..., first=..., and count=... or last=...")
 
@@ -279,7 +276,7 @@ def parse(dsl: str) -> Query:
                 first = _coerce_time_value(kv["first"])
                 if has_count:
                     time_series = TimeSeries(
-                        period=str(kv["period"]),
+                        period=sys.intern(str(kv["period"])),
                         first=first,
                         count=int(kv["count"]),
                         last=None,
@@ -287,156 +284,196 @@ def parse(dsl: str) -> Query:
                 else:
                     last = _coerce_time_value(kv["last"])
                     time_series = TimeSeries(
-                        period=str(kv["period"]),
+                        period=sys.intern(str(kv["period"])),
                         first=first,
                         count=None,
                         last=last,
                     )
                 idx += 1
 
+    end_word = _BLOCK_END_WORDS.get(block)
     stages: list[Stage] = []
     while idx < len(lines):
-        pm = _PIPE_RE.match(lines[idx])
-        if not pm:
-            raise DslParseError(f"Expected pipeline stage starting with '|': {lines[idx]}")
-
-        stage_text = pm.group("rest").strip()
+        line = lines[idx]
+        if end_word is not None:
+            control = _control_word(line.text)
+            if control == end_word:
+                idx += 1
+                break
+            if block == "merge" and control == "endbranch":
+                # A merge inside a branch is closed by the end of that branch.
+                break
+
+        stage = _stage_span(line, block)
+        stage_text = stage.text
+        stage_lower = stage_text.lower()
+        keyword, space, _ = stage_lower.partition(" ")
+
+        if not space:
+            # Spawn and fork blocks: a bare `spawn`/`fork` line opens `branch` blocks.
+            if keyword in _BRANCH_BLOCKS:
+                parse_block = _parse_spawn_block if keyword == "spawn" else _parse_fork_block
+                branch_queries, idx = parse_block(lines, idx + 1, raw_text=raw_text)
+                stages.append(Stage(kind=keyword, payload=Branches(branch_queries)))
+                continue
 
         # Multiline group stage support.
         # Allows formatting the `fields { ... }` block across multiple lines.
         # Continuation lines may start with `|` / `||` (especially inside fork/spawn branches),
         # or may be plain lines (top-level formatting).
-        if stage_text.lower().startswith("group ") and "{" in stage_text and not _balanced_braces(
-            stage_text
-        ):
-            stage_text, idx = _consume_multiline_brace_stage(stage_text, lines, idx + 1)
-            stages.append(_parse_stage(stage_text))
-            continue
-        # Spawn block support.
-        if stage_text.lower() == "spawn":
-            spawn_queries, idx = _parse_spawn_block(lines, idx + 1)
-            stages.append(Stage(kind="spawn", payload=spawn_queries))
-            continue
-
-        # Fork block support.
-        if stage_text.lower() == "fork":
-            fork_queries, idx = _parse_fork_block(lines, idx + 1)
-            stages.append(Stage(kind="fork", payload=fork_queries))
-            continue
+        elif keyword == "group":
+            if "{" in stage_text and not _balanced_braces(line):
+                stage_text, idx = _consume_multiline_brace_stage(stage_text, lines, idx + 1, block)
+                stages.append(_parse_stage(Line(stage_text, line.number).span()))
+                continue
 
         # Merge block support.
-        if stage_text.lower().startswith("merge "):
-            merge_spec = _parse_merge_header(stage_text)
-            merge_query, idx = _parse_merge_block(lines, idx + 1)
+        elif keyword == "merge":
+            fields, mappings = _parse_merge_header(stage)
+            merge_query, idx = _parse_merge_block(lines, idx + 1, raw_text=raw_text)
             stages.append(
                 Stage(
                     kind="merge",
-                    payload={
-                        "fields": merge_spec["fields"],
-                        "mappings": merge_spec["mappings"],
-                        "query": merge_query,
-                    },
+                    payload=MergePayload(fields=fields, mappings=mappings, query=merge_query),
                 )
             )
             continue
 
-        # Multiline raw JSON stage support.
-        if stage_text.lower().startswith("raw "):
-            raw_start = stage_text[len("raw ") :].strip()
-            obj, idx = _parse_raw_json_object_multiline(raw_start, lines, idx + 1)
-            stages.append(Stage(kind="raw", payload=obj))
-            continue
-
-        # Multiline bulkExpand stage support.
-        if stage_text.lower().startswith("bulkexpand "):
-            bulk_start = stage_text[len("bulkexpand ") :].strip()
-            obj, idx = _parse_raw_json_object_multiline(bulk_start, lines, idx + 1)
-            stages.append(Stage(kind="bulkExpand", payload=obj))
-            continue
-
-        # Multiline fork stage support.
-        if stage_text.lower().startswith("fork "):
-            fork_start = stage_text[len("fork ") :].strip()
-            arr, idx = _parse_raw_json_array_multiline(fork_start, lines, idx + 1)
-            stages.append(Stage(kind="fork", payload=arr))
-            continue
-
-        # Multiline sessionReplays stage support.
-        if stage_text.lower().startswith("sessionreplays "):
-            sr_start = stage_text[len("sessionreplays ") :].strip()
-            obj, idx = _parse_raw_json_object_multiline(sr_start, lines, idx + 1)
-            stages.append(Stage(kind="sessionReplays", payload=obj))
-            continue
-
-        # Multiline pes stage support.
-        if stage_text.lower().startswith("pes "):
-            pes_start = stage_text[len("pes ") :].strip()
-            obj, idx = _parse_raw_json_object_multiline(pes_start, lines, idx + 1)
-            stages.append(Stage(kind="pes", payload=obj))
+        # Multiline JSON stage support (raw, bulkExpand, fork [...], sessionReplays, pes).
+        elif keyword in _MULTILINE_JSON_STAGES:
+            kind, parse_json = _MULTILINE_JSON_STAGES[keyword]
+            payload, idx = parse_json(
+                stage_text[len(keyword) + 1 :].strip(), lines, idx + 1, raw_text=raw_text
+            )
+            stages.append(Stage(kind=kind, payload=payload))
             continue
 
-        stages.append(_parse_stage(stage_text))
+        stages.append(_parse_stage(stage))
         idx += 1
 
-    return Query(
+    query = Query(
         event_source=event_source,
         time_series=time_series,
-        stages=stages,
+        stages=tuple(stages),
         response_mime_type=response_mime_type,
         request_name=request_name,
     )
+    return query, idx
 
 
-def _balanced_braces(text: str) -> bool:
-    in_quotes = False
-    escape = False
-    depth = 0
-    saw_open = False
-    for ch in text:
-        if escape:
-            escape = False
-            continue
-        if ch == "\\":
-            escape = True
-            continue
-        if ch == '"':
-            in_quotes = not in_quotes
-            continue
-        if in_quotes:
-            continue
-        if ch == "{":
-            saw_open = True
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-    return saw_open and depth == 0
+_BRANCH_BLOCKS = ("spawn", "fork")
+_BLOCK_END_WORDS = {"merge": "endmerge", "spawn": "endbranch", "fork": "endbranch"}
+
+
+def _control_word(text: str) -> str:
+    """Normalize block control lines: `endmerge`, `| endmerge` and `|| endmerge` are equal."""
+    return text.lstrip("|").strip().lower()
+
+
+def _stage_span(line: Line, block: str | None) -> Span:
+    """Return the stage text of a pipeline line, enforcing the prefix used by `block`."""
+    text = line.text
+    if block in _BRANCH_BLOCKS:
+        # Inside a branch, pipeline stages start with `||`.
+        bm = _BRANCH_PIPE_RE.match(text)
+        if bm:
+            return line.span(bm.start("rest"))
+        if text.startswith("|"):
+            raise DslParseError(f"Inside {block} branch, pipeline stages must start with '||'")
+    elif block == "merge":
+        if text.startswith("||"):
+            raise DslParseError("Inside merge block, stages must start with '|' (not '||')")
+        # Legacy prefix: treat `>>` as a normal pipeline stage.
+        lm = _LEGACY_PIPE_RE.match(text)
+        if lm:
+            return line.span(lm.start("rest"))
+
+    pm = _PIPE_RE.match(text)
+    if not pm:
+        raise DslParseError(f"Expected pipeline stage starting with '|': {text}")
+    return line.span(pm.start("rest"))
+
+
+def _balanced_braces(line: Line) -> bool:
+    opened, closed = line.brace_counts()
+    return opened > 0 and opened == closed
 
 
 def _consume_multiline_brace_stage(
     first_fragment: str,
-    lines: list[str],
+    lines: list[Line],
     next_idx: int,
+    block: str | None = None,
 ) -> tuple[str, int]:
     """Consume continuation lines until braces are balanced.
 
     Used for non-JSON DSL constructs that embed brace blocks (e.g. `group ... fields { ... }`).
-    Continuation lines may start with `|`/`||` (treated as continuation content), or may be
-    plain lines.
+    Continuation lines may start with the stage prefix of the enclosing block (`|`/`||`,
+    treated as continuation content), or may be plain lines.
     """
     buf = [first_fragment]
-    candidate = " ".join(buf).strip()
-
-    while candidate and not _balanced_braces(candidate) and next_idx < len(lines):
-        line = lines[next_idx]
-        pm = _PIPE_RE.match(line)
-        if pm:
-            buf.append(pm.group("rest").strip())
-        else:
-            buf.append(line.strip())
+    depth = _BracketDepth("{", "}")
+    depth.feed(first_fragment)
+    prefix_re = _BRANCH_PIPE_RE if block in _BRANCH_BLOCKS else _PIPE_RE
+
+    while not depth.balanced() and next_idx < len(lines):
+        line = lines[next_idx].text
+        pm = prefix_re.match(line) or _PIPE_RE.match(line)
+        piece = pm.group("rest").strip() if pm else line
+        buf.append(piece)
+        depth.feed(piece)
         next_idx += 1
-        candidate = " ".join(buf).strip()
 
-    return candidate, next_idx
+    return " ".join(buf).strip(), next_idx
+
+
+class _BracketDepth:
+    """Bracket depth of a multiline payload, fed one line at a time.
+
+    Brackets inside quoted strings and escaped characters are ignored. The quote state
+    carries over between lines, so every line is scanned exactly once: strings and
+    escapes are removed with a regex and the remaining brackets are counted.
+    """
+
+    __slots__ = ("opener", "closer", "depth", "opened", "in_quotes")
+
+    def __init__(self, opener: str, closer: str) -> None:
+        self.opener = opener
+        self.closer = closer
+        self.depth = 0
+        self.opened = 0
+        self.in_quotes = False
+
+    def feed(self, text: str) -> None:
+        if self.in_quotes:
+            # Finish the string left open by the previous line.
+            m = _STRING_TAIL_RE.match(text)
+            if m is None:
+                return
+            text = text[m.end() :]
+            self.in_quotes = False
+
+        if '"' in text or "\\" in text:
+            text = _STRING_OR_ESCAPE_RE.sub("", text)
+            # Only an unterminated string leaves a quote behind; the rest of the line
+            # is inside that string.
+            quote = text.find('"')
+            if quote >= 0:
+                text = text[:quote]
+                self.in_quotes = True
+
+        opened = text.count(self.opener)
+        self.opened += opened
+        self.depth += opened - text.count(self.closer)
+
+    def balanced(self) -> bool:
+        return self.opened > 0 and self.depth == 0
+
+
+# Closed quoted strings and escaped characters (outside of strings).
+_STRING_OR_ESCAPE_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|\\.?')
+# The remainder of a string continued from the previous line, up to its closing quote.
+_STRING_TAIL_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"')
 
 
 def _coerce_time_value(value: Any) -> int | str:
@@ -451,166 +488,196 @@ def _coerce_time_value(value: Any) -> int | str:
     raise DslParseError(f"Unsupported time value: {value!r}")
 
 
-def _parse_stage(text: str) -> Stage:
-    # filter <expr>
-    if text.lower().startswith("filter "):
-        return Stage(kind="filter", payload=text[len("filter ") :].strip())
-
-    # identified <field>
-    if text.lower().startswith("identified "):
-        field = text[len("identified ") :].strip()
-        if not field:
-            raise DslParseError("identified requires a field, e.g. | identified visitorId")
-        return Stage(kind="identified", payload=field)
-
-    # eval { a=b, c=d }
-    if text.lower().startswith("eval "):
-        return Stage(kind="eval", payload=_parse_brace_map(text[len("eval ") :].strip(), context="eval"))
-
-    # select { a=b, c=d }
-    if text.lower().startswith("select "):
-        return Stage(kind="select", payload=_parse_brace_map(text[len("select ") :].strip(), context="select"))
-
-    # join fields [a,b,c]
-    if text.lower().startswith("join "):
-        rest = text[len("join ") :].strip()
-        jm = re.match(r"^fields\s*\[(?P<fields>.*)\]\s*$", rest, flags=re.IGNORECASE)
-        if not jm:
-            raise DslParseError("join syntax: | join fields [field1,field2]")
-        fields = [f.strip() for f in jm.group("fields").split(",") if f.strip()]
-        return Stage(kind="join", payload={"fields": fields})
-
-    # switch outVar from field { "1"=="abc", "2"=="def" }
+# Single-line stage parsers by lowercase keyword (the text before the first space),
+# so each stage line costs one lookup however many kinds there are.
+# `aggdsl.stages.register_stage` adds user kinds.
+_STAGE_PARSERS: dict[str, Callable[[Span], Stage]] = {}
+
+
+def _parses(keyword: str) -> Callable[[Callable[[Span], Stage]], Callable[[Span], Stage]]:
+    def register(fn: Callable[[Span], Stage]) -> Callable[[Span], Stage]:
+        _STAGE_PARSERS[keyword] = fn
+        return fn
+
+    return register
+
+
+def _parse_stage(src: Span) -> Stage:
+    text = src.text
+    lowered = text.lower()
+    keyword, space, _ = lowered.partition(" ")
+    parse_stage = _STAGE_PARSERS.get(keyword) if space else None
+    if parse_stage is None:
+        # The two kinds that do not need a space after the keyword.
+        if lowered.startswith("segment"):
+            parse_stage = _parse_segment
+        elif _SWITCH_RE.match(text):
+            parse_stage = _parse_switch
+        else:
+            raise DslParseError(f"Unknown stage: {text}")
+    return parse_stage(src)
+
+
+# filter <expr>
+@_parses("filter")
+def _parse_filter(src: Span) -> Stage:
+    return Stage(kind="filter", payload=src.text[len("filter ") :].strip())
+
+
+# identified <field>
+@_parses("identified")
+def _parse_identified(src: Span) -> Stage:
+    field = src.text[len("identified ") :].strip()
+    if not field:
+        raise DslParseError("identified requires a field, e.g. | identified visitorId")
+    return Stage(kind="identified", payload=field)
+
+
+# eval/select/unmarshal { a=b, c=d }
+def _brace_map_stage(kind: str) -> Callable[[Span], Stage]:
+    def parse_brace_map_stage(src: Span) -> Stage:
+        return Stage(kind=kind, payload=_parse_brace_map(src.sub(len(kind) + 1), context=kind))
+
+    return parse_brace_map_stage
+
+
+_STAGE_PARSERS.update({kind: _brace_map_stage(kind) for kind in ("eval", "select", "unmarshal")})
+
+
+# join fields [a,b,c]
+@_parses("join")
+def _parse_join(src: Span) -> Stage:
+    rest = src.text[len("join ") :].strip()
+    jm = _JOIN_FIELDS_RE.match(rest)
+    if not jm:
+        raise DslParseError("join syntax: | join fields [field1,field2]")
+    return Stage(kind="join", payload=JoinPayload(_names(jm.group("fields"))))
+
+
+# switch outVar from field { "1"=="abc", "2"=="def" }
+@_parses("switch")
+def _parse_switch(src: Span) -> Stage:
+    text = src.text
     sm = _SWITCH_RE.match(text)
-    if sm:
-        out_var = sm.group("out")
-        field = sm.group("field")
-        body = sm.group("body").strip()
-        parts = _split_by_comma_respecting_groups(body)
-        cases: list[dict[str, str]] = []
-        for part in parts:
-            m = re.match(r"^(?P<value>.+?)\s*==\s*(?P<id>.+?)\s*$", part)
-            if not m:
-                raise DslParseError(f"Invalid switch case: {part}")
-            value = _parse_scalar(m.group("value").strip())
-            ident = _parse_scalar(m.group("id").strip())
-            cases.append({"value": str(value), "==": str(ident)})
-        return Stage(kind="switch", payload={"out": out_var, "field": field, "cases": cases})
-
-    # unmarshal { field=expr, ... }
-    if text.lower().startswith("unmarshal "):
-        rest = text[len("unmarshal ") :].strip()
-        return Stage(kind="unmarshal", payload=_parse_brace_map(rest, context="unmarshal"))
-
-    # unwind { field=list, index=listIndex }
-    if text.lower().startswith("unwind "):
-        rest = text[len("unwind ") :].strip()
-        raw_map = _parse_brace_map(rest, context="unwind")
-        coerced: dict[str, Any] = {}
-        for k, v in raw_map.items():
-            if isinstance(v, str) and v.lower() == "true":
-                coerced[k] = True
-            elif isinstance(v, str) and v.lower() == "false":
-                coerced[k] = False
-            else:
-                coerced[k] = v
-        return Stage(kind="unwind", payload=coerced)
-
-    # segment id=...  (or segment { id=... })
-    if text.lower().startswith("segment"):
-        rest = text[len("segment") :].strip()
-        if not rest:
-            raise DslParseError('segment syntax: | segment id="segmentId"')
-
-        if rest.startswith("{"):
-            seg = _parse_brace_map(rest, context="segment")
-        elif "=" in rest:
-            seg = _split_kv_pairs(rest)
+    if not sm:
+        raise DslParseError(f"Unknown stage: {text}")
+    out_var = sys.intern(sm.group("out"))
+    field = sys.intern(sm.group("field"))
+    body = src.sub(*sm.span("body")).strip()
+    cases: list[SwitchCase] = []
+    for part in body.split(COMMA):
+        m = _SWITCH_CASE_RE.match(part.text)
+        if not m:
+            raise DslParseError(f"Invalid switch case: {part.text}")
+        value = _parse_scalar(part.sub(*m.span("value")).strip())
+        ident = _parse_scalar(part.sub(*m.span("id")).strip())
+        cases.append(SwitchCase(str(value), str(ident)))
+    return Stage(kind="switch", payload=SwitchPayload(out_var, field, tuple(cases)))
+
+
+# unwind { field=list, index=listIndex }
+@_parses("unwind")
+def _parse_unwind(src: Span) -> Stage:
+    raw_map = _parse_brace_map(src.sub(len("unwind ")), context="unwind")
+    coerced: dict[str, Any] = {}
+    for k, v in raw_map.items():
+        if isinstance(v, str) and v.lower() == "true":
+            coerced[k] = True
+        elif isinstance(v, str) and v.lower() == "false":
+            coerced[k] = False
         else:
-            # Allow: | segment <id>
-            token = rest
-            if token.startswith('"') and token.endswith('"') and len(token) >= 2:
-                token = token[1:-1]
-            seg = {"id": token}
-
-        if "id" not in seg:
-            raise DslParseError('segment requires id=..., e.g. | segment id="segmentId"')
-
-        return Stage(kind="segment", payload=seg)
-
-    # bulkExpand { ...json... }
-    if text.lower().startswith("bulkexpand "):
-        rest = text[len("bulkexpand ") :].strip()
-        obj = _parse_raw_json_object(rest)
-        return Stage(kind="bulkExpand", payload=obj)
-
-    # fork [ ...json array... ]
-    if text.lower().startswith("fork "):
-        rest = text[len("fork ") :].strip()
-        arr = _parse_raw_json_array(rest)
-        return Stage(kind="fork", payload=arr)
-
-    # sessionReplays { ...json... }
-    if text.lower().startswith("sessionreplays "):
-        rest = text[len("sessionreplays ") :].strip()
-        obj = _parse_raw_json_object(rest)
-        return Stage(kind="sessionReplays", payload=obj)
-
-    # pes { ...json... }
-    if text.lower().startswith("pes "):
-        rest = text[len("pes ") :].strip()
-        obj = _parse_raw_json_object(rest)
-        return Stage(kind="pes", payload=obj)
-
-    # raw { ...json... }
-    if text.lower().startswith("raw "):
-        obj = _parse_raw_json_object(text[len("raw ") :].strip())
-        return Stage(kind="raw", payload=obj)
-
-    # limit N
-    if text.lower().startswith("limit "):
-        n = text[len("limit ") :].strip()
-        if not n.isdigit():
-            raise DslParseError("limit must be an integer")
-        return Stage(kind="limit", payload=int(n))
-
-    # sort -field,+field
-    if text.lower().startswith("sort "):
-        rest = text[len("sort ") :].strip()
-        keys = [k.strip() for k in rest.split(",") if k.strip()]
-        if not keys:
-            raise DslParseError("sort requires at least one key")
-        return Stage(kind="sort", payload=keys)
-
-    # group by a,b fields { x=sum(y) }
-    if text.lower().startswith("group "):
-        return Stage(kind="group", payload=_parse_group(text))
-
-    raise DslParseError(f"Unknown stage: {text}")
-
-
-def _parse_merge_header(text: str) -> dict[str, Any]:
-    m = _MERGE_HEADER_RE.match(text)
+            coerced[k] = v
+    return Stage(kind="unwind", payload=coerced)
+
+
+# segment id=...  (or segment { id=... })
+@_parses("segment")
+def _parse_segment(src: Span) -> Stage:
+    rest = src.sub(len("segment")).strip()
+    if not rest.text:
+        raise DslParseError('segment syntax: | segment id="segmentId"')
+
+    if rest.text.startswith("{"):
+        seg = _parse_brace_map(rest, context="segment")
+    elif "=" in rest.text:
+        seg = _split_kv_pairs(rest)
+    else:
+        # Allow: | segment <id>
+        token = rest.text
+        if token.startswith('"') and token.endswith('"') and len(token) >= 2:
+            token = token[1:-1]
+        seg = {"id": token}
+
+    if "id" not in seg:
+        raise DslParseError('segment requires id=..., e.g. | segment id="segmentId"')
+
+    return Stage(kind="segment", payload=seg)
+
+
+# bulkExpand/sessionReplays/pes/raw { ...json... }
+def _json_object_stage(kind: str) -> Callable[[Span], Stage]:
+    def parse_json_object_stage(src: Span) -> Stage:
+        return Stage(kind=kind, payload=_parse_raw_json_object(src.text[len(kind) + 1 :].strip()))
+
+    return parse_json_object_stage
+
+
+_STAGE_PARSERS.update(
+    {kind.lower(): _json_object_stage(kind) for kind in ("bulkExpand", "sessionReplays", "pes", "raw")}
+)
+
+
+# fork [ ...json array... ]
+@_parses("fork")
+def _parse_fork_array(src: Span) -> Stage:
+    return Stage(kind="fork", payload=_parse_raw_json_array(src.text[len("fork ") :].strip()))
+
+
+# limit N
+@_parses("limit")
+def _parse_limit(src: Span) -> Stage:
+    n = src.text[len("limit ") :].strip()
+    if not n.isdigit():
+        raise DslParseError("limit must be an integer")
+    return Stage(kind="limit", payload=int(n))
+
+
+# sort -field,+field
+@_parses("sort")
+def _parse_sort(src: Span) -> Stage:
+    keys = _names(src.text[len("sort ") :])
+    if not keys:
+        raise DslParseError("sort requires at least one key")
+    return Stage(kind="sort", payload=keys)
+
+
+# group by a,b fields { x=sum(y) }
+@_parses("group")
+def _parse_group_stage(src: Span) -> Stage:
+    return Stage(kind="group", payload=_parse_group(src))
+
+
+def _parse_merge_header(src: Span) -> tuple[tuple[str, ...], dict[str, Any] | None]:
+    m = _MERGE_HEADER_RE.match(src.text)
     if not m:
         raise DslParseError(
             "merge syntax: | merge fields [field1,field2] (optional: mappings { out=in, ... })"
         )
 
-    fields_text = m.group("fields").strip()
-    fields = [f.strip() for f in fields_text.split(",") if f.strip()]
+    fields = _names(m.group("fields"))
     if not fields:
         raise DslParseError("merge fields [...] cannot be empty")
 
-    mappings_group = m.group("mappings")
-    if mappings_group is None:
-        return {"fields": fields, "mappings": None}
+    if m.group("mappings") is None:
+        return fields, None
 
-    mappings_text = mappings_group.strip()
-    mappings = _parse_brace_map(mappings_text, context="mappings")
-    return {"fields": fields, "mappings": mappings}
+    mappings = _parse_brace_map(src.sub(*m.span("mappings")), context="mappings")
+    return fields, mappings
 
 
-def _parse_merge_block(lines: list[str], idx: int) -> tuple[Query, int]:
+def _parse_merge_block(
+    lines: list[Line], idx: int, *, raw_text: bool = False
+) -> tuple[Query, int]:
     """Parse a merge pipeline block starting at lines[idx].
 
     Expected form:
@@ -627,47 +694,14 @@ def _parse_merge_block(lines: list[str], idx: int) -> tuple[Query, int]:
       - Lines `FROM`, `TIMESERIES`, and `PIPELINE` are allowed without prefixes.
       - The block ends at a line `endmerge` (or `| endmerge`).
     """
-    inner_lines: list[str] = []
-    i = idx
-    nested_merge_depth = 0
-    while i < len(lines):
-        line = lines[i]
-        control = line
-        if control.startswith("|") and not control.startswith("||"):
-            control = control[1:].strip()
-
-        control_lower = control.lower()
-
-        if control_lower.startswith("merge "):
-            nested_merge_depth += 1
-
-        if control_lower == "endmerge":
-            if nested_merge_depth > 0:
-                nested_merge_depth -= 1
-                inner_lines.append(line)
-                i += 1
-                continue
-            i += 1
-            break
-
-        if line.startswith(">>"):
-            # Legacy prefix: treat `>>` as a normal pipeline stage.
-            inner_lines.append("|" + line[2:].lstrip())
-        elif line.startswith("||"):
-            raise DslParseError("Inside merge block, stages must start with '|' (not '||')")
-        else:
-            inner_lines.append(line)
-        i += 1
-
-    if not inner_lines:
+    if idx >= len(lines) or _control_word(lines[idx].text) in ("endmerge", "endbranch"):
         raise DslParseError("Empty merge block")
-    if i > len(lines):
-        raise DslParseError("merge block missing 'endmerge'")
-
-    return parse("\n".join(inner_lines)), i
+    return _parse_query(lines, idx, block="merge", raw_text=raw_text)
 
 
-def _parse_spawn_block(lines: list[str], idx: int) -> tuple[list[Query], int]:
+def _parse_spawn_block(
+    lines: list[Line], idx: int, *, raw_text: bool = False
+) -> tuple[tuple[Query, ...], int]:
     """Parse a spawn block starting at lines[idx].
 
     Expected form:
@@ -688,81 +722,12 @@ def _parse_spawn_block(lines: list[str], idx: int) -> tuple[list[Query], int]:
       - Inside a branch, pipeline stages must start with `||`.
       - The spawn block ends at a top-level line `| endspawn`.
     """
-    queries: list[Query] = []
-    i = idx
-    while i < len(lines):
-        line = lines[i]
-        control = line
-        if control.startswith("|") and not control.startswith("||"):
-            control = control[1:].strip()
-
-        if control.lower() == "branch":
-            i += 1
-            branch_lines: list[str] = []
-            in_merge_block = False
-            nested_branch_depth = 0
-            while i < len(lines):
-                l2 = lines[i]
-                control2 = l2
-                if control2.startswith("|") and not control2.startswith("||"):
-                    control2 = control2[1:].strip()
-
-                # Allow an optional `|| endmerge` terminator inside a branch.
-                if l2.startswith("||") and l2[2:].strip().lower() == "endmerge":
-                    control2 = "endmerge"
-
-                if control2.lower() == "endmerge" and in_merge_block:
-                    in_merge_block = False
-
-                if control2.lower() == "branch":
-                    nested_branch_depth += 1
-                elif control2.lower() == "endbranch":
-                    if nested_branch_depth > 0:
-                        nested_branch_depth -= 1
-                    else:
-                        i += 1
-                        break
-
-                # Detect merge block start (the merge header stage itself is `|| merge ...`).
-                if l2.startswith("||") and l2[2:].lstrip().lower().startswith("merge "):
-                    in_merge_block = True
-
-                # Only allow nested pipeline stages via `||`.
-                # Exception: inside a merge block, internal stages are normal `|` stages.
-                if l2.startswith("|") and not l2.startswith("||") and not in_merge_block:
-                    raise DslParseError(
-                        "Inside spawn branch, pipeline stages must start with '||'"
-                    )
-                if l2.startswith("||"):
-                    if nested_branch_depth == 0:
-                        branch_lines.append("|" + l2[2:])
-                    else:
-                        branch_lines.append(l2)
-                else:
-                    branch_lines.append(l2)
-                i += 1
-
-            if not branch_lines:
-                raise DslParseError("Empty branch in spawn")
-
-            # Allow branch pipelines that start directly with stages (e.g. `|| filter ...`)
-            # without an explicit `PIPELINE` line.
-            first_line = branch_lines[0].strip() if branch_lines else ""
-            if first_line.startswith("|"):
-                branch_lines = ["PIPELINE", *branch_lines]
-
-            queries.append(parse("\n".join(branch_lines)))
-            continue
-
-        if control.lower().startswith("endspawn") or line.lower().startswith("| endspawn"):
-            return queries, i + 1
-
-        raise DslParseError(f"Unexpected line in spawn block: {line}")
+    return _parse_branches(lines, idx, kind="spawn", raw_text=raw_text)
 
-    raise DslParseError("spawn block missing '| endspawn'")
 
-
-def _parse_fork_block(lines: list[str], idx: int) -> tuple[list[Query], int]:
+def _parse_fork_block(
+    lines: list[Line], idx: int, *, raw_text: bool = False
+) -> tuple[tuple[Query, ...], int]:
     """Parse a fork block starting at lines[idx].
 
     Expected form:
@@ -783,77 +748,32 @@ def _parse_fork_block(lines: list[str], idx: int) -> tuple[list[Query], int]:
       - The fork block ends at a top-level line `| endfork` (or `endfork`).
       - Merge blocks are allowed inside branches (they use normal `|` internally).
     """
-    queries: list[Query] = []
-    i = idx
-    while i < len(lines):
-        line = lines[i]
-        control = line
-        if control.startswith("|") and not control.startswith("||"):
-            control = control[1:].strip()
-
-        if control.lower() == "branch":
-            i += 1
-            branch_lines: list[str] = []
-            in_merge_block = False
-            nested_branch_depth = 0
-            while i < len(lines):
-                l2 = lines[i]
-                control2 = l2
-                if control2.startswith("|") and not control2.startswith("||"):
-                    control2 = control2[1:].strip()
-
-                # Allow an optional `|| endmerge` terminator inside a branch.
-                if l2.startswith("||") and l2[2:].strip().lower() == "endmerge":
-                    control2 = "endmerge"
-
-                if control2.lower() == "endmerge" and in_merge_block:
-                    in_merge_block = False
-
-                if control2.lower() == "branch":
-                    nested_branch_depth += 1
-                elif control2.lower() == "endbranch":
-                    if nested_branch_depth > 0:
-                        nested_branch_depth -= 1
-                    else:
-                        i += 1
-                        break
-
-                # Detect merge block start (the merge header stage itself is `|| merge ...`).
-                if l2.startswith("||") and l2[2:].lstrip().lower().startswith("merge "):
-                    in_merge_block = True
-
-                if l2.startswith("|") and not l2.startswith("||") and not in_merge_block:
-                    raise DslParseError(
-                        "Inside fork branch, pipeline stages must start with '||'"
-                    )
+    return _parse_branches(lines, idx, kind="fork", raw_text=raw_text)
 
-                if l2.startswith("||"):
-                    if nested_branch_depth == 0:
-                        branch_lines.append("|" + l2[2:])
-                    else:
-                        branch_lines.append(l2)
-                else:
-                    branch_lines.append(l2)
-                i += 1
-
-            if not branch_lines:
-                raise DslParseError("Empty branch in fork")
 
-            # Allow branch pipelines that start directly with stages (e.g. `|| filter ...`)
-            # without an explicit `PIPELINE` line.
-            first_line = branch_lines[0].strip() if branch_lines else ""
-            if first_line.startswith("|"):
-                branch_lines = ["PIPELINE", *branch_lines]
+def _parse_branches(
+    lines: list[Line], idx: int, *, kind: str, raw_text: bool = False
+) -> tuple[tuple[Query, ...], int]:
+    queries: list[Query] = []
+    end_word = "end" + kind
+    while idx < len(lines):
+        line = lines[idx]
+        control = _control_word(line.text)
 
-            queries.append(parse("\n".join(branch_lines)))
+        if control == "branch":
+            idx += 1
+            if idx >= len(lines) or _control_word(lines[idx].text) == "endbranch":
+                raise DslParseError(f"Empty branch in {kind}")
+            query, idx = _parse_query(lines, idx, block=kind, raw_text=raw_text)
+            queries.append(query)
             continue
 
-        if control.lower().startswith("endfork") or line.lower().startswith("| endfork"):
-            return queries, i + 1
+        if control.startswith(end_word):
+            return tuple(queries), idx + 1
 
-        raise DslParseError(f"Unexpected line in fork block: {line}")
+        raise DslParseError(f"Unexpected line in {kind} block: {line.text}")
 
-    raise DslParseError("fork block missing '| endfork'")
+    raise DslParseError(f"{kind} block missing '| {end_word}'")
 
 
 def _parse_raw_json_object(text: str) -> dict[str, Any]:
@@ -884,204 +804,125 @@ def _parse_raw_json_array(text: str) -> list[Any]:
 
 def _parse_raw_json_object_multiline(
     first_fragment: str,
-    lines: list[str],
+    lines: list[Line],
     next_idx: int,
-) -> tuple[dict[str, Any], int]:
+    *,
+    raw_text: bool = False,
+) -> tuple[dict[str, Any] | RawJson, int]:
     """Parse a raw JSON object that may span multiple lines.
 
     The first fragment is the text after `raw` on the current pipe line.
     Continuation lines are consumed until a full JSON object is balanced.
-    Returns (parsed_object, next_index_after_consumed_lines).
+    Returns (parsed_object, next_index_after_consumed_lines); with `raw_text`, the
+    validated source text is returned as `RawJson` instead of the parsed object.
     """
-    buf = [first_fragment]
-    candidate = "\n".join(buf).strip()
-
-    def balanced_json_object(s: str) -> bool:
-        s = s.strip()
-        if not s.startswith("{"):
-            return False
-        in_quotes = False
-        escape = False
-        depth = 0
-        for ch in s:
-            if escape:
-                escape = False
-                continue
-            if ch == "\\":
-                escape = True
-                continue
-            if ch == '"':
-                in_quotes = not in_quotes
-                continue
-            if in_quotes:
-                continue
-            if ch == "{":
-                depth += 1
-            elif ch == "}":
-                depth -= 1
-                if depth == 0:
-                    # Only balanced if the remaining non-whitespace is empty.
-                    # (Allows trailing whitespace/newlines)
-                    pass
-        return depth == 0 and s.endswith("}")
-
-    while candidate and not balanced_json_object(candidate) and next_idx < len(lines):
-        # Continuation lines must NOT start a new pipe stage.
-        if _PIPE_RE.match(lines[next_idx]):
-            break
-        buf.append(lines[next_idx])
-        next_idx += 1
-        candidate = "\n".join(buf).strip()
-
-    return _parse_raw_json_object(candidate), next_idx
+    text, next_idx = _consume_multiline_json(first_fragment, lines, next_idx, "{", "}")
+    obj = _parse_raw_json_object(text)
+    if raw_text:
+        return RawJson(text), next_idx
+    return obj, next_idx
 
 
 def _parse_raw_json_array_multiline(
     first_fragment: str,
-    lines: list[str],
+    lines: list[Line],
     next_idx: int,
-) -> tuple[list[Any], int]:
+    *,
+    raw_text: bool = False,
+) -> tuple[list[Any] | RawJson, int]:
     """Parse a raw JSON array that may span multiple lines.
 
     The first fragment is the text after `fork` on the current pipe line.
     Continuation lines are consumed until a full JSON array is balanced.
-    Returns (parsed_array, next_index_after_consumed_lines).
+    Returns (parsed_array, next_index_after_consumed_lines); with `raw_text`, the
+    validated source text is returned as `RawJson` instead of the parsed array.
     """
-    buf = [first_fragment]
-    candidate = "\n".join(buf).strip()
-
-    def balanced_json_array(s: str) -> bool:
-        s = s.strip()
-        if not s.startswith("["):
-            return False
-        in_quotes = False
-        escape = False
-        depth = 0
-        for ch in s:
-            if escape:
-                escape = False
-                continue
-            if ch == "\\":
-                escape = True
-                continue
-            if ch == '"':
-                in_quotes = not in_quotes
-                continue
-            if in_quotes:
-                continue
-            if ch == "[":
-                depth += 1
-            elif ch == "]":
-                depth -= 1
-        return depth == 0 and s.endswith("]")
-
-    while candidate and not balanced_json_array(candidate) and next_idx < len(lines):
-        if _PIPE_RE.match(lines[next_idx]):
-            break
-        buf.append(lines[next_idx])
-        next_idx += 1
-        candidate = "\n".join(buf).strip()
+    text, next_idx = _consume_multiline_json(first_fragment, lines, next_idx, "[", "]")
+    arr = _parse_raw_json_array(text)
+    if raw_text:
+        return RawJson(text), next_idx
+    return arr, next_idx
 
-    return _parse_raw_json_array(candidate), next_idx
 
+# Stages whose JSON payload may span several lines, by keyword: (kind, parser).
+_MULTILINE_JSON_STAGES: dict[str, tuple[str, Callable[..., tuple[Any, int]]]] = {
+    "raw": ("raw", _parse_raw_json_object_multiline),
+    "bulkexpand": ("bulkExpand", _parse_raw_json_object_multiline),
+    "fork": ("fork", _parse_raw_json_array_multiline),
+    "sessionreplays": ("sessionReplays", _parse_raw_json_object_multiline),
+    "pes": ("pes", _parse_raw_json_object_multiline),
+}
 
-def _parse_brace_map(text: str, *, context: str, coerce_values: bool = False) -> dict[str, Any]:
-    s = text.strip()
-    if not (s.startswith("{") and s.endswith("}")):
+
+def _consume_multiline_json(
+    first_fragment: str,
+    lines: list[Line],
+    next_idx: int,
+    opener: str,
+    closer: str,
+) -> tuple[str, int]:
+    """Collect the lines of a JSON value delimited by `opener`/`closer`.
+
+    Depth is tracked incrementally and the text is joined once, so the cost is linear
+    in the payload size. Returns (joined_text, next_index_after_consumed_lines).
+    """
+    buf = [first_fragment]
+    if first_fragment.startswith(opener):
+        depth = _BracketDepth(opener, closer)
+        depth.feed(first_fragment)
+        last = first_fragment
+        while not (depth.depth == 0 and last.endswith(closer)) and next_idx < len(lines):
+            # Continuation lines must NOT start a new pipe stage.
+            last = lines[next_idx].text
+            if last.startswith(("|", ">>")):
+                break
+            buf.append(last)
+            depth.feed(last)
+            next_idx += 1
+    return "\n".join(buf).strip(), next_idx
+
+
+def _parse_brace_map(src: Span, *, context: str, coerce_values: bool = False) -> dict[str, Any]:
+    s = src.strip()
+    if not (s.text.startswith("{") and s.text.endswith("}")):
         raise DslParseError(f"{context} syntax: | {context} {{ a=b, c=d }}")
-    inner = s[1:-1].strip()
-    if not inner:
+    inner = s.inner()
+    if not inner.text:
         raise DslParseError(f"{context} map cannot be empty")
 
-    items = _split_by_comma_respecting_groups(inner)
-
     out: dict[str, Any] = {}
-    for item in items:
-        if not item:
+    for item in inner.split(COMMA):
+        if not coerce_values:
+            key, sep, value = item.text.partition("=")
+            if not sep:
+                raise DslParseError(f"Invalid {context} mapping: {item.text}")
+            out[key.strip()] = value.strip()
             continue
-        if "=" in item:
-            key, value = [x.strip() for x in item.split("=", 1)]
-        elif coerce_values and ":" in item:
-            key, value = [x.strip() for x in item.split(":", 1)]
-        else:
-            raise DslParseError(f"Invalid {context} mapping: {item}")
 
-        if coerce_values:
-            key_val = _parse_scalar(key)
-            key = key_val if isinstance(key_val, str) else str(key_val)
-            out[key] = _parse_scalar(value)
-        else:
-            out[key] = value
+        kv = item.partition("=") or item.partition(":")
+        if kv is None:
+            raise DslParseError(f"Invalid {context} mapping: {item.text}")
+        key_val = _parse_scalar(kv[0])
+        out[key_val if isinstance(key_val, str) else str(key_val)] = _parse_scalar(kv[1])
     return out
 
 
-def _split_by_comma_respecting_groups(text: str) -> list[str]:
-    """Split a,b,c but keep commas inside quotes or parentheses."""
-    items: list[str] = []
-    buf: list[str] = []
-    in_quotes = False
-    escape = False
-    paren_depth = 0
-    bracket_depth = 0
-    brace_depth = 0
-
-    def flush() -> None:
-        s = "".join(buf).strip()
-        if s:
-            items.append(s)
-
-    for ch in text:
-        if escape:
-            buf.append(ch)
-            escape = False
-            continue
-        if ch == "\\":
-            escape = True
-            buf.append(ch)
-            continue
-        if ch == '"':
-            in_quotes = not in_quotes
-            buf.append(ch)
-            continue
-
-        if not in_quotes:
-            if ch == "(":
-                paren_depth += 1
-            elif ch == ")" and paren_depth > 0:
-                paren_depth -= 1
-            elif ch == "[":
-                bracket_depth += 1
-            elif ch == "]" and bracket_depth > 0:
-                bracket_depth -= 1
-            elif ch == "{":
-                brace_depth += 1
-            elif ch == "}" and brace_depth > 0:
-                brace_depth -= 1
-
-            if ch == "," and paren_depth == 0 and bracket_depth == 0 and brace_depth == 0:
-                flush()
-                buf = []
-                continue
-
-        buf.append(ch)
-
-    flush()
-    return items
-
-
 _GROUP_RE = re.compile(
     r"^group\s+by\s*(?P<group>.*?)\s+(?P<fields_kw>fields|fieldsMap|field)(?:\s+(?P<mode>map|list))?\s*\{(?P<fields>.*)\}\s*$",
     re.IGNORECASE,
 )
 
 
-def _parse_group(text: str) -> _GroupFields:
-    m = _GROUP_RE.match(text)
+_AGGREGATE_RE = re.compile(r"^(?P<agg>[a-zA-Z_][a-zA-Z0-9_]*)\((?P<arg>.*)\)$")
+
+
+def _parse_group(src: Span) -> GroupPayload:
+    m = _GROUP_RE.match(src.text)
     if not m:
         raise DslParseError(
             "Group syntax: | group by field1,field2 fields { alias=sum(field) }"
         )
-    group = [g.strip() for g in m.group("group").split(",") if g.strip()]
+    group = _names(m.group("group"))
     mode = (m.group("mode") or "").lower()
     kw = m.group("fields_kw").lower()
     if mode == "map":
@@ -1093,30 +934,28 @@ def _parse_group(text: str) -> _GroupFields:
         # - `fields { ... }` -> list form
         # - `fieldsMap { ... }` / `field { ... }` -> map form
         emit_map = kw in {"fieldsmap", "field"}
-    fields_text = m.group("fields").strip()
-    if not fields_text:
+    fields_src = src.sub(*m.span("fields")).strip()
+    if not fields_src.text:
         raise DslParseError("group fields {...} cannot be empty")
 
     # support comma-separated assignments inside fields block
     # Each assignment: alias=agg(arg)
     # arg may be a scalar (field/expression), the literal `null`, or an object map `{ k=v, ... }`.
-    assignments = _split_by_comma_respecting_groups(fields_text)
-
-    fields: list[tuple[str, str, Any]] = []
-    for a in assignments:
-        if not a:
-            continue
-        if "=" not in a:
-            raise DslParseError(f"Invalid fields assignment: {a}")
-        alias, expr = [x.strip() for x in a.split("=", 1)]
-        em = re.match(r"^(?P<agg>[a-zA-Z_][a-zA-Z0-9_]*)\((?P<arg>.*)\)$", expr)
+    fields: list[GroupField] = []
+    for a in fields_src.split(COMMA):
+        kv = a.partition("=")
+        if kv is None:
+            raise DslParseError(f"Invalid fields assignment: {a.text}")
+        alias_src, expr = kv
+        alias = sys.intern(alias_src.text)
+        em = _AGGREGATE_RE.match(expr.text)
         if not em:
-            raise DslParseError(f"Invalid aggregate expression: {expr}")
-        agg = em.group("agg")
-        arg = em.group("arg").strip()
-        if arg.lower() == "null":
+            raise DslParseError(f"Invalid aggregate expression: {expr.text}")
+        agg = sys.intern(em.group("agg"))
+        arg = expr.sub(*em.span("arg")).strip()
+        if arg.text.lower() == "null":
             arg_val: Any = None
-        elif arg.startswith("{"):
+        elif arg.text.startswith("{"):
             arg_val = _parse_brace_map(
                 arg,
                 context=f"group {alias}={agg}(...) argument",
@@ -1124,6 +963,6 @@ def _parse_group(text: str) -> _GroupFields:
             )
         else:
             arg_val = _parse_scalar(arg)
-        fields.append((alias, agg, arg_val))
+        fields.append(GroupField(alias, agg, arg_val))
 
-    return _GroupFields(group=group, fields=fields, emit_map=emit_map)
+    return GroupPayload(group=group, fields=tuple(fields), emit_map=emit_map)
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import json
+import re
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Iterable
+
+try:
+    from .compiler import compile_to_pendo_aggregation
+    from .dsl_ast import GroupPayload, Query, Stage, TimeSeries
+    from .expr import Literal, format_expression
+    from .fold import _Folder
+except ImportError:  # pragma: no cover
+    from compiler import compile_to_pendo_aggregation  # type: ignore
+    from dsl_ast import GroupPayload, Query, Stage, TimeSeries  # type: ignore
+    from expr import Literal, format_expression  # type: ignore
+    from fold import _Folder  # type: ignore
+
+
+class PlanError(ValueError):
+    pass
+
+
+# `dateAdd` units for the periods a window can be split along.
+_PERIOD_UNITS = {
+    "hourRange": "hours",
+    "dayRange": "days",
+    "weekRange": "weeks",
+    "monthRange": "months",
+}
+
+# Stages that act on each row independently of the others, so running them per window
+# and concatenating gives the same rows as running them over the whole window.
+_ROW_LOCAL_STAGES = frozenset(
+    {"filter", "identified", "eval", "select", "unmarshal", "unwind", "switch", "segment", "merge"}
+)
+
+# How per-window partial aggregates combine into the aggregate over the whole window.
+_COMBINERS = {"sum": "sum", "countIf": "sum", "min": "min", "max": "max"}
+
+_NOW_CALL_RE = re.compile(r"\bnow\s*\(", re.IGNORECASE)
+
+
+@dataclass(frozen=True, slots=True)
+class MergeSpec:
+    """How to combine the per-window results into the result for the whole window.
+
+    With `aggregates` set, rows are grouped by `group_by` and each aggregate alias is
+    combined with `sum`, `min` or `max`; with `aggregates=None` the rows are
+    concatenated. `sort` and `limit` (the stages after the group) are applied last.
+    """
+
+    group_by: tuple[str, ...]
+    aggregates: dict[str, str] | None
+    sort: tuple[str, ...] = ()
+    limit: int | None = None
+
+    def combine(self, partials: Iterable[Iterable[dict[str, Any]]]) -> list[dict[str, Any]]:
+        rows: list[dict[str, Any]]
+        if self.aggregates is None:
+            rows = [row for partial in partials for row in partial]
+        else:
+            groups: dict[tuple[Any, ...], dict[str, Any]] = {}
+            for partial in partials:
+                for row in partial:
+                    key = tuple(_hashable(row.get(f)) for f in self.group_by)
+                    acc = groups.get(key)
+                    if acc is None:
+                        groups[key] = dict(row)
+                        continue
+                    for alias, combiner in self.aggregates.items():
+                        acc[alias] = _combine(combiner, acc.get(alias), row.get(alias))
+            rows = list(groups.values())
+
+        # Stable sorts from the last key to the first give a multi-key sort.
+        for spec in reversed(self.sort):
+            field = spec.lstrip("+-")
+            present = [r for r in rows if r.get(field) is not None]
+            missing = [r for r in rows if r.get(field) is None]
+            present.sort(key=lambda r: r[field], reverse=spec.startswith("-"))
+            rows = present + missing
+        if self.limit is not None:
+            rows = rows[: self.limit]
+        return rows
+
+
+@dataclass(frozen=True, slots=True)
+class WindowPlan:
+    """Request bodies for contiguous sub-windows, in time order, plus how to merge them."""
+
+    windows: tuple[TimeSeries, ...]
+    bodies: tuple[dict[str, Any], ...]
+    merge: MergeSpec
+
+
+def plan_time_windows(query: Query, windows: int, *, now_ms: int | None = None) -> WindowPlan:
+    """Split the `TIMESERIES` of `query` into `windows` contiguous sub-windows.
+
+    The window must be given as `first=... count=N` with a period of `hourRange`,
+    `dayRange`, `weekRange` or `monthRange`; sub-window starts are
+    `dateAdd(first, k, "<unit>")`, so calendar arithmetic stays on the server. Every
+    `now()` in `first`, including inside an expression such as
+    `dateAdd(startOfPeriod("daily", now()), -30, "days")`, is pinned to `now_ms`
+    (default: the current time) so every sub-window starts from the same instant.
+
+    The pipeline must be row-local stages (filter, eval, select, switch, unwind,
+    merge, ...), optionally followed by one `group` whose aggregates are `sum`,
+    `count(null)`, `countIf`, `min` or `max`, and then only `sort`/`limit`. Each body
+    runs the pipeline up to and including the group; `MergeSpec.combine` applies the
+    rest to the combined rows. Anything else raises `PlanError` with the reason.
+    """
+    if windows < 1:
+        raise PlanError("windows must be >= 1")
+    ts = query.time_series
+    if query.event_source is None or ts is None:
+        raise PlanError("planning requires FROM event(...) with TIMESERIES")
+    if ts.count is None:
+        raise PlanError("TIMESERIES with last=... cannot be split; use first=... count=N")
+    unit = _PERIOD_UNITS.get(ts.period)
+    if unit is None:
+        raise PlanError(
+            f"TIMESERIES period={ts.period} cannot be split; supported periods: "
+            + ", ".join(_PERIOD_UNITS)
+        )
+    total = abs(ts.count)
+    if total < windows:
+        raise PlanError(f"TIMESERIES count={ts.count} cannot be split into {windows} windows")
+
+    stages, merge = _split_pipeline(query.stages)
+
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    first = _pin_now(ts.first, now_ms)
+    # A negative count extends backwards from `first`; the sub-windows do the same.
+    sign = -1 if ts.count < 0 else 1
+    sub_windows: list[TimeSeries] = []
+    offset = 0
+    for i in range(windows):
+        size = total // windows + (1 if i < total % windows else 0)
+        start = first if offset == 0 else f'dateAdd({first}, {sign * offset}, "{unit}")'
+        sub_windows.append(replace(ts, first=start, count=sign * size))
+        offset += size
+    if sign < 0:
+        sub_windows.reverse()
+
+    bodies = tuple(
+        compile_to_pendo_aggregation(
+            replace(query, time_series=window, stages=stages), now_ms=now_ms
+        )
+        for window in sub_windows
+    )
+    return WindowPlan(windows=tuple(sub_windows), bodies=bodies, merge=merge)
+
+
+def _pin_now(first: int | str, now_ms: int) -> int | str:
+    """`first` with every `now()` replaced by `now_ms`."""
+    if not isinstance(first, str):
+        return first
+    folded = _Folder(now_ms, None).text(first)
+    if isinstance(folded, Literal) and type(folded.value) is int:
+        first = folded.value
+    elif folded is not None:
+        first = format_expression(folded)
+    if isinstance(first, str) and _NOW_CALL_RE.search(first):
+        # Each sub-request would resolve it on its own, so the windows could drift apart.
+        raise PlanError(f"TIMESERIES first={first} cannot be split: its now() could not be pinned")
+    return first
+
+
+def _split_pipeline(stages: tuple[Stage, ...]) -> tuple[tuple[Stage, ...], MergeSpec]:
+    """The stages each window runs, and the merge spec for the rest."""
+    group_at = next((i for i, s in enumerate(stages) if s.kind == "group"), None)
+    if group_at is not None:
+        split = group_at + 1
+    else:
+        # Without a group, trailing sort/limit stages are applied to the combined rows.
+        split = len(stages)
+        while split and stages[split - 1].kind in ("sort", "limit"):
+            split -= 1
+
+    for n, stage in enumerate(stages[: group_at if group_at is not None else split], start=1):
+        if stage.kind == "sort" and group_at is not None:
+            continue  # The order of rows does not change sum/count/min/max.
+        if stage.kind not in _ROW_LOCAL_STAGES:
+            raise PlanError(
+                f"stage {n} ({stage.kind}) is not row-local; its result over the whole "
+                "window cannot be rebuilt from sub-windows"
+            )
+
+    aggregates: dict[str, str] | None = None
+    group_by: tuple[str, ...] = ()
+    if group_at is not None:
+        group: GroupPayload = stages[group_at].payload
+        group_by = tuple(group.group)
+        aggregates = {}
+        for field in group.fields:
+            if field.agg == "count" and field.arg is not None:
+                raise PlanError(
+                    f"group {field.alias}=count({field.arg}) counts distinct values, which "
+                    "cannot be added up across windows"
+                )
+            combiner = "sum" if field.agg == "count" else _COMBINERS.get(field.agg)
+            if combiner is None:
+                raise PlanError(
+                    f"group {field.alias}={field.agg}(...) cannot be combined across windows; "
+                    "supported aggregates: sum, count(null), countIf, min, max"
+                )
+            aggregates[field.alias] = combiner
+
+    sort: tuple[str, ...] = ()
+    limit: int | None = None
+    for n, stage in enumerate(stages[split:], start=split + 1):
+        if stage.kind == "sort" and limit is not None:
+            raise PlanError(f"stage {n} (sort) after a limit cannot be applied to combined rows")
+        if stage.kind == "sort":
+            sort = tuple(stage.payload)
+        elif stage.kind == "limit":
+            limit = int(stage.payload) if limit is None else min(limit, int(stage.payload))
+        else:
+            raise PlanError(
+                f"stage {n} ({stage.kind}) after the group needs the combined result; "
+                "only sort and limit can follow it"
+            )
+    return stages[:split], MergeSpec(group_by=group_by, aggregates=aggregates, sort=sort, limit=limit)
+
+
+def _combine(combiner: str, a: Any, b: Any) -> Any:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if combiner == "sum":
+        return a + b
+    return min(a, b) if combiner == "min" else max(a, b)
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
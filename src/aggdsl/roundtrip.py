@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Iterator
+
+try:
+    from .compiler import compile_to_pendo_aggregation
+    from .decompiler import decompile_pendo_aggregation_to_dsl
+    from .parser import parse
+except ImportError:  # pragma: no cover
+    from compiler import compile_to_pendo_aggregation  # type: ignore
+    from decompiler import decompile_pendo_aggregation_to_dsl  # type: ignore
+    from parser import parse  # type: ignore
+
+
+class RoundTripError(ValueError):
+    """A step of the round trip failed; the message names the step."""
+
+
+def roundtrip_body(body: Any) -> list[str]:
+    """Decompile `body`, parse and compile the DSL, and compare the result with `body`.
+
+    Returns the differences as `<JSON pointer>: <detail>` strings (empty when the
+    round trip is lossless). Raises `RoundTripError` when a step fails.
+
+    `body` is first brought into the form the compiler emits: a pipeline array or a
+    legacy `{"request": [...]}` becomes `{"request": {"pipeline": [...]}}`, and a missing
+    `response` or `response.location` is not a difference (the compiled body always
+    states them).
+    """
+    try:
+        dsl = decompile_pendo_aggregation_to_dsl(body)
+    except ValueError as e:
+        raise RoundTripError(f"decompile: {e}") from e
+    try:
+        query = parse(dsl)
+    except ValueError as e:
+        raise RoundTripError(f"parse: {e}") from e
+    try:
+        compiled = compile_to_pendo_aggregation(query)
+    except ValueError as e:
+        raise RoundTripError(f"compile: {e}") from e
+
+    expected = _normalize(body)
+    if "response" not in expected:
+        compiled.pop("response", None)
+    elif isinstance(expected["response"], dict) and "location" not in expected["response"]:
+        compiled["response"].pop("location", None)
+    return list(diff_json(expected, compiled))
+
+
+def diff_json(expected: Any, actual: Any, pointer: str = "") -> Iterator[str]:
+    """Structural differences between two JSON values, as `<JSON pointer>: <detail>`.
+
+    Types are compared strictly: `1`, `1.0`, `true` and `"1"` all differ. Object key
+    order is ignored; array order is not.
+    """
+    if type(expected) is not type(actual):
+        yield f"{pointer or '/'}: expected {_show(expected)}, got {_show(actual)}"
+    elif isinstance(expected, dict):
+        for key, value in expected.items():
+            here = f"{pointer}/{_escape(key)}"
+            if key not in actual:
+                yield f"{here}: missing (expected {_show(value)})"
+            else:
+                yield from diff_json(value, actual[key], here)
+        for key in actual.keys() - expected.keys():
+            yield f"{pointer}/{_escape(key)}: unexpected {_show(actual[key])}"
+    elif isinstance(expected, list):
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            yield from diff_json(a, b, f"{pointer}/{i}")
+        if len(expected) != len(actual):
+            yield f"{pointer or '/'}: expected {len(expected)} items, got {len(actual)}"
+    elif expected != actual:
+        yield f"{pointer or '/'}: expected {_show(expected)}, got {_show(actual)}"
+
+
+def _normalize(body: Any) -> Any:
+    if isinstance(body, list):
+        return {"request": {"pipeline": body}}
+    if isinstance(body, dict) and isinstance(body.get("request"), list):
+        return {**body, "request": {"pipeline": body["request"]}}
+    return body
+
+
+def _escape(key: str) -> str:
+    # RFC 6901: `~` and `/` in keys are written `~0` and `~1`.
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _show(value: Any, limit: int = 60) -> str:
+    try:
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    except (TypeError, ValueError):
+        text = repr(value)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Callable
+
+try:
+    from .compiler import _STAGE_COMPILERS
+    from .decompiler import _STAGE_DECOMPILERS
+    from .dsl_ast import Stage
+    from .lexer import Span
+    from .parser import _STAGE_PARSERS
+except ImportError:  # pragma: no cover
+    from compiler import _STAGE_COMPILERS  # type: ignore
+    from decompiler import _STAGE_DECOMPILERS  # type: ignore
+    from dsl_ast import Stage  # type: ignore
+    from lexer import Span  # type: ignore
+    from parser import _STAGE_PARSERS  # type: ignore
+
+
+class StageRegistrationError(ValueError):
+    pass
+
+
+_KIND_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Built-in kinds and block keywords, lowercased: the DSL matches stage keywords
+# case-insensitively, so a user kind must differ from these in more than case.
+_RESERVED = frozenset(
+    {k.lower() for k in (*_STAGE_PARSERS, *_STAGE_COMPILERS, *_STAGE_DECOMPILERS)}
+    | {"source", "merge", "spawn", "fork", "branch", "endbranch", "endmerge", "endfork", "endspawn"}
+)
+
+# User kinds registered so far, by lowercase keyword.
+_REGISTERED: dict[str, str] = {}
+
+
+def register_stage(
+    kind: str,
+    *,
+    parse: Callable[[str], Any] | None = None,
+    compile: Callable[[Any], Any] | None = None,
+    decompile: Callable[[Any], str | None] | None = None,
+) -> None:
+    """Teach the parser, compiler and decompiler a new single-key stage `{kind: value}`.
+
+    - `parse(text)` gets the DSL text after the keyword (`| <kind> <text>`, keyword
+      matched case-insensitively) and returns the `Stage.payload`.
+    - `compile(payload)` returns the stage's JSON value; the compiled stage is
+      `{kind: value}`.
+    - `decompile(value)` returns the DSL text after the keyword, or None to keep the
+      stage as `| raw {...}`.
+
+    Any of the three may be omitted: the DSL form is then an unknown stage, the
+    compiler raises `CompileError`, or the decompiler emits `raw`, respectively.
+    Built-in kinds cannot be replaced, and a kind can only be registered once (see
+    `unregister_stage`).
+    """
+    if not _KIND_RE.fullmatch(kind):
+        raise StageRegistrationError(f"Invalid stage kind: {kind!r}")
+    keyword = kind.lower()
+    if keyword in _RESERVED:
+        raise StageRegistrationError(f"Stage kind {kind!r} is built in")
+    if keyword in _REGISTERED:
+        raise StageRegistrationError(f"Stage kind {_REGISTERED[keyword]!r} is already registered")
+
+    _REGISTERED[keyword] = kind
+    if parse is not None:
+        _STAGE_PARSERS[keyword] = _stage_parser(kind, parse)
+    if compile is not None:
+        _STAGE_COMPILERS[kind] = lambda payload, now_ms, compile_query: {kind: compile(payload)}
+    if decompile is not None:
+        _STAGE_DECOMPILERS[kind] = _stage_decompiler(kind, decompile)
+
+
+def unregister_stage(kind: str) -> None:
+    """Remove a kind added by `register_stage`."""
+    keyword = kind.lower()
+    if _REGISTERED.get(keyword) != kind:
+        raise StageRegistrationError(f"Stage kind {kind!r} is not registered")
+    del _REGISTERED[keyword]
+    _STAGE_PARSERS.pop(keyword, None)
+    _STAGE_COMPILERS.pop(kind, None)
+    _STAGE_DECOMPILERS.pop(kind, None)
+
+
+def _stage_parser(kind: str, parse: Callable[[str], Any]) -> Callable[[Span], Stage]:
+    def parse_stage(src: Span) -> Stage:
+        return Stage(kind=kind, payload=parse(src.text[len(kind) + 1 :].strip()))
+
+    return parse_stage
+
+
+def _stage_decompiler(kind: str, decompile: Callable[[Any], str | None]) -> Callable[[Any, str], list[str] | None]:
+    def decompile_stage(value: Any, prefix: str) -> list[str] | None:
+        text = decompile(value)
+        return None if text is None else [f"{prefix} {kind} {text}"]
+
+    return decompile_stage
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable, Iterator, Mapping
+
+try:
+    from .cache import CompileCache
+    from .compiler import compile_to_pendo_aggregation
+    from .parser import parse
+except ImportError:  # pragma: no cover
+    from cache import CompileCache  # type: ignore
+    from compiler import compile_to_pendo_aggregation  # type: ignore
+    from parser import parse  # type: ignore
+
+
+def compile_stream(
+    records: Iterable[str | Mapping[str, Any]],
+    *,
+    now_ms: int | None = None,
+    cache: CompileCache | None = None,
+    raw_text: bool = False,
+) -> Iterator[dict[str, Any]]:
+    """Compile a stream of `{"id": ..., "dsl": ...}` records lazily.
+
+    `records` may contain mappings or JSON Lines text (blank lines are skipped). For
+    each record, yields `{"id": ..., "body": ...}` on success or `{"id": ..., "error": ...}`
+    on failure, in input order, as soon as that record is compiled. Nothing is
+    buffered, so memory use does not grow with the length of the stream.
+
+    Pass a `CompileCache` to reuse work across records with identical DSL text. With
+    `raw_text=True` (see `parse`), bodies may hold `RawJson` values; serialize them with
+    `aggdsl.emit.dumps`. The cache only stores fully parsed bodies, so the two options
+    cannot be combined.
+    """
+    if cache is not None and raw_text:
+        raise ValueError("compile_stream: cache cannot be combined with raw_text")
+    for record in records:
+        record_id: Any = None
+        try:
+            if isinstance(record, str):
+                if not record.strip():
+                    continue
+                record = json.loads(record)
+            if not isinstance(record, Mapping):
+                raise ValueError("record must be a JSON object")
+            record_id = record.get("id")
+            dsl = record.get("dsl")
+            if not isinstance(dsl, str):
+                raise ValueError("record requires a string 'dsl' field")
+
+            if cache is not None:
+                body = cache.compile(dsl, now_ms=now_ms)
+            else:
+                query = parse(dsl, raw_text=raw_text)
+                body = compile_to_pendo_aggregation(query, now_ms=now_ms)
+        except ValueError as e:
+            # Covers DslParseError, CompileError and json.JSONDecodeError.
+            yield {"id": record_id, "error": str(e)}
+            continue
+        yield {"id": record_id, "body": body}
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Mapping
+
+try:
+    from .cache import _find_now_slots
+    from .compiler import compile_to_pendo_aggregation
+    from .dsl_ast import Query
+    from .parser import parse
+except ImportError:  # pragma: no cover
+    from cache import _find_now_slots  # type: ignore
+    from compiler import compile_to_pendo_aggregation  # type: ignore
+    from dsl_ast import Query  # type: ignore
+    from parser import parse  # type: ignore
+
+
+class TemplateError(ValueError):
+    pass
+
+
+_PLACEHOLDER_RE = re.compile(r"\{\{([^{}]+)\}\}")
+
+# Slot kinds.
+_WHOLE = 0  # the value is exactly `{{NAME}}` and is replaced by the bound value
+_EMBEDDED = 1  # placeholders inside a longer string (e.g. a filter expression)
+_NOW = 2  # a TIMESERIES `now()` value
+
+
+class _PlanNode:
+    """The containers on the way to the slots, so `bind` copies exactly those."""
+
+    __slots__ = ("children", "leaves")
+
+    def __init__(self) -> None:
+        self.children: dict[Any, _PlanNode] = {}
+        # (key, kind, data): a placeholder name, a list of literal/name parts, or None.
+        self.leaves: list[tuple[Any, int, Any]] = []
+
+
+class Template:
+    """A DSL query compiled once, with `{{NAME}}` placeholders and `now()` slots recorded.
+
+    `bind()` fills only the recorded slots: the containers on the paths to them are
+    copied and everything else is shared with the template, so the cost depends on the
+    number of slots rather than on the size of the body. Bound bodies share structure
+    with the template and with each other and must be treated as read-only.
+
+    A string value that is exactly `{{NAME}}` is replaced by the bound value as-is (so
+    `appId={{APP_ID}}` can become an int); placeholders inside longer strings (filters,
+    eval expressions) are replaced by the value's text (`str` for strings, JSON
+    otherwise). Placeholders in object keys are not substituted.
+    """
+
+    __slots__ = ("_body", "_plan", "placeholders")
+
+    def __init__(self, query: Query) -> None:
+        self._body = compile_to_pendo_aggregation(query)
+        self._plan = _PlanNode()
+        names: set[str] = set()
+
+        for path, key, value in _iter_strings(self._body, ()):
+            if "{{" not in value:
+                continue
+            whole = _PLACEHOLDER_RE.fullmatch(value)
+            if whole:
+                name = whole.group(1).strip()
+                names.add(name)
+                self._add(path, key, _WHOLE, name)
+                continue
+            parts: list[tuple[bool, str]] = []
+            pos = 0
+            for m in _PLACEHOLDER_RE.finditer(value):
+                parts.append((False, value[pos : m.start()]))
+                parts.append((True, m.group(1).strip()))
+                names.add(m.group(1).strip())
+                pos = m.end()
+            if pos:
+                parts.append((False, value[pos:]))
+                self._add(path, key, _EMBEDDED, parts)
+
+        for path, field in _find_now_slots(query):
+            self._add(path, field, _NOW, None)
+
+        self.placeholders = frozenset(names)
+
+    def _add(self, path: tuple[Any, ...], key: Any, kind: int, data: Any) -> None:
+        node = self._plan
+        for step in path:
+            child = node.children.get(step)
+            if child is None:
+                child = node.children[step] = _PlanNode()
+            node = child
+        node.leaves.append((key, kind, data))
+
+    def bind(self, params: Mapping[str, Any] | None = None, *, now_ms: int | None = None) -> dict[str, Any]:
+        """Return the body with placeholders set from `params` and `now()` set to `now_ms`.
+
+        Every placeholder must be bound and no other names may be given. With
+        `now_ms=None`, `now()` is kept literally (as in `compile_to_pendo_aggregation`).
+        """
+        params = {} if params is None else params
+        if params.keys() != self.placeholders:
+            missing = sorted(self.placeholders - params.keys())
+            unknown = sorted(params.keys() - self.placeholders)
+            detail = []
+            if missing:
+                detail.append(f"missing {', '.join(missing)}")
+            if unknown:
+                detail.append(f"unknown {', '.join(unknown)}")
+            raise TemplateError(f"Template parameters do not match: {'; '.join(detail)}")
+        return _apply(self._body, self._plan, params, now_ms)
+
+
+def compile_template(dsl: str) -> Template:
+    """Parse and compile `dsl` once for repeated `Template.bind()` calls."""
+    return Template(parse(dsl))
+
+
+def _iter_strings(value: Any, path: tuple[Any, ...]):
+    # Yields (container_path, key, string) for every string value in the body.
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return
+    for key, item in items:
+        if isinstance(item, str):
+            yield path, key, item
+        elif isinstance(item, (dict, list)):
+            yield from _iter_strings(item, (*path, key))
+
+
+def _apply(container: Any, node: _PlanNode, params: Mapping[str, Any], now_ms: int | None) -> Any:
+    out = dict(container) if isinstance(container, dict) else list(container)
+    for key, child in node.children.items():
+        out[key] = _apply(out[key], child, params, now_ms)
+    for key, kind, data in node.leaves:
+        if kind == _WHOLE:
+            out[key] = params[data]
+        elif kind == _EMBEDDED:
+            out[key] = "".join(_text(params[text]) if is_name else text for is_name, text in data)
+        elif now_ms is not None:
+            out[key] = now_ms
+    return out
+
+
+def _text(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator
+
+import pytest
+
+
+class StandInServer:
+    """Local HTTP/1.1 stand-in for the Pendo aggregation endpoint.
+
+    `respond(payload, headers)` returns each reply as (status, extra headers, body), or
+    None to hang up without answering; the default is 200 echoing the payload. A bytes
+    body is sent as is, anything else as JSON. With `drop_idle` set, the server
+    closes every connection after its response without announcing it, like a server
+    whose keep-alive timeout has passed.
+    """
+
+    def __init__(self) -> None:
+        self.respond: Callable[[Any, Any], Any] = lambda payload, headers: (200, {}, {"echo": payload})
+        self.drop_idle = False
+        self.requests: list[Any] = []
+        self.connections = 0
+        self.closed = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}/api/v1/aggregation"
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _make_handler(stand_in: StandInServer) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self) -> None:
+            super().setup()
+            with stand_in._lock:
+                stand_in.connections += 1
+
+        def finish(self) -> None:
+            super().finish()
+            with stand_in._lock:
+                stand_in.closed += 1
+
+        def do_POST(self) -> None:
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                payload = json.loads(raw)
+            except ValueError:
+                payload = raw
+            with stand_in._lock:
+                stand_in.requests.append(payload)
+            reply = stand_in.respond(payload, self.headers)
+            if reply is None:
+                self.close_connection = True
+                return
+            status, headers, body = reply
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            if stand_in.drop_idle:
+                self.close_connection = True
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def stand_in_server(monkeypatch: pytest.MonkeyPatch) -> Iterator[StandInServer]:
+    monkeypatch.setenv("NO_PROXY", "*")
+    server = StandInServer()
+    try:
+        yield server
+    finally:
+        server.close()
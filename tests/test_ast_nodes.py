@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.dsl_ast import (
+    Branches,
+    GroupPayload,
+    JoinPayload,
+    MergePayload,
+    Query,
+    Stage,
+    SwitchCase,
+    SwitchPayload,
+)
+
+
+DSL = """\
+FROM event([source=pageEvents,appId=1])
+TIMESERIES period=dayRange first=now() count=-7
+| switch bucket from score { "1"=="low" }
+| merge fields [visitorId, accountId]
+  PIPELINE
+  | join fields [visitorId]
+endmerge
+| fork
+  | branch
+  || group by visitorId fields { n=count(null) }
+  | endbranch
+| endfork
+| sort -n
+"""
+
+
+def test_stages_are_tuples_with_typed_payloads() -> None:
+    q = parse(DSL)
+    assert isinstance(q.stages, tuple)
+    switch, merge, fork, sort = q.stages
+
+    assert switch.payload == SwitchPayload("bucket", "score", (SwitchCase("1", "low"),))
+    assert isinstance(merge.payload, MergePayload)
+    assert merge.payload.fields == ("visitorId", "accountId")
+    assert merge.payload.query.stages == (Stage("join", JoinPayload(("visitorId",))),)
+    assert isinstance(fork.payload, Branches)
+    (branch,) = fork.payload
+    assert isinstance(branch.stages[0].payload, GroupPayload)
+    assert sort.payload == ("-n",)
+
+
+def test_nodes_are_slotted() -> None:
+    q = parse(DSL)
+    for node in (q, q.event_source, q.time_series, q.stages[0], q.stages[1].payload):
+        assert not hasattr(node, "__dict__")
+
+
+def test_query_accepts_a_stage_list() -> None:
+    q = Query(event_source=None, time_series=None, stages=[Stage("limit", 1)])
+    assert q.stages == (Stage("limit", 1),)
+    assert compile_to_pendo_aggregation(q)["request"]["pipeline"] == [{"limit": 1}]
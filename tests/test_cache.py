@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import pytest
+
+import aggdsl.cache as cache_module
+from aggdsl import CompileCache, compile_to_pendo_aggregation, parse
+from aggdsl.cache import DiskCache
+from aggdsl.cli import main
+from aggdsl.parser import DslParseError
+
+
+DSL = """\
+FROM event([source=pageEvents,pageId="p1"])
+TIMESERIES period=dayRange first=now() count=-30
+| merge fields [visitorId]
+FROM event([source=visitors])
+TIMESERIES period=dayRange first=now() count=-7
+| identified visitorId
+endmerge
+| limit 10
+"""
+
+
+def test_cache_returns_same_query_and_counts_hits() -> None:
+    cache = CompileCache(maxsize=4)
+
+    q1 = cache.parse(DSL)
+    q2 = cache.parse(DSL)
+
+    assert q1 is q2
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+
+def test_cache_resolves_now_per_call_without_touching_cached_body() -> None:
+    cache = CompileCache()
+
+    body_a = cache.compile(DSL, now_ms=1000)
+    body_b = cache.compile(DSL, now_ms=2000)
+
+    assert body_a == compile_to_pendo_aggregation(parse(DSL), now_ms=1000)
+    assert body_b == compile_to_pendo_aggregation(parse(DSL), now_ms=2000)
+    assert cache.compile(DSL) == compile_to_pendo_aggregation(parse(DSL))
+    assert cache.stats().misses == 1
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    cache = CompileCache(maxsize=2)
+    docs = [f"PIPELINE\n| limit {n}\n" for n in range(3)]
+
+    cache.parse(docs[0])
+    cache.parse(docs[1])
+    cache.parse(docs[0])
+    cache.parse(docs[2])
+
+    stats = cache.stats()
+    assert stats.evictions == 1
+    assert stats.size == 2
+
+    cache.parse(docs[0])
+    assert cache.stats().hits == 2
+
+
+def test_cache_does_not_store_parse_errors() -> None:
+    cache = CompileCache()
+
+    with pytest.raises(DslParseError):
+        cache.parse("| limit 1\n")
+
+    assert len(cache) == 0
+
+
+def test_disk_cache_serves_unchanged_documents_without_parsing(tmp_path, monkeypatch) -> None:
+    cache = DiskCache(tmp_path)
+    expected = compile_to_pendo_aggregation(parse(DSL), now_ms=5)
+
+    assert cache.compile(DSL, now_ms=5) == expected
+
+    def fail(_dsl: str) -> None:
+        raise AssertionError("cache hit must not parse")
+
+    monkeypatch.setattr(cache_module, "parse", fail)
+    assert DiskCache(tmp_path).compile(DSL, now_ms=5) == expected
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_disk_cache_treats_corrupt_entries_as_misses(tmp_path) -> None:
+    cache = DiskCache(tmp_path)
+    cache.compile(DSL)
+    (entry,) = tmp_path.rglob("*.json")
+    entry.write_text("{not json", encoding="utf-8")
+
+    assert cache.compile(DSL) == compile_to_pendo_aggregation(parse(DSL))
+
+
+def test_disk_cache_evicts_to_size_cap(tmp_path) -> None:
+    cache = DiskCache(tmp_path, max_bytes=16 * 400)
+    for n in range(200):
+        cache.compile(f"PIPELINE\n| limit {n}\n")
+
+    total = sum(p.stat().st_size for p in tmp_path.rglob("*.json"))
+    assert 0 < total <= 16 * 400
+
+
+def test_cli_compile_uses_cache_dir_unless_disabled(tmp_path, capsys) -> None:
+    dsl_path = tmp_path / "q.dsl"
+    dsl_path.write_text("PIPELINE\n| limit 1\n", encoding="utf-8")
+    cache_dir = tmp_path / "cache"
+
+    assert main(["compile", str(dsl_path), "--no-cache", "--cache-dir", str(cache_dir)]) == 0
+    assert not cache_dir.exists()
+
+    assert main(["compile", str(dsl_path), "--cache-dir", str(cache_dir)]) == 0
+    assert len(list(cache_dir.rglob("*.json"))) == 1
+    assert '"limit": 1' in capsys.readouterr().out
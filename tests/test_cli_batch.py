@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from aggdsl.cli import main
+
+
+def _write(path: Path, text: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_batch_compile_directory_into_out_dir(tmp_path: Path, capsys) -> None:
+    src = tmp_path / "queries"
+    _write(src / "a.dsl", "PIPELINE\n| limit 1\n")
+    _write(src / "nested" / "b.dsl", "PIPELINE\n| limit 2\n")
+    out = tmp_path / "out"
+
+    rc = main(["compile", str(src), "--out-dir", str(out), "--jobs", "2", "--no-cache"])
+
+    assert rc == 0
+    a = json.loads((out / "a.json").read_text(encoding="utf-8"))
+    b = json.loads((out / "nested" / "b.json").read_text(encoding="utf-8"))
+    assert a["request"]["pipeline"] == [{"limit": 1}]
+    assert b["request"]["pipeline"] == [{"limit": 2}]
+    assert "Total: 2  Passed: 2  Failed: 0" in capsys.readouterr().out
+
+
+def test_batch_check_reports_failures_without_writing(tmp_path: Path, capsys) -> None:
+    good = _write(tmp_path / "good.dsl", "PIPELINE\n| limit 1\n")
+    bad = _write(tmp_path / "bad.dsl", "| limit 1\n")
+
+    rc = main(["compile", str(tmp_path / "*.dsl"), "--check", "--jobs", "1", "--no-cache"])
+
+    assert rc == 2
+    out = capsys.readouterr().out
+    assert f"ok   {good}" in out
+    assert f"FAIL {bad}: Expected: FROM event([..]) or PIPELINE" in out
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_batch_writes_next_to_inputs_by_default(tmp_path: Path) -> None:
+    a = _write(tmp_path / "a.dsl", "PIPELINE\n| limit 1\n")
+    b = _write(tmp_path / "b.dsl", "PIPELINE\n| limit 2\n")
+
+    assert main(["compile", str(a), str(b), "--jobs", "1", "--no-cache"]) == 0
+
+    assert json.loads(a.with_suffix(".json").read_text(encoding="utf-8"))["request"]["pipeline"] == [
+        {"limit": 1}
+    ]
+    assert b.with_suffix(".json").exists()
+
+
+def test_jsonl_mode_streams_bodies_and_errors(tmp_path: Path, capsys) -> None:
+    records = [
+        json.dumps({"id": 1, "dsl": "PIPELINE\n| limit 1\n"}),
+        "",
+        json.dumps({"id": "b", "dsl": "| limit 1\n"}),
+        "{not json",
+    ]
+    src = _write(tmp_path / "in.jsonl", "\n".join(records) + "\n")
+
+    rc = main(["compile", "--jsonl", str(src)])
+
+    assert rc == 2
+    out = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert out[0] == {"id": 1, "body": _body([{"limit": 1}])}
+    assert out[1] == {"id": "b", "error": "Expected: FROM event([..]) or PIPELINE"}
+    assert out[2]["id"] is None and "error" in out[2]
+    assert len(out) == 3
+
+
+def _body(pipeline: list) -> dict:
+    return {
+        "response": {"location": "request", "mimeType": "application/json"},
+        "request": {"pipeline": pipeline},
+    }
+
+
+def test_batch_out_dir_rejects_colliding_output_names(tmp_path: Path, capsys) -> None:
+    a = _write(tmp_path / "a" / "q.dsl", "PIPELINE\n| limit 1\n")
+    b = _write(tmp_path / "b" / "q.dsl", "PIPELINE\n| limit 2\n")
+    out = tmp_path / "out"
+
+    rc = main(["compile", str(a.parent), str(b.parent), "--out-dir", str(out), "--jobs", "2", "--no-cache"])
+
+    assert rc == 2
+    err = capsys.readouterr().err
+    assert str(a) in err and str(b) in err
+    assert not out.exists()
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import itertools
+
+from aggdsl import CompileCache, compile_stream
+
+
+def test_compile_stream_is_lazy_and_preserves_order() -> None:
+    def records():
+        for n in itertools.count():
+            yield {"id": n, "dsl": f"PIPELINE\n| limit {n % 3}\n"}
+
+    cache = CompileCache(maxsize=8)
+    results = compile_stream(records(), cache=cache)
+    first = list(itertools.islice(results, 5))
+
+    assert [r["id"] for r in first] == [0, 1, 2, 3, 4]
+    assert first[4]["body"]["request"]["pipeline"] == [{"limit": 1}]
+    assert cache.stats().hits == 2
+
+
+def test_compile_stream_reports_bad_records() -> None:
+    results = list(compile_stream(['{"id": 7}', '["x"]'], now_ms=1))
+
+    assert results == [
+        {"id": 7, "error": "record requires a string 'dsl' field"},
+        {"id": None, "error": "record must be a JSON object"},
+    ]
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from aggdsl import parse
+from aggdsl.cli import main
+from aggdsl.cost import DEFAULT_EVENT_ROWS_PER_DAY, estimate_cost
+
+
+def _query(window: str = "count=-30", stages: str = "") -> str:
+    return (
+        "FROM event([source=pageEvents,appId=1])\n"
+        f"TIMESERIES period=dayRange first=now() {window}\n"
+        f"{stages}"
+    )
+
+
+def test_cost_scales_with_window_and_source_rows() -> None:
+    month = estimate_cost(parse(_query("count=-30")))
+    year = estimate_cost(parse(_query("count=-365")))
+
+    assert month.window_days == 30
+    assert month.rows == 30 * DEFAULT_EVENT_ROWS_PER_DAY["pageEvents"]
+    assert year.cost > 12 * month.cost
+
+    calibrated = estimate_cost(parse(_query("count=-30")), source_rows={"pageEvents": 10})
+    assert calibrated.rows == 300
+
+    fixed = estimate_cost(parse(_query("last=1700086400000").replace("first=now()", "first=1700000000000")))
+    assert fixed.window_days == 1
+
+    unknown = estimate_cost(parse(_query("last=now()").replace("first=now()", 'first="dateAdd(now(), -7, \\"days\\")"')))
+    assert "window length is not constant" in unknown.nodes[0].notes[0]
+
+
+def test_filter_before_unwind_is_cheaper_and_late_filters_are_reported() -> None:
+    unwind = "| unwind { field=list, index=listIndex }\n"
+    flt = '| filter pageId == "home"\n'
+    early = estimate_cost(parse(_query(stages=flt + unwind)))
+    late = estimate_cost(parse(_query(stages=unwind + flt)))
+
+    assert early.rows == late.rows
+    assert early.cost < late.cost
+    assert early.warnings == ()
+    assert late.warnings == (
+        "pipeline: stage 2: filter runs after unwind (stage 1); if it does not use that stage's output, filter earlier",
+    )
+
+
+def test_nested_queries_are_counted_and_included() -> None:
+    dsl = _query(
+        stages="""\
+| merge fields [visitorId]
+  FROM event([source=visitors,appId=1])
+endmerge
+| bulkExpand {"account":{"account":"accountId"}}
+| fork
+  | branch
+  || group by visitorId fields { n=count(null) }
+  | endbranch
+  | branch
+  || limit 5
+  | endbranch
+| endfork
+"""
+    )
+    estimate = estimate_cost(parse(dsl))
+    assert (estimate.merges, estimate.bulk_expands, estimate.branches) == (1, 1, 2)
+
+    merge, fork = estimate.nodes[1], estimate.nodes[3]
+    assert merge.children[0].label == "source visitors"
+    assert merge.cost > merge.children[0].cost
+    assert [b.label for b in fork.children] == ["branch 1", "branch 2"]
+    assert fork.rows_out == sum(b.rows_out for b in fork.children)
+    assert fork.children[1].rows_out == 5
+    assert estimate.cost == sum(n.cost for n in estimate.nodes)
+
+
+def test_cli_explain_prints_tree_and_enforces_budget(tmp_path: Path, capsys) -> None:
+    path = tmp_path / "q.dsl"
+    path.write_text(_query(stages="| group by visitorId fields { n=sum(numEvents) }\n"), encoding="utf-8")
+
+    assert main(["explain", str(path)]) == 0
+    out = capsys.readouterr().out
+    assert out.startswith("estimated cost: ")
+    assert "\nsource pageEvents dayRange (30 days) " in out
+    assert "\n| group by visitorId " in out
+
+    assert main(["explain", str(path), "--max-cost", "1000"]) == 1
+    assert "exceeds --max-cost 1000" in capsys.readouterr().err
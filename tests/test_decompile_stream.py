@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+import aggdsl.decompile_stream as decompile_stream
+from aggdsl import (
+    compile_to_pendo_aggregation,
+    decompile_json_stream,
+    decompile_pendo_aggregation_to_dsl,
+    decompile_to_stream,
+    parse,
+)
+from aggdsl.cli import main
+from aggdsl.decompiler import DecompileError
+
+
+_DSL = "\n".join(
+    [
+        "RESPONSE mimeType=application/json",
+        'REQUEST name="Big"',
+        "FROM event([source=pageEvents,appId=1])",
+        "TIMESERIES period=dayRange first=now() count=-7",
+        "| filter pageId == \"p1\"",
+        '| bulkExpand {"account":{"account":"accountId"}}',
+        "| fork",
+        "branch",
+        "PIPELINE",
+        "|| filter x > 1.5",
+        "endbranch",
+        "branch",
+        "PIPELINE",
+        "|| limit 3",
+        "endbranch",
+        "| endfork",
+        "| merge fields [visitorId] mappings { a=b }",
+        "PIPELINE",
+        "| select { v=visitorId }",
+        "endmerge",
+        "| group by [visitorId] fields { n=count(null) }",
+        "",
+    ]
+)
+
+_BULK = {"account": {"ids": [{"id": i, "name": "é \"q\" \\ x", "score": i * 1.5e3} for i in range(200)]}}
+
+
+def _big_body() -> dict:
+    body = compile_to_pendo_aggregation(parse(_DSL), now_ms=0)
+    pipeline = body["request"]["pipeline"]
+    pipeline.insert(2, {"bulkExpand": _BULK})
+    pipeline.insert(3, {"fork": [[{"bulkExpand": _BULK}, {"limit": 1}], [{"filter": "y"}]]})
+    pipeline.insert(4, {"fork": [{"not": "a branch"}, [1]]})
+    pipeline.insert(5, {"merge": {"pipeline": [{"bulkExpand": _BULK}], "fields": ["v"]}})
+    return body
+
+
+def _stream(text: str, chunk_size: int = 4096) -> str:
+    out = io.StringIO()
+    decompile_json_stream(io.StringIO(text), out, chunk_size=chunk_size)
+    return out.getvalue()
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    # Force the element-by-element and spooling paths on small inputs.
+    monkeypatch.setattr(decompile_stream, "_DECODE_LIMIT", 64)
+    monkeypatch.setattr(decompile_stream, "_SPOOL_LIMIT", 128)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_stream_matches_in_memory_decompiler(small_limits, chunk_size: int) -> None:
+    body = _big_body()
+    expected = decompile_pendo_aggregation_to_dsl(body)
+
+    assert _stream(json.dumps(body, indent=1, ensure_ascii=False), chunk_size) == expected
+    assert _stream(json.dumps(body), chunk_size) == expected
+
+
+def test_headers_after_pipeline_and_legacy_forms(small_limits) -> None:
+    body = _big_body()
+    request = body["request"]
+    variants = [
+        {"request": {"pipeline": request["pipeline"], "name": "Late"}, "response": body["response"]},
+        {"request": request["pipeline"]},
+        request["pipeline"],
+    ]
+    for variant in variants:
+        assert _stream(json.dumps(variant)) == decompile_pendo_aggregation_to_dsl(variant)
+
+
+def test_decompile_to_stream_writes_same_text() -> None:
+    body = _big_body()
+    out = io.StringIO()
+    decompile_to_stream(body, out)
+    assert out.getvalue() == decompile_pendo_aggregation_to_dsl(body)
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ('{"response": {}}', "Missing 'request' in aggregation body"),
+        ('{"request": 1}', "'request' must be a list or an object"),
+        ('[{"limit": 1},]', "Invalid JSON: trailing ',' before ']'"),
+        ('{"request": []} []', "Invalid JSON: unexpected data after the body"),
+        ('[{"limit": 1}', "Invalid JSON: expected ',' or ']', found 'end of input'"),
+    ],
+)
+def test_invalid_input_raises_decompile_error(text: str, message: str) -> None:
+    with pytest.raises(DecompileError) as e:
+        _stream(text)
+    assert str(e.value) == message
+
+
+def test_cli_decompile_streams_file(tmp_path: Path, capsys) -> None:
+    body = _big_body()
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(body, indent=2), encoding="utf-8")
+
+    assert main(["decompile", str(path)]) == 0
+    assert capsys.readouterr().out == decompile_pendo_aggregation_to_dsl(body)
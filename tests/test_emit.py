@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import io
+import json
+
+import pytest
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.cli import _compile_chunks
+from aggdsl.emit import iter_body, iter_dumps, write_body
+
+
+DSL = """\
+RESPONSE mimeType=text/csv
+REQUEST name="Streamed ü"
+FROM event([source=pageEvents,pageId="p1"])
+TIMESERIES period=dayRange first=now() count=-7
+| merge fields [visitorId] mappings { a=b }
+FROM event([source=visitors])
+TIMESERIES period=dayRange first=now() count=-1
+| fork
+branch
+PIPELINE
+endbranch
+branch
+|| spawn
+branch
+|| limit 1
+endbranch
+|| endspawn
+endbranch
+| endfork
+endmerge
+| group by visitorId fields { n=count(null) }
+| raw {"unwind": {"field": "x"}}
+"""
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("ensure_ascii", [False, True])
+def test_iter_body_matches_json_dumps_byte_for_byte(indent, ensure_ascii) -> None:
+    q = parse(DSL)
+    expected = json.dumps(
+        compile_to_pendo_aggregation(q, now_ms=42), indent=indent, ensure_ascii=ensure_ascii
+    )
+
+    chunks = list(iter_body(q, now_ms=42, indent=indent, ensure_ascii=ensure_ascii))
+
+    assert "".join(chunks) == expected
+    assert len(chunks) > 1
+
+
+def test_write_body_writes_utf8_bytes() -> None:
+    q = parse(DSL)
+    out = io.BytesIO()
+
+    write_body(q, out, indent=2)
+
+    expected = json.dumps(compile_to_pendo_aggregation(q), indent=2, ensure_ascii=False)
+    assert out.getvalue() == expected.encode("utf-8")
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("ensure_ascii", [False, True])
+def test_iter_dumps_matches_json_dumps_byte_for_byte(indent, ensure_ascii) -> None:
+    body = compile_to_pendo_aggregation(parse(DSL), now_ms=42)
+    expected = json.dumps(body, indent=indent, ensure_ascii=ensure_ascii)
+
+    chunks = list(iter_dumps(body, indent=indent, ensure_ascii=ensure_ascii))
+
+    assert "".join(chunks) == expected
+    assert len(chunks) > 1
+
+
+def test_cached_compile_is_not_built_as_one_string(tmp_path) -> None:
+    dsl = "PIPELINE\n" + "".join(f"| filter n == {i}\n" for i in range(200))
+    expected = json.dumps(compile_to_pendo_aggregation(parse(dsl)), indent=2, ensure_ascii=False)
+
+    for _ in range(2):  # the second compile is served from the cache
+        chunks = list(_compile_chunks(dsl, now_ms=None, cache_dir=str(tmp_path), no_cache=False))
+        assert "".join(chunks) == expected
+        assert max(len(c) for c in chunks) < len(expected) // 50
+    assert any(tmp_path.rglob("*.json"))
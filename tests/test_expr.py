@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import pytest
+
+from aggdsl import parse
+from aggdsl.expr import (
+    Binary,
+    Call,
+    ExpressionError,
+    Field,
+    Index,
+    ListExpr,
+    Literal,
+    Slice,
+    Unary,
+    field_paths,
+    format_expression,
+    parse_expression,
+)
+from aggdsl.optimize import optimize
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "!isBroken",
+        "!isNil(group.id)",
+        '!isNull(parameters.parameter) && parameters.parameter != ""',
+        'recordingSessionId == "a" || recordingSessionId == \'b\' || url == "https://example.com"',
+        "[8, 5, 1, 1, 2, 1 + 2]",
+        "formatTime(`2006-01-02`, browserTime)",
+        "inputs.listTwo[0] + inputs.listTwo[3:5][:1][1:]",
+        "(a || b) && !(c == 1.5e3) && -(x - y) * 2 >= -1",
+        "a - (b - c) / (d % 4)",
+        "- -x + !!y",
+        "f(x).y.z[0]",
+        "recordingId != null && isBroken == false",
+    ],
+)
+def test_format_round_trips(text: str) -> None:
+    expr = parse_expression(text)
+    formatted = format_expression(expr)
+    assert formatted == text
+    assert parse_expression(formatted) == expr
+
+
+def test_structure_and_precedence() -> None:
+    assert parse_expression("endTime-startTime") == Binary("-", Field(("endTime",)), Field(("startTime",)))
+    assert parse_expression('a == 1 || b && !isNull(c.d)') == Binary(
+        "||",
+        Binary("==", Field(("a",)), Literal(1, "1")),
+        Binary("&&", Field(("b",)), Unary("!", Call("isNull", (Field(("c", "d")),)))),
+    )
+    assert parse_expression("[1, x[2:]]") == ListExpr(
+        (Literal(1, "1"), Slice(Field(("x",)), Literal(2, "2"), None))
+    )
+    assert parse_expression("a.b[0]") == Index(Field(("a", "b")), Literal(0, "0"))
+    assert parse_expression('"a\\"b"').value == 'a"b'
+    assert format_expression(parse_expression("((a))  &&(b||c)")) == "a && (b || c)"
+
+
+def test_field_paths_skip_calls_literals_and_members() -> None:
+    expr = parse_expression('isNull(metadata.auto.accountid) && f(x).y == "z" && nil != items[i]')
+    assert field_paths(expr) == {"metadata.auto.accountid", "x", "items", "i"}
+
+
+def test_parse_is_cached_per_string() -> None:
+    text = "numEvents > 0 && pageId == \"cached\""
+    assert parse_expression(text) is parse_expression(text)
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ("a &&", "Unexpected end of expression at column 5"),
+        ("(a", "Expected ')', found end of expression"),
+        ("a b", "Unexpected 'b' at column 3"),
+        ("a # b", "Unexpected character '#' at column 3"),
+        ("f(a,)", "Unexpected ')' at column 5"),
+    ],
+)
+def test_syntax_errors(text: str, message: str) -> None:
+    with pytest.raises(ExpressionError) as info:
+        parse_expression(text)
+    assert str(info.value).startswith(message)
+
+
+def test_optimizer_uses_expression_fields() -> None:
+    # `y` is a member of a call result, not a field, so the filter does not depend on
+    # the eval that computes `y`.
+    query = parse(
+        """\
+PIPELINE
+| eval { y=numEvents * 2 }
+| filter f(x).y > 1
+"""
+    )
+    optimized, rewrites = optimize(query)
+    assert [s.kind for s in optimized.stages] == ["filter", "eval"]
+    assert [r.rule for r in rewrites] == ["hoist-filter"]
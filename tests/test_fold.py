@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.cli import main
+from aggdsl.fold import FoldError, fold_constants
+
+
+NOW = 1700000000000
+
+DSL = """\
+FROM event([source=pageEvents,appId=1])
+TIMESERIES period=dayRange first=date(2024, 1, 1, 0, 0, 0) last=date(2024, 12, 31, 23, 59, 59)
+| filter browserTime >= date(2024, 6, 1) && browserTime < now() - 24 * 60 * 60 * 1000
+| eval { age=now() - browserTime, week=dateAdd(now(), -7, "days"), page=pageId }
+| merge fields [visitorId]
+  FROM event([source=visitors])
+  TIMESERIES period=dayRange first=now() count=-7
+endmerge
+"""
+
+
+def _pipeline(query) -> list:
+    return compile_to_pendo_aggregation(query)["request"]["pipeline"]
+
+
+def test_folds_dates_now_and_arithmetic() -> None:
+    folded, folds = fold_constants(parse(DSL), now_ms=NOW, timezone="UTC")
+    pipeline = _pipeline(folded)
+
+    assert pipeline[0]["source"]["timeSeries"] == {
+        "period": "dayRange",
+        "first": 1704067200000,
+        "last": 1735689599000,
+    }
+    assert pipeline[1] == {"filter": "browserTime >= 1717200000000 && browserTime < 1699913600000"}
+    assert pipeline[2] == {
+        "eval": {"age": "1700000000000 - browserTime", "week": 'dateAdd(1700000000000, -7, "days")', "page": "pageId"}
+    }
+    assert pipeline[3]["merge"]["pipeline"][0]["source"]["timeSeries"]["first"] == NOW
+    assert [str(f) for f in folds] == [
+        "pipeline: TIMESERIES first: date(2024, 1, 1, 0, 0, 0) -> 1704067200000",
+        "pipeline: TIMESERIES last: date(2024, 12, 31, 23, 59, 59) -> 1735689599000",
+        "pipeline: stage 1 filter: browserTime >= date(2024, 6, 1) && browserTime < now() - 24 * 60 * 60 * 1000 "
+        "-> browserTime >= 1717200000000 && browserTime < 1699913600000",
+        "pipeline: stage 2 eval age: now() - browserTime -> 1700000000000 - browserTime",
+        'pipeline: stage 2 eval week: dateAdd(now(), -7, "days") -> dateAdd(1700000000000, -7, "days")',
+        "pipeline/merge@3: TIMESERIES first: now() -> 1700000000000",
+    ]
+    assert {f.rule for f in folds} == {"fold-constant"}
+
+
+def test_date_needs_a_timezone_and_now_needs_now_ms() -> None:
+    folded, folds = fold_constants(parse(DSL))
+    assert [str(f) for f in folds] == [
+        "pipeline: stage 1 filter: browserTime >= date(2024, 6, 1) && browserTime < now() - 24 * 60 * 60 * 1000 "
+        "-> browserTime >= date(2024, 6, 1) && browserTime < now() - 86400000",
+    ]
+    assert folded.time_series == parse(DSL).time_series
+
+    paris, _ = fold_constants(parse(DSL), timezone="Europe/Paris")
+    assert paris.time_series.first == 1704067200000 - 3600 * 1000
+
+    with pytest.raises(FoldError, match="Unknown time zone: Nowhere/Land"):
+        fold_constants(parse(DSL), timezone="Nowhere/Land")
+
+
+def test_invalid_dates_and_unparsable_expressions_are_left_alone() -> None:
+    query = parse("PIPELINE\n| filter day == date(2024, 13, 1)\n| filter a # 1 + 1\n| eval { n=1 + 1.5 }\n")
+    folded, folds = fold_constants(query, timezone="UTC")
+    assert folds == []
+    assert folded is query
+
+
+def test_cli_fold_constants(tmp_path: Path, capsys) -> None:
+    path = tmp_path / "q.dsl"
+    path.write_text("PIPELINE\n| filter numEvents > 2 * 3\n", encoding="utf-8")
+
+    assert main(["compile", str(path), "--fold-constants", "--explain-optimizations", "--no-cache"]) == 0
+    captured = capsys.readouterr()
+    assert '"filter": "numEvents > 6"' in captured.out
+    assert captured.err == (
+        "constants folded: 1\n"
+        "  pipeline: stage 1 filter: numEvents > 2 * 3 -> numEvents > 6\n"
+        "optimizations applied: 0\n"
+    )
+
+    with pytest.raises(SystemExit):
+        main(["compile", str(path), "--timezone", "UTC"])
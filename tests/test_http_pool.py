@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import http.client
+import threading
+import time
+
+import pytest
+
+from tools.pendo.http_pool import HttpPool
+
+
+def _wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_requests_reuse_one_connection(stand_in_server) -> None:
+    with HttpPool() as pool:
+        for i in range(3):
+            status, _headers, body = pool.post_json(stand_in_server.url, {"i": i})
+            assert (status, body) == (200, {"echo": {"i": i}})
+
+        assert pool.connections_opened == 1
+    assert stand_in_server.connections == 1
+
+
+def test_stale_idle_connection_is_retried_once_on_a_new_one(stand_in_server) -> None:
+    stand_in_server.drop_idle = True
+    with HttpPool() as pool:
+        assert pool.post_json(stand_in_server.url, {"i": 1})[0] == 200
+        _wait_for(lambda: stand_in_server.closed == 1)
+
+        status, _headers, body = pool.post_json(stand_in_server.url, {"i": 2})
+
+        assert (status, body) == (200, {"echo": {"i": 2}})
+        assert pool.connections_opened == 2
+    assert stand_in_server.requests == [{"i": 1}, {"i": 2}]
+
+
+def test_failure_on_a_new_connection_is_not_retried(stand_in_server) -> None:
+    stand_in_server.respond = lambda payload, headers: None
+    with HttpPool() as pool:
+        with pytest.raises(http.client.RemoteDisconnected):
+            pool.post_json(stand_in_server.url, {"i": 1})
+
+        assert pool.connections_opened == 1
+    assert stand_in_server.requests == [{"i": 1}]
+
+
+def test_connection_close_response_is_not_pooled(stand_in_server) -> None:
+    stand_in_server.respond = lambda payload, headers: (200, {"Connection": "close"}, {"ok": True})
+    with HttpPool() as pool:
+        pool.post_json(stand_in_server.url, {})
+        assert not any(pool._idle.values())
+
+        pool.post_json(stand_in_server.url, {})
+        assert pool.connections_opened == 2
+
+
+def test_idle_connections_are_capped_at_maxsize(stand_in_server) -> None:
+    both_arrived = threading.Barrier(2)
+
+    def respond(payload, headers):
+        # Hold each response until both requests are in flight on their own connections.
+        both_arrived.wait(timeout=5)
+        return 200, {}, {"ok": True}
+
+    stand_in_server.respond = respond
+    with HttpPool(maxsize=1) as pool:
+        threads = [threading.Thread(target=pool.post_json, args=(stand_in_server.url, {})) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert pool.connections_opened == 2
+        assert [len(conns) for conns in pool._idle.values()] == [1]
+    _wait_for(lambda: stand_in_server.closed == 2)
+
+
+def test_post_json_returns_text_for_a_non_json_body(stand_in_server) -> None:
+    stand_in_server.respond = lambda payload, headers: (502, {"Content-Type": "text/plain"}, b"Bad gateway")
+    with HttpPool() as pool:
+        status, headers, body = pool.post_json(stand_in_server.url, {})
+
+    assert (status, body) == (502, "Bad gateway")
+    assert headers["Content-Type"] == "text/plain"
+
+
+def test_maxsize_must_be_positive() -> None:
+    with pytest.raises(ValueError):
+        HttpPool(maxsize=0)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.lexer import COMMA, SPACE, Line, tokenize
+
+
+def _split(text: str, kind: str) -> list[str]:
+    return [part.text for part in Line(text).span().split(kind)]
+
+
+def test_tokenize_skips_blank_and_comment_lines() -> None:
+    lines = list(tokenize("// c\n\n  # note\nPIPELINE\n  | limit 1  \n"))
+
+    assert [ln.text for ln in lines] == ["PIPELINE", "| limit 1"]
+    assert [ln.number for ln in lines] == [4, 5]
+
+
+def test_split_respects_quotes_and_brackets() -> None:
+    text = 'a=if(isNull(x), "p, q", y), b={k=[1,2]}, c="\\"quoted, still\\"", d'
+
+    assert _split(text, COMMA) == [
+        'a=if(isNull(x), "p, q", y)',
+        "b={k=[1,2]}",
+        'c="\\"quoted, still\\""',
+        "d",
+    ]
+    assert _split("first=now() last=date(2025, 1, 1) name=\"a b\"", SPACE) == [
+        "first=now()",
+        "last=date(2025, 1, 1)",
+        'name="a b"',
+    ]
+
+
+def test_split_falls_back_for_deep_nesting_and_unbalanced_input() -> None:
+    deep = "a=" + "f(" * 10 + "x, y" + ")" * 10
+    assert _split(deep + ", b", COMMA) == [deep, "b"]
+    assert _split("a(b, c", COMMA) == ["a(b, c"]
+    assert _split("a), b", COMMA) == ["a)", "b"]
+
+
+def test_sub_spans_split_relative_to_their_container() -> None:
+    span = Line("{ x=[1,2], y=(3, 4) }").span()
+
+    parts = span.inner().split(COMMA)
+    assert [p.text for p in parts] == ["x=[1,2]", "y=(3, 4)"]
+    _, value = parts[0].partition("=")
+    assert [p.text for p in value.inner().split(COMMA)] == ["1", "2"]
+
+
+def test_deeply_nested_group_argument_parses() -> None:
+    dsl = """\
+PIPELINE
+| group by visitorId fields { info=collect({ a=f(g(h(i(j(k(l(m(1)))))))), b=[1, [2, [3]]] }) }
+"""
+
+    body = compile_to_pendo_aggregation(parse(dsl))
+    assert body["request"]["pipeline"][0]["group"]["fields"] == [
+        {"info": {"collect": {"a": "f(g(h(i(j(k(l(m(1))))))))", "b": [1, [2, [3]]]}}}
+    ]
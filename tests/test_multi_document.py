@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from aggdsl import parse_documents
+from aggdsl.cli import main
+from aggdsl.parser import DslParseError
+
+
+MULTI = """\
+---
+RESPONSE mimeType=text/csv
+REQUEST name="First"
+PIPELINE
+| limit 1
+---
+REQUEST name="Second"
+FROM event([source=pageEvents,pageId="p1"])
+| limit 2
+---
+"""
+
+
+def test_parse_documents_yields_one_query_per_document_with_own_headers() -> None:
+    queries = list(parse_documents(MULTI))
+
+    assert [q.request_name for q in queries] == ["First", "Second"]
+    assert [q.response_mime_type for q in queries] == ["text/csv", "application/json"]
+    assert queries[1].event_source is not None
+
+
+def test_parse_documents_is_lazy_and_names_failing_document() -> None:
+    src = io.StringIO("PIPELINE\n| limit 1\n---\n| limit 2\n")
+    docs = parse_documents(src)
+
+    assert next(docs).stages[0].payload == 1
+    with pytest.raises(DslParseError, match="^document 2: "):
+        next(docs)
+
+
+def test_cli_compiles_documents_to_array_and_jsonl(tmp_path: Path, capsys) -> None:
+    path = tmp_path / "multi.dsl"
+    path.write_text(MULTI, encoding="utf-8")
+
+    assert main(["compile", "--documents", "array", str(path)]) == 0
+    bodies = json.loads(capsys.readouterr().out)
+    assert [b["request"]["name"] for b in bodies] == ["First", "Second"]
+
+    assert main(["compile", "--documents", "jsonl", str(path)]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line) for line in lines] == bodies
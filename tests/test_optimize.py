@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from aggdsl import compile_pipeline, parse
+from aggdsl.cli import main
+from aggdsl.optimize import optimize, prefix_hashes
+
+
+def _optimized(dsl: str) -> tuple[list, list[str]]:
+    query, rewrites = optimize(parse(dsl))
+    return compile_pipeline(query), [r.rule for r in rewrites]
+
+
+def test_merges_adjacent_filters() -> None:
+    pipeline, rules = _optimized('PIPELINE\n| filter a > 1 || b\n| filter c == "x"\n')
+    assert pipeline == [{"filter": '(a > 1 || b) && (c == "x")'}]
+    assert rules == ["merge-filters"]
+
+
+def test_hoists_filter_over_independent_eval_and_select() -> None:
+    pipeline, rules = _optimized(
+        "PIPELINE\n"
+        "| eval { score=n * 2 }\n"
+        "| select { visitorId=visitorId, score=score }\n"
+        '| filter visitorId != "x" && isNull(visitorId.name) == false\n'
+    )
+    assert pipeline[0] == {"filter": 'visitorId != "x" && isNull(visitorId.name) == false'}
+    assert [next(iter(s)) for s in pipeline] == ["filter", "eval", "select"]
+    assert rules == ["hoist-filter"]
+
+
+def test_keeps_filter_after_stages_it_depends_on() -> None:
+    dsl = (
+        "PIPELINE\n"
+        "| eval { score=n * 2 }\n"
+        "| filter score > 1\n"
+        "| select { total=score }\n"
+        "| filter total > 1\n"
+    )
+    pipeline, rules = _optimized(dsl)
+    assert pipeline == compile_pipeline(parse(dsl))
+    assert rules == []
+
+
+def test_drops_sort_before_group_and_collapses_limits() -> None:
+    pipeline, rules = _optimized(
+        "PIPELINE\n"
+        "| sort -n\n"
+        "| group by visitorId fields { n=sum(numEvents) }\n"
+        "| limit 50\n"
+        "| limit 10\n"
+        "| limit 20\n"
+    )
+    assert [next(iter(s)) for s in pipeline] == ["group", "limit"]
+    assert pipeline[-1] == {"limit": 10}
+    assert rules == ["drop-sort-before-group", "collapse-limits", "collapse-limits"]
+
+
+def test_keeps_sort_before_order_dependent_group() -> None:
+    dsl = "PIPELINE\n| sort -n\n| group by visitorId fields { f=first(pageId) }\n"
+    pipeline, rules = _optimized(dsl)
+    assert pipeline == compile_pipeline(parse(dsl))
+    assert rules == []
+
+
+def test_optimizes_nested_pipelines() -> None:
+    dsl = (
+        "PIPELINE\n"
+        "| merge fields [visitorId]\n"
+        "  PIPELINE\n"
+        "  | filter a\n"
+        "  | filter b\n"
+        "endmerge\n"
+    )
+    query, rewrites = optimize(parse(dsl))
+    assert compile_pipeline(query)[0]["merge"]["pipeline"] == [{"filter": "(a) && (b)"}]
+    assert [str(r) for r in rewrites] == [
+        "pipeline/merge@1: stages 1+2: merged adjacent filters into (a) && (b)"
+    ]
+
+
+def test_unoptimizable_query_is_returned_unchanged() -> None:
+    query = parse("PIPELINE\n| filter a\n| limit 1\n")
+    assert optimize(query) == (query, [])
+    assert optimize(query)[0] is query
+
+
+def test_cli_explain_optimizations(tmp_path: Path, capsys) -> None:
+    path = tmp_path / "q.dsl"
+    path.write_text("PIPELINE\n| filter a\n| filter b\n", encoding="utf-8")
+
+    assert main(["compile", str(path), "--explain-optimizations"]) == 0
+
+    captured = capsys.readouterr()
+    assert '"filter": "(a) && (b)"' in captured.out
+    assert captured.err == (
+        "optimizations applied: 1\n"
+        "  pipeline: stages 1+2: merged adjacent filters into (a) && (b)\n"
+    )
+
+
+def test_merged_filters_stay_flat() -> None:
+    pipeline, rules = _optimized("PIPELINE\n| filter a\n| filter b || c\n| filter d\n")
+    assert pipeline == [{"filter": "(a) && (b || c) && (d)"}]
+    assert rules == ["merge-filters", "merge-filters"]
+
+
+PUSHDOWN_DSL = """\
+FROM event([source=pageEvents,appId=1])
+| eval { score=numEvents * 2, unused=concat(a, b) }
+| merge fields [visitorId] mappings { accountId=metadata.auto.accountid, lastVisit=lastVisit }
+  FROM event([source=visitors,appId=1])
+endmerge
+| unwind { field=pages, index=pageIndex }
+| filter pageIndex < 3 && score > 1
+| select { visitorId=visitorId, accountId=accountId, pageIndex=pageIndex, extra=numMinutes }
+| group by visitorId,accountId fields { n=count(null), idx=max(pageIndex) }
+"""
+
+
+def test_projection_pushdown_narrows_stages_before_a_projection() -> None:
+    pipeline, rules = _optimized(PUSHDOWN_DSL)
+
+    assert pipeline[1] == {"eval": {"score": "numEvents * 2"}}
+    assert pipeline[2] == {
+        "select": {"pages": "pages", "score": "score", "visitorId": "visitorId"}
+    }
+    merge = pipeline[3]["merge"]
+    assert merge["mappings"] == {"accountId": "metadata.auto.accountid"}
+    assert merge["pipeline"][-1] == {"select": {"metadata": "metadata", "visitorId": "visitorId"}}
+    # The rows reaching unwind are already narrowed; no second select is inserted.
+    assert next(iter(pipeline[4])) == "unwind"
+    assert pipeline[6] == {
+        "select": {"visitorId": "visitorId", "accountId": "accountId", "pageIndex": "pageIndex"}
+    }
+    assert sorted(set(rules)) == [
+        "insert-select",
+        "narrow-eval",
+        "narrow-select",
+        "trim-merge-mappings",
+    ]
+
+
+def test_projection_pushdown_needs_a_downstream_projection() -> None:
+    # Without a later select/group the query result may use any field.
+    dsl = (
+        "FROM event([source=pageEvents,appId=1])\n"
+        "| eval { unused=1 }\n"
+        "| merge fields [visitorId] mappings { a=b }\n"
+        "  FROM event([source=visitors,appId=1])\n"
+        "endmerge\n"
+    )
+    pipeline, rules = _optimized(dsl)
+    assert pipeline[1] == {"eval": {"unused": "1"}}
+    assert pipeline[2]["merge"]["pipeline"][-1] == {"select": {"b": "b", "visitorId": "visitorId"}}
+    assert rules == ["insert-select"]
+
+
+def test_projection_pushdown_stops_at_opaque_stages() -> None:
+    dsl = (
+        "PIPELINE\n"
+        "| eval { unused=1 }\n"
+        '| raw { "custom": {} }\n'
+        "| select { a=a }\n"
+    )
+    pipeline, rules = _optimized(dsl)
+    assert pipeline == compile_pipeline(parse(dsl))
+    assert rules == []
+
+
+def test_eval_keys_read_by_kept_keys_are_kept() -> None:
+    pipeline, _ = _optimized("PIPELINE\n| eval { a=1, b=a + 1, c=2 }\n| select { b=b }\n")
+    assert pipeline[0] == {"eval": {"a": "1", "b": "a + 1"}}
+
+
+def test_quoted_eval_keys_are_not_the_bare_field() -> None:
+    # `"score"` keeps its quotes in JSON, so the eval leaves the bare `score` alone.
+    pipeline, rules = _optimized('PIPELINE\n| eval { "score"=n * 2 }\n| filter score > 1\n')
+    assert pipeline == [{"filter": "score > 1"}, {"eval": {'"score"': "n * 2"}}]
+    assert rules == ["hoist-filter"]
+
+
+def test_quoted_select_keys_block_filter_hoisting() -> None:
+    dsl = 'FROM event([source=visitors])\n| select { "x"=x }\n| filter x > 1\n'
+    pipeline, rules = _optimized(dsl)
+    assert pipeline == compile_pipeline(parse(dsl))
+    assert rules == []
+
+
+def test_quoted_keys_do_not_satisfy_downstream_reads() -> None:
+    pipeline, _ = _optimized('PIPELINE\n| eval { a=1, "a"=2, b=3 }\n| select { a=a }\n')
+    assert pipeline[0] == {"eval": {"a": "1"}}
+
+
+SPAWN_DSL = """\
+PIPELINE
+| spawn
+branch
+FROM event([source=pollEvents,pollId="p"])
+TIMESERIES period=dayRange first=now() count=-30
+|| identified visitorId
+|| switch mapped from pollResponse { "1"=="aaa" }
+endbranch
+branch
+FROM event([source=pollEvents,pollId="p"])
+TIMESERIES period=dayRange first=now() count=-30
+|| identified visitorId
+|| group by visitorId fields { n=count(null) }
+endbranch
+| endspawn
+| limit 5
+"""
+
+
+def test_spawn_with_one_source_scans_it_once() -> None:
+    query, rewrites = optimize(parse(SPAWN_DSL))
+    pipeline = compile_pipeline(query)
+
+    assert pipeline[0] == {
+        "source": {
+            "pollEvents": {"pollId": "p"},
+            "timeSeries": {"period": "dayRange", "first": "now()", "count": -30},
+        }
+    }
+    assert pipeline[1] == {"identified": "visitorId"}
+    assert [[next(iter(s)) for s in branch] for branch in pipeline[2]["fork"]] == [
+        ["switch"],
+        ["group"],
+    ]
+    assert pipeline[3] == {"limit": 5}
+    assert [r.rule for r in rewrites] == ["hoist-spawn-source"]
+
+
+def test_fork_branch_prefix_is_hoisted() -> None:
+    pipeline, rules = _optimized(
+        "PIPELINE\n"
+        "| fork\n"
+        "  | branch\n"
+        "  || filter b\n"
+        "  || limit 3\n"
+        "  | endbranch\n"
+        "  | branch\n"
+        "  || filter b\n"
+        "  || limit 4\n"
+        "  | endbranch\n"
+        "| endfork\n"
+    )
+    assert pipeline == [{"filter": "b"}, {"fork": [[{"limit": 3}], [{"limit": 4}]]}]
+    assert rules == ["hoist-shared-prefix"]
+
+
+def test_shared_prefixes_that_cannot_be_hoisted_are_reported() -> None:
+    dsl = SPAWN_DSL.replace("PIPELINE\n", "PIPELINE\n| limit 9\n", 1)
+    query, rewrites = optimize(parse(dsl))
+    assert compile_pipeline(query) == compile_pipeline(parse(dsl))
+    assert [str(r) for r in rewrites] == [
+        "pipeline: stage 2: spawn branches 1, 2 share FROM pollEvents + 1 stage (identified) "
+        "(not hoisted)"
+    ]
+
+
+def test_prefix_hashes_match_for_equal_prefixes() -> None:
+    a = parse("FROM event([source=pageEvents,appId=1])\n| filter x\n| limit 1\n")
+    b = parse("FROM event([source=pageEvents,appId=1])\n| filter x\n| limit 2\n")
+    c = parse('FROM event([source=pageEvents,appId="1"])\n| filter x\n| limit 1\n')
+    ha, hb, hc = prefix_hashes(a), prefix_hashes(b), prefix_hashes(c)
+    assert ha[:2] == hb[:2] and ha[2] != hb[2]
+    assert ha[0] != hc[0]
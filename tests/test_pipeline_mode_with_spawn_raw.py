@@ -22,3 +22,19 @@ PIPELINE
     assert "spawn" in pipeline[0]
     assert pipeline[1] == {"eval": {"realTime": "formatTime(`2006-01-02`, browserTime)"}}
     assert pipeline[2] == {"join": {"fields": ["browserTime", "visitorId"]}}
+
+
+def test_multiline_raw_ignores_brackets_inside_strings() -> None:
+    dsl = """\
+PIPELINE
+| raw {
+  "eval": {"a": "x } y", "b": "q\\"{"},
+  "note": "]]"
+}
+| limit 1
+"""
+
+    pipeline = compile_to_pendo_aggregation(parse(dsl))["request"]["pipeline"]
+
+    assert pipeline[0] == {"eval": {"a": "x } y", "b": 'q"{'}, "note": "]]"}
+    assert pipeline[1] == {"limit": 1}
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import pytest
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.planner import MergeSpec, PlanError, plan_time_windows
+
+
+NOW = 1700000000000
+
+DSL = """\
+FROM event([source=pageEvents,appId=1])
+TIMESERIES period=dayRange first=now() count=-365
+| filter pageId == "home"
+| group by visitorId fields { events=sum(numEvents), rows=count(null), firstDay=min(day) }
+| sort -events
+| limit 10
+"""
+
+
+def _source(body: dict) -> dict:
+    return body["request"]["pipeline"][0]["source"]
+
+
+def test_backward_window_is_split_into_contiguous_windows_in_time_order() -> None:
+    plan = plan_time_windows(parse(DSL), 4, now_ms=NOW)
+
+    assert [w.count for w in plan.windows] == [-91, -91, -91, -92]
+    assert [w.first for w in plan.windows] == [
+        'dateAdd(1700000000000, -274, "days")',
+        'dateAdd(1700000000000, -183, "days")',
+        'dateAdd(1700000000000, -92, "days")',
+        NOW,
+    ]
+    for window, body in zip(plan.windows, plan.bodies):
+        assert _source(body)["timeSeries"] == {"period": "dayRange", "first": window.first, "count": window.count}
+        # Each window runs the pipeline up to and including the group.
+        assert [next(iter(s)) for s in body["request"]["pipeline"][1:]] == ["filter", "group"]
+
+    assert plan.merge == MergeSpec(
+        group_by=("visitorId",),
+        aggregates={"events": "sum", "rows": "sum", "firstDay": "min"},
+        sort=("-events",),
+        limit=10,
+    )
+
+
+def test_forward_window_and_single_window() -> None:
+    dsl = DSL.replace("first=now() count=-365", "first=1690000000000 count=10")
+    plan = plan_time_windows(parse(dsl), 3, now_ms=NOW)
+    assert [(w.first, w.count) for w in plan.windows] == [
+        (1690000000000, 4),
+        ('dateAdd(1690000000000, 4, "days")', 3),
+        ('dateAdd(1690000000000, 7, "days")', 3),
+    ]
+
+    single = plan_time_windows(parse(dsl), 1, now_ms=NOW)
+    expected = compile_to_pendo_aggregation(parse(dsl.split("| sort")[0]), now_ms=NOW)
+    assert single.bodies == (expected,)
+
+
+def test_now_inside_first_is_pinned_for_every_window() -> None:
+    first = 'dateAdd(startOfPeriod("daily", now()), -30, "days")'
+    dsl = DSL.replace("first=now() count=-365", f"first={first} count=30")
+    plan = plan_time_windows(parse(dsl), 3, now_ms=NOW)
+
+    pinned = 'dateAdd(startOfPeriod("daily", 1700000000000), -30, "days")'
+    assert [w.first for w in plan.windows] == [
+        pinned,
+        f'dateAdd({pinned}, 10, "days")',
+        f'dateAdd({pinned}, 20, "days")',
+    ]
+    for body in plan.bodies:
+        assert "now()" not in _source(body)["timeSeries"]["first"]
+
+
+def test_merge_spec_combines_partial_groups() -> None:
+    spec = MergeSpec(
+        group_by=("visitorId",),
+        aggregates={"events": "sum", "firstDay": "min", "lastDay": "max"},
+        sort=("-events", "visitorId"),
+        limit=2,
+    )
+    rows = spec.combine(
+        [
+            [{"visitorId": "a", "events": 1, "firstDay": 5, "lastDay": 5}],
+            [
+                {"visitorId": "a", "events": 3, "firstDay": 2, "lastDay": 9},
+                {"visitorId": "b", "events": 4, "firstDay": None, "lastDay": 1},
+                {"visitorId": "c", "events": None, "firstDay": 1, "lastDay": 1},
+            ],
+        ]
+    )
+    assert rows == [
+        {"visitorId": "a", "events": 4, "firstDay": 2, "lastDay": 9},
+        {"visitorId": "b", "events": 4, "firstDay": None, "lastDay": 1},
+    ]
+
+    concat = MergeSpec(group_by=(), aggregates=None, limit=3)
+    assert concat.combine([[{"x": 1}, {"x": 2}], [{"x": 3}, {"x": 4}]]) == [{"x": 1}, {"x": 2}, {"x": 3}]
+
+
+@pytest.mark.parametrize(
+    "dsl, reason",
+    [
+        (DSL.replace("first=now() count=-365", "first=now() last=now()"), "last="),
+        (DSL.replace("count(null)", "count(accountId)"), "distinct"),
+        (DSL.replace("min(day)", "avg(day)"), "avg"),
+        (DSL.replace("| sort -events", '| filter events > 1\n| sort -events'), "only sort and limit"),
+        (DSL.replace('| filter pageId == "home"', "| limit 5"), "not row-local"),
+        (DSL.replace("period=dayRange", "period=range"), "period=range"),
+        (DSL.replace("first=now()", "first=now()#"), "could not be pinned"),
+    ],
+)
+def test_refuses_pipelines_that_cannot_be_decomposed(dsl: str, reason: str) -> None:
+    with pytest.raises(PlanError, match=reason):
+        plan_time_windows(parse(dsl), 4, now_ms=NOW)
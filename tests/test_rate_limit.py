@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import email.utils
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from tools.pendo import rate_limit, run_agg
+from tools.pendo.rate_limit import RateLimiter, parse_retry_after
+
+
+class _Clock:
+    """Stands in for the `time` module: `sleep` advances `time` instead of waiting."""
+
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    fake = _Clock()
+    monkeypatch.setattr(rate_limit, "time", fake)
+    return fake
+
+
+def test_burst_then_refill_at_rate(tmp_path: Path, clock: _Clock) -> None:
+    limiter = RateLimiter(tmp_path / "state.json", rate=2, burst=3)
+
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire() == pytest.approx(0.5)
+
+    # An idle period refills the bucket only up to `burst`.
+    clock.now += 60
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire() == pytest.approx(0.5)
+
+
+def test_limiters_on_one_file_share_the_bucket(tmp_path: Path, clock: _Clock) -> None:
+    a = RateLimiter(tmp_path / "state.json", rate=1, burst=2)
+    b = RateLimiter(tmp_path / "state.json", rate=1, burst=2)
+
+    assert a.acquire() == 0.0
+    assert b.acquire() == 0.0
+    assert a.acquire() == pytest.approx(1.0)
+
+
+def test_throttled_blocks_until_retry_after_and_halves_once_per_pause(tmp_path: Path, clock: _Clock) -> None:
+    limiter = RateLimiter(tmp_path / "state.json", rate=4, burst=4, recovery=20)
+    limiter.acquire()
+
+    limiter.throttled(5)
+    # Other requests that were in flight get their 429s during the same pause.
+    clock.now += 1
+    limiter.throttled(3)
+
+    assert limiter.current_rate() == pytest.approx(2 + 1 * 4 / 20)
+    assert limiter.acquire() == pytest.approx(4)  # until the first Retry-After ends
+
+    # A 429 after the pause is a new episode and slows down again.
+    rate_before = limiter.current_rate()
+    limiter.throttled(None)
+    assert limiter.current_rate() == pytest.approx(rate_before / 2)
+    assert limiter.acquire() == pytest.approx(1.0)  # the default pause
+
+    clock.now += 20
+    assert limiter.current_rate() == 4
+
+
+def test_corrupt_state_file_starts_from_a_full_bucket(tmp_path: Path, clock: _Clock) -> None:
+    path = tmp_path / "state.json"
+    path.write_text("{not json", encoding="utf-8")
+    limiter = RateLimiter(path, rate=1, burst=2)
+
+    assert [limiter.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert limiter.acquire() == pytest.approx(1.0)
+
+
+def test_unusable_state_file_falls_back_to_this_process(tmp_path: Path, clock: _Clock, capsys) -> None:
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("", encoding="utf-8")
+    limiter = RateLimiter(blocker / "state.json", rate=1, burst=2)
+
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, pytest.approx(1.0)]
+    limiter.throttled(2)
+    assert limiter.acquire() == pytest.approx(2.0)
+
+    assert capsys.readouterr().err.count("warning: rate limiter state") == 1
+
+
+def test_processes_share_one_state_file(tmp_path: Path) -> None:
+    state = tmp_path / "state.json"
+    script = (
+        "import sys\n"
+        "from tools.pendo.rate_limit import RateLimiter\n"
+        "limiter = RateLimiter(sys.argv[1], rate=20, burst=5)\n"
+        "for _ in range(10):\n"
+        "    limiter.acquire()\n"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+
+    t0 = time.monotonic()
+    procs = [subprocess.Popen([sys.executable, "-c", script, str(state)], env=env) for _ in range(2)]
+    assert [p.wait(timeout=30) for p in procs] == [0, 0]
+    elapsed = time.monotonic() - t0
+
+    # 20 tokens from one bucket: 5 at once, then 15 at 20/s. Separate buckets would
+    # take 0.25 s.
+    assert elapsed >= 0.7
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("120", 120.0), (" 3 ", 3.0), ("soon", None), ("-5", None), ("", None), (None, None)],
+)
+def test_parse_retry_after_seconds_and_junk(value, expected) -> None:
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date() -> None:
+    ahead = email.utils.formatdate(time.time() + 30, usegmt=True)
+    past = email.utils.formatdate(time.time() - 30, usegmt=True)
+
+    assert 28 <= parse_retry_after(ahead) <= 30
+    assert parse_retry_after(past) == 0.0
+
+
+def _throttle_first(n: int):
+    served: list[object] = []
+
+    def respond(payload, headers):
+        served.append(payload)
+        if len(served) <= n:
+            return 429, {"Retry-After": "0"}, {"message": "Too many requests"}
+        return 200, {}, {"results": []}
+
+    return respond
+
+
+def test_429_is_resent_without_spending_an_attempt(tmp_path: Path, stand_in_server) -> None:
+    stand_in_server.respond = _throttle_first(2)
+    limiter = RateLimiter(tmp_path / "state.json", rate=1000, burst=10)
+    body = {"response": {"mimeType": "application/json"}, "request": {"pipeline": [{"source": {"events": None}}]}}
+
+    resp, attempts = run_agg.run_aggregation(
+        body, url=stand_in_server.url, api_key="k", api_key_header="x-key", max_attempts=1, limiter=limiter
+    )
+
+    assert (resp, attempts) == ({"results": []}, 1)
+    assert len(stand_in_server.requests) == 3
+    assert limiter.current_rate() < 1000
+
+
+def test_429s_are_resent_a_bounded_number_of_times(tmp_path: Path, stand_in_server, monkeypatch) -> None:
+    stand_in_server.respond = _throttle_first(1000)
+    monkeypatch.setattr(run_agg.time, "sleep", lambda seconds: None)
+    body = {"response": {"mimeType": "application/json"}, "request": {"pipeline": [{"source": {"events": None}}]}}
+
+    with pytest.raises(run_agg.PendoRequestError) as exc:
+        run_agg.run_aggregation(body, url=stand_in_server.url, api_key="k", api_key_header="x-key", max_attempts=1)
+
+    assert (exc.value.status, exc.value.retry_after) == (429, 0.0)
+    assert len(stand_in_server.requests) == run_agg._MAX_THROTTLED_RETRIES + 1
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.cli import main
+from aggdsl.dsl_ast import RawJson
+from aggdsl.emit import dumps
+from aggdsl.parser import DslParseError
+
+
+DSL = """\
+PIPELINE
+| raw {"bulkExpand": {"account": {"account": "accountId"}},
+  "ids": [3, 1, 2]}
+| bulkExpand {"list": ["a", "ü"]}
+| fork [[{"limit": 1}], [{"limit": 2}]]
+| limit 5
+"""
+
+
+def test_raw_text_keeps_validated_source_and_splices_it() -> None:
+    q = parse(DSL, raw_text=True)
+
+    assert q.stages[0].payload == RawJson(
+        '{"bulkExpand": {"account": {"account": "accountId"}},\n"ids": [3, 1, 2]}'
+    )
+
+    body = compile_to_pendo_aggregation(q)
+    expected = compile_to_pendo_aggregation(parse(DSL))
+    assert json.loads(dumps(body, indent=2)) == expected
+
+    compact = dumps(body)
+    assert "\n" not in compact
+    assert json.loads(compact) == expected
+
+
+def test_dumps_without_raw_values_matches_json_dumps() -> None:
+    body = compile_to_pendo_aggregation(parse(DSL))
+
+    assert dumps(body, indent=2) == json.dumps(body, indent=2, ensure_ascii=False)
+    assert dumps(body, ensure_ascii=True) == json.dumps(body)
+
+
+def test_dumps_honours_ensure_ascii_for_raw_text() -> None:
+    body = compile_to_pendo_aggregation(parse(DSL, raw_text=True))
+
+    out = dumps(body, ensure_ascii=True)
+
+    assert out.isascii()
+    assert json.loads(out) == compile_to_pendo_aggregation(parse(DSL))
+
+
+def test_raw_text_still_validates_json() -> None:
+    with pytest.raises(DslParseError, match="Invalid JSON in raw stage"):
+        parse('PIPELINE\n| raw {"a": }\n', raw_text=True)
+
+
+def test_cli_raw_passthrough(tmp_path: Path, capsys) -> None:
+    path = tmp_path / "q.dsl"
+    path.write_text(DSL, encoding="utf-8")
+
+    assert main(["compile", "--raw-passthrough", str(path)]) == 0
+
+    out = capsys.readouterr().out
+    assert '"ids": [3, 1, 2]}' in out
+    assert json.loads(out) == compile_to_pendo_aggregation(parse(DSL))
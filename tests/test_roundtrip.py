@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.cli import main
+from aggdsl.roundtrip import RoundTripError, diff_json, roundtrip_body
+
+
+def test_diff_json_reports_json_pointers() -> None:
+    expected = {"a/b": [1, {"x~": True}], "gone": 1, "n": 1}
+    actual = {"a/b": [1, {"x~": 1}, 3], "new": None, "n": 1.0}
+
+    assert sorted(diff_json(expected, actual)) == [
+        "/a~1b/1/x~0: expected true, got 1",
+        "/a~1b: expected 2 items, got 3",
+        "/gone: missing (expected 1)",
+        "/n: expected 1, got 1.0",
+        "/new: unexpected null",
+    ]
+
+
+def test_roundtrip_body_normalizes_request_forms() -> None:
+    body = compile_to_pendo_aggregation(parse('REQUEST name="N"\nPIPELINE\n| limit 3\n'))
+    assert roundtrip_body(body) == []
+
+    pipeline = [{"filter": "x > 1"}, {"sort": ["-n"]}]
+    assert roundtrip_body(pipeline) == []
+    assert roundtrip_body({"request": pipeline, "response": {"mimeType": "text/csv"}}) == []
+
+
+def test_roundtrip_body_reports_losses_and_failures() -> None:
+    assert roundtrip_body([{"limit": "5"}]) == ['/request/pipeline/0/limit: expected "5", got 5']
+
+    with pytest.raises(RoundTripError, match="^decompile: "):
+        roundtrip_body({"no": "request"})
+
+
+def test_cli_roundtrip_directory(tmp_path: Path, capsys) -> None:
+    good = compile_to_pendo_aggregation(parse("PIPELINE\n| filter a == 1\n| limit 1\n"))
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "good.json").write_text(json.dumps(good), encoding="utf-8")
+    (tmp_path / "nested" / "lossy.json").write_text(
+        json.dumps({"request": [{"filter": 1}], "extra": True}), encoding="utf-8"
+    )
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("ignored", encoding="utf-8")
+
+    rc = main(["roundtrip", str(tmp_path), "--jobs", "2"])
+
+    out = capsys.readouterr().out
+    assert rc == 2
+    assert f"FAIL {tmp_path / 'nested' / 'lossy.json'}: 2 differences\n" in out
+    assert '  /request/pipeline/0/filter: expected 1, got "1"\n' in out
+    assert "  /extra: missing (expected true)\n" in out
+    assert f"FAIL {tmp_path / 'broken.json'}: read: " in out
+    assert "good.json" not in out
+    assert "Total: 3  Passed: 1  Failed: 2" in out
+    assert "files/s" in out and "MB/s" in out
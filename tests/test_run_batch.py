@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from tools.pendo import run_agg, run_batch
+
+GOOD_DSL = "FROM event([source=pageEvents])\nTIMESERIES period=dayRange first=1731769200000 count=7\n| limit 5\n"
+
+
+def _body(*stages: dict) -> dict:
+    return {"response": {"mimeType": "application/json"}, "request": {"pipeline": [{"source": {"events": None}}, *stages]}}
+
+
+def _write(path: Path, text: str) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def _reject_bogus(payload, headers):
+    if "bogus" in json.dumps(payload):
+        return 400, {}, {"message": "unknown stage bogus"}
+    return 200, {}, {"results": [{"n": 1}]}
+
+
+@pytest.fixture
+def endpoint(stand_in_server, monkeypatch: pytest.MonkeyPatch) -> tuple[str, str, str]:
+    monkeypatch.setenv("PENDO_AGG_URL", stand_in_server.url)
+    monkeypatch.setenv("PENDO_API_KEY", "test-key")
+    # Retries back off between attempts; the tests need not wait.
+    monkeypatch.setattr(run_agg.time, "sleep", lambda seconds: None)
+    stand_in_server.respond = _reject_bogus
+    return stand_in_server.url, "test-key", "x-pendo-integration-key"
+
+
+def test_run_batch_yields_one_result_per_input(tmp_path: Path, endpoint) -> None:
+    good = _write(tmp_path / "good.dsl", GOOD_DSL)
+    rejected = _write(tmp_path / "rejected.json", json.dumps(_body({"bogus": 1})))
+    broken = _write(tmp_path / "broken.dsl", "| limit 1\n")
+
+    results = {r.path: r for r in run_batch.run_batch([good, rejected, broken], endpoint=endpoint, jobs=3, max_attempts=2)}
+
+    assert set(results) == {good, rejected, broken}
+    assert results[good].ok and results[good].response == {"results": [{"n": 1}]}
+    assert results[good].attempts == 1
+    assert not results[rejected].ok
+    assert (results[rejected].status, results[rejected].response) == (400, {"message": "unknown stage bogus"})
+    assert "FROM event" in results[broken].error
+    assert results[broken].status is None
+
+
+def test_out_dir_writes_results_and_removes_stale_counterparts(tmp_path: Path, endpoint) -> None:
+    _write(tmp_path / "in" / "good.dsl", GOOD_DSL)
+    _write(tmp_path / "in" / "rejected.json", json.dumps(_body({"bogus": 1})))
+    out = tmp_path / "out"
+    _write(out / "good.error.json", "{}")
+    _write(out / "rejected.json", "{}")
+
+    rc = run_batch.main([str(tmp_path / "in"), "--out-dir", str(out), "--max-attempts", "1", "--no-rate-limit"])
+
+    assert rc == 2
+    assert sorted(p.name for p in out.iterdir()) == ["good.json", "rejected.error.json"]
+    assert json.loads((out / "good.json").read_text(encoding="utf-8")) == {"results": [{"n": 1}]}
+    error = json.loads((out / "rejected.error.json").read_text(encoding="utf-8"))
+    assert error["status"] == 400 and error["response"] == {"message": "unknown stage bogus"}
+    assert error["path"] == str(tmp_path / "in" / "rejected.json")
+
+
+def test_jsonl_records(tmp_path: Path, endpoint, capsys) -> None:
+    good = _write(tmp_path / "good.dsl", GOOD_DSL)
+    rejected = _write(tmp_path / "rejected.json", json.dumps(_body({"bogus": 1})))
+    sink = tmp_path / "results.jsonl"
+
+    rc = run_batch.main([good, rejected, "--jsonl", str(sink), "--max-attempts", "1", "--no-rate-limit"])
+
+    assert rc == 2
+    records = {r["path"]: r for r in map(json.loads, sink.read_text(encoding="utf-8").splitlines())}
+    assert records[good]["ok"] is True and records[good]["attempts"] == 1
+    assert records[good]["response"] == {"results": [{"n": 1}]}
+    assert records[rejected]["ok"] is False and records[rejected]["status"] == 400
+    assert records[rejected]["error"] == "HTTP 400 from Pendo"
+    assert all(isinstance(r["latency_ms"], float) for r in records.values())
+    assert "Total: 2  Passed: 1  Failed: 1" in capsys.readouterr().err
+
+
+def test_out_dir_rejects_colliding_stems(tmp_path: Path, endpoint, stand_in_server) -> None:
+    a = _write(tmp_path / "a" / "q.dsl", GOOD_DSL)
+    b = _write(tmp_path / "b" / "q.json", json.dumps(_body()))
+
+    with pytest.raises(SystemExit) as exc:
+        run_batch.main([a, b, "--out-dir", str(tmp_path / "out"), "--no-rate-limit"])
+
+    assert a in str(exc.value) and b in str(exc.value)
+    assert stand_in_server.requests == []
+
+
+def test_queries_are_validated_before_sending(tmp_path: Path, endpoint, stand_in_server) -> None:
+    invalid = _write(tmp_path / "invalid.json", json.dumps(_body({})))
+
+    [result] = run_batch.run_batch([invalid], endpoint=endpoint)
+
+    assert result.error == "pipeline[1] must be a non-empty object"
+    assert stand_in_server.requests == []
+
+
+def test_rejected_queries_are_rewritten_and_retried(endpoint, stand_in_server) -> None:
+    def reject_now(payload, headers):
+        if "now()" in json.dumps(payload):
+            return 400, {}, {"message": "timeSeries.first must be a number, got now()"}
+        return 200, {}, {"results": []}
+
+    stand_in_server.respond = reject_now
+    url, api_key, header = endpoint
+    body = _body({"timeSeries": {"period": "dayRange", "first": "now()", "count": -7}})
+
+    resp, attempts = run_agg.run_aggregation(body, url=url, api_key=api_key, api_key_header=header)
+
+    assert (resp, attempts) == ({"results": []}, 2)
+    first = stand_in_server.requests[1]["request"]["pipeline"][1]["timeSeries"]["first"]
+    assert isinstance(first, int)
+
+
+def test_load_body_compiles_dsl_and_rejects_non_object_json() -> None:
+    body = run_agg.load_body("q.dsl", GOOD_DSL)
+    assert body["request"]["pipeline"][-1] == {"limit": 5}
+
+    with pytest.raises(ValueError, match="aggregation body object"):
+        run_agg.load_body("q.json", "[]")
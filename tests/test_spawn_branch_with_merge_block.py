@@ -29,3 +29,28 @@ endbranch
     assert branch0[0]["merge"]["pipeline"][0] == {"source": {"visitors": {}}}
     assert branch0[0]["merge"]["pipeline"][1] == {"identified": "visitorId"}
     assert branch0[1] == {"limit": 1}
+
+
+def test_merge_block_can_contain_fork_block_inside_spawn_branch() -> None:
+    dsl = """\
+PIPELINE
+| spawn
+branch
+|| merge fields [visitorId]
+PIPELINE
+| fork
+branch
+|| limit 2
+endbranch
+| endfork
+endmerge
+|| limit 1
+endbranch
+| endspawn
+"""
+
+    body = compile_to_pendo_aggregation(parse(dsl))
+    branch0 = body["request"]["pipeline"][0]["spawn"][0]
+
+    assert branch0[0]["merge"]["pipeline"] == [{"fork": [[{"limit": 2}]]}]
+    assert branch0[1] == {"limit": 1}
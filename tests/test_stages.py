@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import io
+import json
+
+import pytest
+
+from aggdsl import (
+    compile_to_pendo_aggregation,
+    decompile_json_stream,
+    decompile_pendo_aggregation_to_dsl,
+    parse,
+    register_stage,
+    unregister_stage,
+)
+from aggdsl.compiler import CompileError
+from aggdsl.parser import DslParseError
+from aggdsl.stages import StageRegistrationError
+
+
+@pytest.fixture
+def sample_stage():
+    # `| sample 10` <-> {"sample": {"percent": 10}}
+    register_stage(
+        "sample",
+        parse=lambda text: int(text),
+        compile=lambda payload: {"percent": payload},
+        decompile=lambda value: str(value["percent"]) if isinstance(value, dict) else None,
+    )
+    yield
+    unregister_stage("sample")
+
+
+def test_registered_stage_round_trips(sample_stage) -> None:
+    dsl = "PIPELINE\n| filter x > 1\n| SAMPLE 10\n| limit 5\n"
+    body = compile_to_pendo_aggregation(parse(dsl))
+    assert body["request"]["pipeline"] == [{"filter": "x > 1"}, {"sample": {"percent": 10}}, {"limit": 5}]
+
+    dsl_out = decompile_pendo_aggregation_to_dsl(body)
+    assert "| sample 10\n" in dsl_out
+    assert compile_to_pendo_aggregation(parse(dsl_out)) == body
+
+    out = io.StringIO()
+    decompile_json_stream(io.StringIO(json.dumps(body)), out)
+    assert out.getvalue() == dsl_out
+
+    # A value the decompiler declines stays raw.
+    assert decompile_pendo_aggregation_to_dsl([{"sample": 3}]) == 'PIPELINE\n| raw {"sample":3}\n'
+
+
+def test_unregistered_stage_is_unknown_again() -> None:
+    register_stage("sample", parse=int)
+    unregister_stage("sample")
+    with pytest.raises(DslParseError, match="Unknown stage: sample 10"):
+        parse("PIPELINE\n| sample 10\n")
+
+
+def test_stage_without_compiler_fails_to_compile() -> None:
+    register_stage("sample", parse=int)
+    try:
+        with pytest.raises(CompileError, match="Unknown stage kind: sample"):
+            compile_to_pendo_aggregation(parse("PIPELINE\n| sample 10\n"))
+    finally:
+        unregister_stage("sample")
+
+
+@pytest.mark.parametrize(
+    "kind, message",
+    [
+        ("Limit", "Stage kind 'Limit' is built in"),
+        ("endbranch", "Stage kind 'endbranch' is built in"),
+        ("two words", "Invalid stage kind: 'two words'"),
+    ],
+)
+def test_register_rejects_builtin_and_invalid_kinds(kind: str, message: str) -> None:
+    with pytest.raises(StageRegistrationError) as e:
+        register_stage(kind, parse=str)
+    assert str(e.value) == message
+
+
+def test_register_twice_and_unregister_unknown(sample_stage) -> None:
+    with pytest.raises(StageRegistrationError, match="already registered"):
+        register_stage("Sample")
+    with pytest.raises(StageRegistrationError, match="is not registered"):
+        unregister_stage("filter")
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import pytest
+
+from aggdsl import compile_template, compile_to_pendo_aggregation, parse
+from aggdsl.template import TemplateError
+
+
+DSL = """\
+FROM event([source=pageEvents,appId={{APP_ID}},blacklist="apply"])
+TIMESERIES period=dayRange first=now() count=-7
+| filter appId == {{APP_ID}} && pageId == "{{PAGE}}"
+| merge fields [visitorId]
+  FROM event([source=visitors,appId={{APP_ID}}])
+  TIMESERIES period=dayRange first=now() count=-7
+endmerge
+| limit 10
+"""
+
+
+def _expected(app_id: str, page: str, now_ms: int | None) -> dict:
+    dsl = DSL.replace("{{APP_ID}}", app_id).replace("{{PAGE}}", page)
+    return compile_to_pendo_aggregation(parse(dsl), now_ms=now_ms)
+
+
+def test_bind_matches_compiling_substituted_text() -> None:
+    template = compile_template(DSL)
+    assert template.placeholders == {"APP_ID", "PAGE"}
+
+    body = template.bind({"APP_ID": 123, "PAGE": "home"}, now_ms=1700000000000)
+    assert body == _expected("123", "home", 1700000000000)
+
+    body = template.bind({"APP_ID": 7, "PAGE": "x"})
+    assert body == _expected("7", "x", None)
+
+
+def test_bind_does_not_mutate_template_or_previous_results() -> None:
+    template = compile_template(DSL)
+    first = template.bind({"APP_ID": 1, "PAGE": "a"}, now_ms=1)
+    second = template.bind({"APP_ID": 2, "PAGE": "b"}, now_ms=2)
+
+    assert first == _expected("1", "a", 1)
+    assert second == _expected("2", "b", 2)
+    # Unparameterized stages are shared rather than copied.
+    assert first["request"]["pipeline"][-1] is second["request"]["pipeline"][-1]
+
+
+def test_bind_rejects_missing_and_unknown_params() -> None:
+    template = compile_template(DSL)
+    with pytest.raises(TemplateError, match="missing PAGE; unknown OTHER"):
+        template.bind({"APP_ID": 1, "OTHER": 2})
+
+
+def test_template_without_placeholders() -> None:
+    template = compile_template("FROM event([source=pageEvents,appId=1])\n| limit 1\n")
+    assert template.placeholders == frozenset()
+    assert template.bind() == compile_to_pendo_aggregation(
+        parse("FROM event([source=pageEvents,appId=1])\n| limit 1\n")
+    )
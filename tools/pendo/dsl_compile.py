@@ -7,11 +7,16 @@ import time
 from typing import Any
 
 from aggdsl import compile_to_pendo_aggregation, parse
+from aggdsl.cache import DiskCache
 
 
-def compile_dsl_text(dsl: str, *, resolve_now: bool) -> dict[str, Any]:
-    q = parse(dsl)
+def compile_dsl_text(
+    dsl: str, *, resolve_now: bool, cache: DiskCache | None = None
+) -> dict[str, Any]:
     now_ms = int(time.time() * 1000) if resolve_now else None
+    if cache is not None:
+        return cache.compile(dsl, now_ms=now_ms)
+    q = parse(dsl)
     return compile_to_pendo_aggregation(q, now_ms=now_ms)
 
 
@@ -25,6 +30,16 @@ def main(argv: list[str] | None = None) -> int:
         help="Do not resolve now() to epoch-ms (leave as 'now()' in output)",
     )
     p.add_argument("--pretty", action="store_true", help="Pretty-print JSON")
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the on-disk compile cache",
+    )
+    p.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Compile cache directory (default: $AGGDSL_CACHE_DIR or ~/.cache/aggdsl)",
+    )
     args = p.parse_args(argv)
 
     if not args.stdin and not args.path:
@@ -38,7 +53,8 @@ def main(argv: list[str] | None = None) -> int:
             with open(args.path, "r", encoding="utf-8") as f:
                 dsl = f.read()
 
-        body = compile_dsl_text(dsl, resolve_now=not args.keep_now)
+        cache = None if args.no_cache else DiskCache(args.cache_dir)
+        body = compile_dsl_text(dsl, resolve_now=not args.keep_now, cache=cache)
 
         if args.pretty:
             json.dump(body, sys.stdout, indent=2, ensure_ascii=False)
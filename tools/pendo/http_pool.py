@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import http.client
+import json
+import socket
+import threading
+import urllib.parse
+import urllib.request
+from typing import Any, Tuple
+
+# Failures that mean a kept-alive connection was closed by the server while idle.
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class HttpPool:
+    """Keep-alive HTTP(S) connections, reused across requests to the same host.
+
+    Up to `maxsize` idle connections are kept per (scheme, host, port); more may be open
+    at once (one per concurrent request), but only `maxsize` go back to the pool.
+    `connect_timeout` bounds the TCP connect and TLS handshake, `timeout` each read.
+    Proxies from the environment (`HTTPS_PROXY`, `NO_PROXY`, ...) are honored like
+    `urllib.request` does. Thread-safe.
+    """
+
+    def __init__(self, *, maxsize: int = 4, timeout: float = 60.0, connect_timeout: float = 10.0) -> None:
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        # Connections opened so far, for tests and benchmarks.
+        self.connections_opened = 0
+
+    def request(
+        self, method: str, url: str, *, body: bytes | None = None, headers: dict[str, str] | None = None
+    ) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        """Send one request and return (status, response headers, response body)."""
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Unsupported URL: {url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+
+        conn = self._checkout(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(key)
+            try:
+                target = url if getattr(conn, "_via_http_proxy", False) else path
+                conn.request(method, target, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except _STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped the idle connection; aggregation requests are
+                # read-only, so sending again on a new connection is safe.
+                conn, reused = None, False
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return resp.status, resp.headers, data
+
+    def post_json(
+        self, url: str, payload: Any, *, headers: dict[str, str] | None = None
+    ) -> Tuple[int, http.client.HTTPMessage, Any]:
+        """POST `payload` as JSON; returns (status, response headers, parsed JSON or the
+        text if not JSON)."""
+        all_headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        all_headers.update(headers or {})
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        status, resp_headers, raw = self.request("POST", url, body=data, headers=all_headers)
+        text = raw.decode("utf-8", errors="replace")
+        try:
+            return status, resp_headers, json.loads(text)
+        except ValueError:
+            return status, resp_headers, text
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def __enter__(self) -> HttpPool:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def _checkout(self, key: tuple[str, str, int]) -> http.client.HTTPConnection | None:
+        with self._lock:
+            conns = self._idle.get(key)
+            # Most recently used first: it is the least likely to have timed out.
+            return conns.pop() if conns else None
+
+    def _checkin(self, key: tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, key: tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        proxy = urllib.request.getproxies().get(scheme)
+        if proxy and not urllib.request.proxy_bypass(host):
+            proxy_parts = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            proxy_port = proxy_parts.port or 80
+            if scheme == "https":
+                conn = cls(proxy_parts.hostname, proxy_port, timeout=self.connect_timeout)
+                conn.set_tunnel(host, port)
+            else:
+                # Plain HTTP goes to the proxy with the absolute URL as the target.
+                conn = cls(proxy_parts.hostname, proxy_port, timeout=self.connect_timeout)
+                conn._via_http_proxy = True  # type: ignore[attr-defined]
+        else:
+            conn = cls(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        if conn.sock is not None:
+            conn.sock.settimeout(self.timeout)
+            # http.client sends headers and body in separate writes; without this, a
+            # reused connection waits on the peer's delayed ACK before sending the body.
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+
+_default_pool: HttpPool | None = None
+_default_lock = threading.Lock()
+
+
+def default_pool() -> HttpPool:
+    """The process-wide pool shared by `run_agg` queries."""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = HttpPool()
+        return _default_pool
+
+
+def configure_default_pool(*, maxsize: int = 4, timeout: float = 60.0, connect_timeout: float = 10.0) -> HttpPool:
+    """Replace the process-wide pool with one using these settings."""
+    global _default_pool
+    with _default_lock:
+        old, _default_pool = _default_pool, HttpPool(
+            maxsize=maxsize, timeout=timeout, connect_timeout=connect_timeout
+        )
+    if old is not None:
+        old.close()
+    return _default_pool
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import contextlib
+import email.utils
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from aggdsl.cache import default_cache_dir
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore[assignment]
+    import msvcrt
+
+# After a 429 the refill rate drops by this factor (never below _MIN_RATE_FRACTION
+# of `rate`) and then recovers linearly back to `rate` over `recovery` seconds.
+_BACKOFF_FACTOR = 0.5
+_MIN_RATE_FRACTION = 0.05
+# Pause after a 429 without a usable Retry-After header.
+_DEFAULT_RETRY_AFTER = 1.0
+
+
+class RateLimiter:
+    """Token bucket shared by every thread and process that uses the same state file.
+
+    Each request takes one token; tokens refill at `rate` per second up to `burst`.
+    The bucket lives in a small JSON file guarded by an exclusive file lock, so
+    concurrent `run_agg` and `run_batch` processes on one host draw from one budget
+    (they should be started with the same `rate` and `burst`).
+
+    If the state file cannot be created, locked, read or written, a warning is printed
+    once and the bucket is kept in this process from then on.
+
+    `throttled()` records a 429: it empties the bucket, holds every caller until the
+    Retry-After has passed, and halves the refill rate; the rate then
+    recovers to `rate` over `recovery` seconds.
+    """
+
+    def __init__(self, path: str | os.PathLike[str], *, rate: float = 5.0, burst: int = 10, recovery: float = 20.0):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        if burst < 1:
+            raise ValueError("burst must be >= 1")
+        self.path = Path(path)
+        self.rate = rate
+        self.burst = burst
+        self.recovery = recovery
+        self._lock = threading.Lock()
+        # The bucket, once the state file has turned out to be unusable.
+        self._local: dict[str, Any] | None = None
+
+    def acquire(self) -> float:
+        """Wait until a request may be sent; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._state() as state:
+                wait = self._take(state, time.time())
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def throttled(self, retry_after: float | None = None) -> None:
+        """Record a 429 response, with its Retry-After in seconds if it had one."""
+        with self._state() as state:
+            now = time.time()
+            pause = _DEFAULT_RETRY_AFTER if retry_after is None else max(0.0, retry_after)
+            if now >= state["blocked_until"]:
+                # Requests already in flight when the first 429 arrived get 429s too;
+                # slow down once per pause, not once per response.
+                state["learned_rate"] = max(self.rate * _MIN_RATE_FRACTION, self._rate_at(state, now) * _BACKOFF_FACTOR)
+                state["throttled_at"] = now
+            state["tokens"] = 0.0
+            state["updated"] = now
+            state["blocked_until"] = max(state["blocked_until"], now + pause)
+
+    def current_rate(self) -> float:
+        """The refill rate in effect now, after any slowdown learned from 429s."""
+        with self._state() as state:
+            return self._rate_at(state, time.time())
+
+    def _take(self, state: dict[str, Any], now: float) -> float:
+        # Takes a token if one is available and returns 0; otherwise returns how long
+        # to wait before trying again.
+        rate = self._rate_at(state, now)
+        state["tokens"] = min(float(self.burst), state["tokens"] + max(0.0, now - state["updated"]) * rate)
+        state["updated"] = now
+        if now < state["blocked_until"]:
+            return state["blocked_until"] - now
+        if state["tokens"] >= 1:
+            state["tokens"] -= 1
+            return 0.0
+        return (1 - state["tokens"]) / rate
+
+    def _rate_at(self, state: dict[str, Any], now: float) -> float:
+        learned = state["learned_rate"]
+        if learned is None:
+            return self.rate
+        recovered = learned + max(0.0, now - state["throttled_at"]) * self.rate / self.recovery
+        return min(self.rate, recovered)
+
+    @contextlib.contextmanager
+    def _state(self) -> Iterator[dict[str, Any]]:
+        # Holds the thread lock and an exclusive lock on the file while the caller
+        # reads and updates the state, then writes it back. If the file cannot be
+        # used, the bucket is kept in this process instead (see `_fall_back`).
+        with self._lock:
+            opened = None if self._local is not None else self._open_locked()
+            if opened is None:
+                assert self._local is not None
+                yield self._local
+                return
+            f, state = opened
+            try:
+                yield state
+                try:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state).encode("utf-8"))
+                    f.flush()
+                except OSError as e:
+                    self._fall_back(e, state)
+            finally:
+                _unlock_file(f)
+                f.close()
+
+    def _open_locked(self) -> tuple[Any, dict[str, Any]] | None:
+        f = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            f = open(self.path, "a+b")
+            _lock_file(f)
+            f.seek(0)
+            return f, self._load(f.read())
+        except OSError as e:
+            if f is not None:
+                f.close()
+            self._fall_back(e)
+            return None
+
+    def _fall_back(self, error: OSError, state: dict[str, Any] | None = None) -> None:
+        # Like the compile cache, an unusable state file must not fail the query: limit
+        # this process alone from now on.
+        self._local = state if state is not None else self._load(b"")
+        print(
+            f"warning: rate limiter state {self.path} is unavailable ({error}); "
+            "limiting this process only",
+            file=sys.stderr,
+        )
+
+    def _load(self, raw: bytes) -> dict[str, Any]:
+        state: dict[str, Any] = {
+            "tokens": float(self.burst),
+            "updated": time.time(),
+            "blocked_until": 0.0,
+            "learned_rate": None,
+            "throttled_at": 0.0,
+        }
+        try:
+            loaded = json.loads(raw) if raw else {}
+        except ValueError:
+            # A torn or foreign file: start from a full bucket.
+            loaded = {}
+        if isinstance(loaded, dict):
+            state.update((k, v) for k, v in loaded.items() if k in state)
+        return state
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def default_state_path(api_key: str) -> Path:
+    """Where processes using `api_key` share their bucket (Pendo limits per key)."""
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return default_cache_dir() / f"pendo-ratelimit-{digest}.json"
+
+
+def _lock_file(f: Any) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:  # pragma: no cover
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f: Any) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:  # pragma: no cover
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
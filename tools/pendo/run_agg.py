@@ -5,29 +5,38 @@ import json
 import os
 import sys
 import time
-import urllib.error
-import urllib.request
 from typing import Any, Tuple
 
 try:
     # Preferred usage: `python -m tools.pendo.run_agg ...`
     from .dsl_compile import compile_dsl_text
     from .env import load_dotenv
+    from .http_pool import HttpPool, configure_default_pool, default_pool
+    from .rate_limit import RateLimiter, default_state_path, parse_retry_after
     from .rewrite import rewrite_on_error
     from .validate import validate_aggregation_body
 except ImportError:  # pragma: no cover
     # Fallback for direct execution: `python tools/pendo/run_agg.py ...`
     from tools.pendo.dsl_compile import compile_dsl_text
     from tools.pendo.env import load_dotenv
+    from tools.pendo.http_pool import HttpPool, configure_default_pool, default_pool
+    from tools.pendo.rate_limit import RateLimiter, default_state_path, parse_retry_after
     from tools.pendo.rewrite import rewrite_on_error
     from tools.pendo.validate import validate_aggregation_body
 
 
 class PendoRequestError(RuntimeError):
-    def __init__(self, message: str, *, status: int | None = None, body: Any | None = None):
+    def __init__(
+        self, message: str, *, status: int | None = None, body: Any | None = None, retry_after: float | None = None
+    ):
         super().__init__(message)
         self.status = status
         self.body = body
+        self.retry_after = retry_after
+
+
+# A 429 is resent without spending an attempt, at most this many times per query.
+_MAX_THROTTLED_RETRIES = 10
 
 
 def _env(name: str, *, required: bool = True, default: str | None = None) -> str:
@@ -75,43 +84,37 @@ def _detect_format(path: str | None, text: str) -> str:
     return "dsl"
 
 
-def _http_post_json(url: str, api_key: str, api_key_header: str, payload: dict[str, Any]) -> Tuple[int, Any]:
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    req.add_header("Accept", "application/json")
-    req.add_header(api_key_header, api_key)
-
-    try:
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            raw = resp.read().decode("utf-8", errors="replace")
-            try:
-                return resp.status, json.loads(raw)
-            except Exception:
-                return resp.status, raw
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode("utf-8", errors="replace")
-        try:
-            parsed = json.loads(raw)
-        except Exception:
-            parsed = raw
+def _http_post_json(
+    url: str, api_key: str, api_key_header: str, payload: dict[str, Any], *, pool: HttpPool | None = None
+) -> Tuple[int, Any]:
+    # Connections are kept alive in `pool` (default: the process-wide pool), so retries
+    # and later queries to the same host skip the TCP and TLS handshakes.
+    pool = pool or default_pool()
+    status, headers, parsed = pool.post_json(url, payload, headers={api_key_header: api_key})
+    if status >= 400:
         raise PendoRequestError(
-            f"HTTP {e.code} from Pendo",
-            status=e.code,
+            f"HTTP {status} from Pendo",
+            status=status,
             body=parsed,
+            retry_after=parse_retry_after(headers.get("Retry-After")),
         )
+    return status, parsed
 
 
-def main(argv: list[str] | None = None) -> int:
-    p = argparse.ArgumentParser(description="Run a Pendo Aggregation request (DSL or JSON) and print the response JSON")
-    p.add_argument("path", nargs="?", help="Path to .dsl or .json")
-    p.add_argument("--stdin", action="store_true", help="Read DSL/JSON from stdin")
-    p.add_argument("--format", choices=["auto", "dsl", "json"], default="auto")
-    p.add_argument("--max-attempts", type=int, default=5)
-    p.add_argument("--keep-now", action="store_true", help="Do not resolve now() during DSL compilation")
-    p.add_argument("--pretty", action="store_true", help="Pretty-print response JSON")
-    args = p.parse_args(argv)
+def load_body(path: str | None, text: str, *, fmt: str = "auto", resolve_now: bool = True) -> dict[str, Any]:
+    """The aggregation body for a DSL or JSON input (`fmt` "auto" detects it)."""
+    if fmt == "auto":
+        fmt = _detect_format(path, text)
+    if fmt == "dsl":
+        return compile_dsl_text(text, resolve_now=resolve_now)
+    loaded = _load_json_from_text(text)
+    if not isinstance(loaded, dict):
+        raise ValueError("JSON input must be an aggregation body object")
+    return loaded
+
 
+def endpoint_from_env() -> Tuple[str, str, str]:
+    """(url, api_key, api_key_header) from the environment, or from `.env` if unset."""
     # Helpful for local usage in VS Code terminals: if env vars aren't set,
     # allow loading them from a local .env file.
     if os.getenv("PENDO_API_KEY") in (None, "") and os.getenv("PENDO_INTEGRATION_KEY") in (None, ""):
@@ -122,60 +125,155 @@ def main(argv: list[str] | None = None) -> int:
     # Support either name (people commonly call this an integration key).
     api_key = _env_any(["PENDO_API_KEY", "PENDO_INTEGRATION_KEY"])
     api_key_header = _env("PENDO_API_KEY_HEADER", required=False, default="x-pendo-integration-key")
+    return url, api_key, api_key_header
 
-    text = _load_text(args.path, use_stdin=args.stdin)
-    fmt = args.format if args.format != "auto" else _detect_format(args.path, text)
 
-    body: dict[str, Any]
-    if fmt == "dsl":
-        body = compile_dsl_text(text, resolve_now=not args.keep_now)
-    else:
-        loaded = _load_json_from_text(text)
-        if not isinstance(loaded, dict):
-            print("error: JSON input must be an aggregation body object", file=sys.stderr)
-            return 2
-        body = loaded
+def run_aggregation(
+    body: dict[str, Any],
+    *,
+    url: str,
+    api_key: str,
+    api_key_header: str,
+    max_attempts: int = 5,
+    pool: HttpPool | None = None,
+    limiter: RateLimiter | None = None,
+) -> Tuple[Any, int]:
+    """Validate and send `body`, rewriting and retrying on errors from Pendo.
 
-    # Retry build+send up to max attempts.
+    Returns (response, attempts used). Raises the last `PendoRequestError` once
+    `max_attempts` are used up; validation and connection errors are not retried.
+    Each send first waits for `limiter`, and a 429 is reported to it and resent
+    as is, without using up an attempt.
+    """
     current = body
-    last_err: PendoRequestError | None = None
-
-    for attempt in range(1, max(1, args.max_attempts) + 1):
+    attempt = 1
+    throttles = 0
+    while True:
+        validate_aggregation_body(current)
+        if limiter is not None:
+            limiter.acquire()
         try:
-            validate_aggregation_body(current)
-            _status, resp = _http_post_json(url, api_key, api_key_header, current)
-
-            if args.pretty:
-                json.dump(resp, sys.stdout, indent=2, ensure_ascii=False)
-            else:
-                json.dump(resp, sys.stdout, ensure_ascii=False)
-            sys.stdout.write("\n")
-            return 0
+            _status, resp = _http_post_json(url, api_key, api_key_header, current, pool=pool)
+            return resp, attempt
         except PendoRequestError as e:
-            last_err = e
+            if e.status == 429 and throttles < _MAX_THROTTLED_RETRIES:
+                # Rate limited: the body is fine, so wait and send it again.
+                throttles += 1
+                if limiter is not None:
+                    limiter.throttled(e.retry_after)
+                else:
+                    time.sleep(e.retry_after if e.retry_after is not None else min(0.5 * throttles, 2.0))
+                continue
+            if attempt >= max_attempts:
+                raise
             err_text = json.dumps(e.body, ensure_ascii=False) if e.body is not None else str(e)
-            if attempt >= args.max_attempts:
-                break
             current = rewrite_on_error(current, attempt=attempt, error_text=err_text)
             # small backoff for transient issues
             time.sleep(min(0.5 * attempt, 2.0))
-        except Exception as e:
-            print(f"error: {e}", file=sys.stderr)
-            return 2
-
-    if last_err is not None:
-        # Provide the last error body for the agent/user to fix the DSL.
-        print(f"error: {last_err}", file=sys.stderr)
-        if last_err.status is not None:
-            print(f"status: {last_err.status}", file=sys.stderr)
-        if last_err.body is not None:
-            print("response:", file=sys.stderr)
-            json.dump(last_err.body, sys.stderr, indent=2, ensure_ascii=False)
-            sys.stderr.write("\n")
+        attempt += 1
+
+
+def add_pool_arguments(p: argparse.ArgumentParser, *, pool_size: int | None = 4, pool_size_default: str = "4") -> None:
+    p.add_argument(
+        "--pool-size",
+        type=int,
+        default=pool_size,
+        help=f"Idle keep-alive connections kept per host (default: {pool_size_default})",
+    )
+    p.add_argument("--connect-timeout", type=float, default=10.0, help="Seconds allowed for connecting (default: 10)")
+    p.add_argument("--timeout", type=float, default=60.0, help="Seconds allowed per read (default: 60)")
+
+
+def configure_pool_from_args(p: argparse.ArgumentParser, args: argparse.Namespace) -> HttpPool:
+    if args.pool_size < 1:
+        p.error("--pool-size must be >= 1")
+    return configure_default_pool(maxsize=args.pool_size, timeout=args.timeout, connect_timeout=args.connect_timeout)
+
+
+def add_rate_limit_arguments(p: argparse.ArgumentParser) -> None:
+    p.add_argument(
+        "--rate",
+        type=float,
+        default=5.0,
+        help="Requests per second shared by all processes using this API key (default: 5)",
+    )
+    p.add_argument("--burst", type=int, default=10, help="Requests allowed at once after an idle period (default: 10)")
+    p.add_argument(
+        "--rate-limit-file",
+        default=None,
+        help="Shared rate limiter state (default: one file per API key in the aggdsl cache directory)",
+    )
+    p.add_argument("--no-rate-limit", action="store_true", help="Do not wait for the shared rate limiter")
+
+
+def rate_limiter_from_args(p: argparse.ArgumentParser, args: argparse.Namespace, api_key: str) -> RateLimiter | None:
+    if args.no_rate_limit:
+        return None
+    if args.rate <= 0:
+        p.error("--rate must be > 0")
+    if args.burst < 1:
+        p.error("--burst must be >= 1")
+    path = args.rate_limit_file or default_state_path(api_key)
+    return RateLimiter(path, rate=args.rate, burst=args.burst)
+
+
+def _print_request_error(err: PendoRequestError) -> None:
+    # Provide the last error body for the agent/user to fix the DSL.
+    print(f"error: {err}", file=sys.stderr)
+    if err.status is not None:
+        print(f"status: {err.status}", file=sys.stderr)
+    if err.body is not None:
+        print("response:", file=sys.stderr)
+        json.dump(err.body, sys.stderr, indent=2, ensure_ascii=False)
+        sys.stderr.write("\n")
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Run a Pendo Aggregation request (DSL or JSON) and print the response JSON")
+    p.add_argument("path", nargs="?", help="Path to .dsl or .json")
+    p.add_argument("--stdin", action="store_true", help="Read DSL/JSON from stdin")
+    p.add_argument("--format", choices=["auto", "dsl", "json"], default="auto")
+    p.add_argument("--max-attempts", type=int, default=5)
+    p.add_argument("--keep-now", action="store_true", help="Do not resolve now() during DSL compilation")
+    p.add_argument("--pretty", action="store_true", help="Pretty-print response JSON")
+    add_pool_arguments(p)
+    add_rate_limit_arguments(p)
+    args = p.parse_args(argv)
+    configure_pool_from_args(p, args)
+
+    url, api_key, api_key_header = endpoint_from_env()
+    limiter = rate_limiter_from_args(p, args, api_key)
+
+    text = _load_text(args.path, use_stdin=args.stdin)
+    try:
+        body = load_body(args.path, text, fmt=args.format, resolve_now=not args.keep_now)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
         return 2
 
-    print("error: request failed", file=sys.stderr)
-    return 2
+    # Retry build+send up to max attempts.
+    try:
+        resp, _attempts = run_aggregation(
+            body,
+            url=url,
+            api_key=api_key,
+            api_key_header=api_key_header,
+            max_attempts=args.max_attempts,
+            limiter=limiter,
+        )
+    except PendoRequestError as e:
+        _print_request_error(e)
+        return 2
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    if args.pretty:
+        json.dump(resp, sys.stdout, indent=2, ensure_ascii=False)
+    else:
+        json.dump(resp, sys.stdout, ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0
 
 
 if __name__ == "__main__":
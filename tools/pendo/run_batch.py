@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator, TextIO
+
+try:
+    # Preferred usage: `python -m tools.pendo.run_batch ...`
+    from .run_agg import (
+        PendoRequestError,
+        add_pool_arguments,
+        add_rate_limit_arguments,
+        configure_pool_from_args,
+        endpoint_from_env,
+        load_body,
+        rate_limiter_from_args,
+        run_aggregation,
+    )
+    from .rate_limit import RateLimiter
+except ImportError:  # pragma: no cover
+    # Fallback for direct execution: `python tools/pendo/run_batch.py ...`
+    from tools.pendo.run_agg import (
+        PendoRequestError,
+        add_pool_arguments,
+        add_rate_limit_arguments,
+        configure_pool_from_args,
+        endpoint_from_env,
+        load_body,
+        rate_limiter_from_args,
+        run_aggregation,
+    )
+    from tools.pendo.rate_limit import RateLimiter
+
+
+@dataclass(frozen=True, slots=True)
+class QueryResult:
+    path: str
+    latency_ms: float
+    attempts: int = 0
+    response: Any = None
+    error: str | None = None
+    status: int | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_record(self) -> dict[str, Any]:
+        record: dict[str, Any] = {"path": self.path, "ok": self.ok, "latency_ms": round(self.latency_ms, 1)}
+        if self.ok:
+            record["attempts"] = self.attempts
+        else:
+            record["error"] = self.error
+            if self.status is not None:
+                record["status"] = self.status
+        record["response"] = self.response
+        return record
+
+
+def _expand_inputs(paths: list[str]) -> list[str]:
+    # Directories contribute their *.dsl and *.json files, sorted.
+    out: list[str] = []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            out.extend(str(p) for p in sorted(path.iterdir()) if p.suffix.lower() in (".dsl", ".json") and p.is_file())
+        else:
+            out.append(raw)
+    return out
+
+
+def _run_one(
+    path: str,
+    *,
+    endpoint: tuple[str, str, str],
+    max_attempts: int,
+    resolve_now: bool,
+    limiter: RateLimiter | None,
+) -> QueryResult:
+    url, api_key, api_key_header = endpoint
+    t0 = time.perf_counter()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            body = load_body(path, f.read(), resolve_now=resolve_now)
+        resp, attempts = run_aggregation(
+            body,
+            url=url,
+            api_key=api_key,
+            api_key_header=api_key_header,
+            max_attempts=max_attempts,
+            limiter=limiter,
+        )
+    except PendoRequestError as e:
+        return QueryResult(path, (time.perf_counter() - t0) * 1000, error=str(e), status=e.status, response=e.body)
+    except Exception as e:
+        return QueryResult(path, (time.perf_counter() - t0) * 1000, error=str(e))
+    return QueryResult(path, (time.perf_counter() - t0) * 1000, attempts=attempts, response=resp)
+
+
+def run_batch(
+    paths: list[str],
+    *,
+    endpoint: tuple[str, str, str],
+    jobs: int = 8,
+    max_attempts: int = 5,
+    resolve_now: bool = True,
+    limiter: RateLimiter | None = None,
+) -> Iterator[QueryResult]:
+    """Run each DSL/JSON file in `paths` with up to `jobs` requests in flight.
+
+    Yields a `QueryResult` per file as it completes (not in input order). Each query
+    gets the same compile, validate and rewrite-and-retry handling as `run_agg`, and
+    every send waits for `limiter` if one is given.
+    """
+    ex = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        futures = [
+            ex.submit(
+                _run_one,
+                path,
+                endpoint=endpoint,
+                max_attempts=max_attempts,
+                resolve_now=resolve_now,
+                limiter=limiter,
+            )
+            for path in paths
+        ]
+        for fut in as_completed(futures):
+            yield fut.result()
+    finally:
+        # On Ctrl-C or an abandoned iterator, drop the queries not yet started.
+        ex.shutdown(cancel_futures=True)
+
+
+def _output_names(paths: list[str]) -> dict[str, str]:
+    # --out-dir names each result after its input file's stem; they must not collide.
+    by_stem: dict[str, str] = {}
+    for path in paths:
+        stem = Path(path).stem
+        if stem in by_stem:
+            raise SystemExit(f"error: {by_stem[stem]} and {path} would both write {stem}.json")
+        by_stem[stem] = path
+    return {path: stem for stem, path in by_stem.items()}
+
+
+def _write_result(out_dir: Path, stem: str, result: QueryResult, *, pretty: bool) -> None:
+    if result.ok:
+        target, data = out_dir / f"{stem}.json", result.response
+    else:
+        target, data = out_dir / f"{stem}.error.json", result.to_record()
+        # A stale result from an earlier run would look like a success.
+        (out_dir / f"{stem}.json").unlink(missing_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2 if pretty else None, ensure_ascii=False)
+        f.write("\n")
+    os.replace(tmp, target)
+    if result.ok:
+        (out_dir / f"{stem}.error.json").unlink(missing_ok=True)
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(
+        description="Run many Pendo Aggregation requests (DSL or JSON files) concurrently"
+    )
+    p.add_argument("paths", nargs="+", help=".dsl/.json files, or directories of them")
+    p.add_argument("-j", "--jobs", type=int, default=8, help="Requests in flight at once (default: 8)")
+    sink = p.add_mutually_exclusive_group(required=True)
+    sink.add_argument("--out-dir", help="Write each response to DIR/<name>.json (failures to <name>.error.json)")
+    sink.add_argument("--jsonl", help="Append one JSON record per query to this file ('-' for stdout)")
+    p.add_argument("--max-attempts", type=int, default=5)
+    p.add_argument("--keep-now", action="store_true", help="Do not resolve now() during DSL compilation")
+    p.add_argument("--pretty", action="store_true", help="Pretty-print the --out-dir files")
+    add_pool_arguments(p, pool_size=None, pool_size_default="--jobs")
+    add_rate_limit_arguments(p)
+    args = p.parse_args(argv)
+    if args.jobs < 1:
+        p.error("--jobs must be >= 1")
+    if args.pool_size is None:
+        args.pool_size = args.jobs
+    configure_pool_from_args(p, args)
+
+    endpoint = endpoint_from_env()
+    limiter = rate_limiter_from_args(p, args, endpoint[1])
+    paths = _expand_inputs(args.paths)
+    if not paths:
+        print("error: no .dsl or .json files found", file=sys.stderr)
+        return 2
+
+    out_dir: Path | None = None
+    names: dict[str, str] = {}
+    jsonl: TextIO | None = None
+    if args.out_dir:
+        names = _output_names(paths)
+        out_dir = Path(args.out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+    elif args.jsonl == "-":
+        jsonl = sys.stdout
+    else:
+        jsonl = open(args.jsonl, "a", encoding="utf-8")
+
+    latencies: list[float] = []
+    failed = 0
+    t0 = time.perf_counter()
+    try:
+        for result in run_batch(
+            paths,
+            endpoint=endpoint,
+            jobs=args.jobs,
+            max_attempts=args.max_attempts,
+            resolve_now=not args.keep_now,
+            limiter=limiter,
+        ):
+            latencies.append(result.latency_ms)
+            if out_dir is not None:
+                _write_result(out_dir, names[result.path], result, pretty=args.pretty)
+            else:
+                assert jsonl is not None
+                jsonl.write(json.dumps(result.to_record(), ensure_ascii=False) + "\n")
+                jsonl.flush()
+            if result.ok:
+                retried = f", {result.attempts} attempts" if result.attempts > 1 else ""
+                print(f"OK   {result.path} ({result.latency_ms:.0f} ms{retried})", file=sys.stderr)
+            else:
+                failed += 1
+                print(f"FAIL {result.path}: {result.error} ({result.latency_ms:.0f} ms)", file=sys.stderr)
+    finally:
+        if jsonl is not None and jsonl is not sys.stdout:
+            jsonl.close()
+    elapsed = time.perf_counter() - t0
+
+    total = len(latencies)
+    latencies.sort()
+    print(f"Total: {total}  Passed: {total - failed}  Failed: {failed}", file=sys.stderr)
+    print(
+        f"Latency: p50 {_percentile(latencies, 0.5):.0f} ms, p95 {_percentile(latencies, 0.95):.0f} ms, "
+        f"max {latencies[-1]:.0f} ms ({elapsed:.1f}s wall, {args.jobs} in flight)",
+        file=sys.stderr,
+    )
+    return 2 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
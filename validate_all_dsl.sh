@@ -1,40 +1,17 @@
 #!/bin/bash
 # Validate all DSL files in the given directory
 
-cd "$(dirname "$0")"
-
 if [ -z "$1" ]; then
-    echo "Usage: $0 <directory>"
+    echo "Usage: $0 <directory> [--jobs N]"
     exit 1
 fi
 
-total=0
-passed=0
-failed=0
-
 echo "Validating DSL files..."
 echo "========================"
 
-while IFS= read -r dsl_file; do
-    total=$((total + 1))
-    if python tools/pendo/dsl_compile.py "$dsl_file" --keep-now > /dev/null 2>&1; then
-        passed=$((passed + 1))
-        echo "✓ $dsl_file"
-    else
-        failed=$((failed + 1))
-        echo "✗ $dsl_file"
-        # Show the error
-        python tools/pendo/dsl_compile.py "$dsl_file" --keep-now 2>&1 | head -5
-    fi
-done < <(find "$1" -name "*.dsl" -type f | sort)
-
-echo ""
-echo "========================"
-echo "Total: $total"
-echo "Passed: $passed"
-echo "Failed: $failed"
-
-if [ $failed -eq 0 ]; then
+# One interpreter compiles every file (across worker processes) and prints a
+# per-file ok/FAIL line with the error, followed by the totals.
+if python -m aggdsl compile --check "$@"; then
     echo "✓ All DSL files are valid!"
     exit 0
 else